@@ -2,186 +2,216 @@ import os
 import sys
 import json
 import logging
+import argparse
+import numpy as np
 from collections import defaultdict
 
+from line_store import load_line_table, line_store_dir
+from util_tile_meta import tile_coords_to_pdf_bottom_left
+from overlay_shards import OverlayShardWriter, shard_dir_for, SHARD_BY_CHOICES
+from pipeline_artifacts import load_json
+
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s - %(levelname)s - %(message)s"
 )
 
-def assemble_overlay(plan_id, plan_dir, output_path):
+class TileIndex:
+    """
+    Per-page index of tile rectangles in bottom-left PDF coords, used to assign
+    items to tiles by position. Tiles overlap, so one item can land in several.
+    """
+
+    def __init__(self, tile_meta):
+        self.tiles = defaultdict(list)  # page_index -> [tile_info, ...] in tile_meta order
+        for tile_info in tile_meta:
+            self.tiles[tile_info.get("page_index")].append(tile_info)
+
+        self.rects = {
+            page_idx: np.array([
+                tile_coords_to_pdf_bottom_left(0, 0, t["tile_width"], t["tile_height"], t) for t in tiles
+            ], dtype=np.float64).reshape(-1, 4)
+            for page_idx, tiles in self.tiles.items()
+        }
+
+    def pages(self):
+        return list(self.tiles)
+
+    def assign(self, page_idx, boxes):
+        """
+        Returns an (N, T) boolean matrix: item n overlaps tile t of page_idx.
+        boxes is (N, 4) of x0, y0, x1, y1 (any corner order).
+        """
+        rects = self.rects.get(page_idx)
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        if rects is None or len(boxes) == 0:
+            return np.zeros((len(boxes), 0 if rects is None else len(rects)), dtype=bool)
+
+        x0 = np.minimum(boxes[:, 0], boxes[:, 2])[:, None]
+        x1 = np.maximum(boxes[:, 0], boxes[:, 2])[:, None]
+        y0 = np.minimum(boxes[:, 1], boxes[:, 3])[:, None]
+        y1 = np.maximum(boxes[:, 1], boxes[:, 3])[:, None]
+        return ((x0 <= rects[:, 2]) & (x1 >= rects[:, 0])
+                & (y0 <= rects[:, 3]) & (y1 >= rects[:, 1]))
+
+def group_by_page(entries):
+    pages = defaultdict(list)
+    for entry in entries:
+        if len(entry.get("bbox") or []) == 4:
+            pages[entry.get("page_index", 0)].append(entry)
+    return pages
+
+def load_json_if_present(path):
+    if not os.path.isfile(path):
+        return []
+    return load_json(path)
+
+def write_overlay_item(f, overlay, first):
+    """
+    Appends one tile overlay to an open JSON array, matching json.dump(..., indent=2).
+    """
+    text = json.dumps(overlay, indent=2)
+    f.write(("[\n" if first else ",\n") + "\n".join("  " + line for line in text.split("\n")))
+
+def assemble_overlay(plan_id, plan_dir, output_path, shard_by=None):
     """
     Aggregates tile metadata, text, lines, dimension data into a single JSON
     for each tile, ensuring we have a unified record ready for final embedding.
+    Items are assigned to every tile their page coordinates overlap (via TileIndex),
+    and tiles are written to output_path one page at a time.
 
     :param plan_id: Unique identifier (string) for this PDF plan.
     :param plan_dir: Directory containing intermediate JSON files (tile_meta.json, categorized_results.json, etc.).
     :param output_path: Path to write final_overlays.json.
+    :param shard_by: "page" or "tile" to also write compressed shards and a manifest to
+                     final_overlays.shards/ (read them with overlay_shards.open_overlays).
     """
 
-    # ---- 1) Load tile_meta.json ----
+    # ---- 1) Load tile_meta.json and build the tile index ----
     tile_meta_file = os.path.join(plan_dir, "tile_meta.json")
     if not os.path.isfile(tile_meta_file):
         logging.error(f"tile_meta.json not found at: {tile_meta_file}")
         return
 
-    with open(tile_meta_file, "r", encoding="utf-8") as f:
-        tile_meta = json.load(f)
-
-    # We'll store all final overlay entries in a dict keyed by (page_index, tile_filename)
-    # so we can easily merge data from other files.
-    overlay_map = {}
-
-    for tile_info in tile_meta:
-        page_idx = tile_info.get("page_index")
-        tile_fn = tile_info.get("tile_filename", "")
-        tile_key = (page_idx, tile_fn)
-
-        # example image path (adjust if needed)
-        # e.g. "C:/.../page_0/tile_3000_6000.png"
-        image_path = os.path.join(plan_dir, f"page_{page_idx}", tile_fn)
-
-        overlay_map[tile_key] = {
-            "planId": plan_id,
-            "pageIndex": page_idx,
-            "tileIndex": tile_info.get("tile_index"),
-            "imagePath": image_path,  # or any relative/absolute path
-            "pdfCoords": {
-                "x_start": tile_info.get("x_start"),
-                "y_start": tile_info.get("y_start"),
-                "zoom_factor": tile_info.get("zoom_factor"),
-                "tile_width": tile_info.get("tile_width"),
-                "tile_height": tile_info.get("tile_height"),
-            },
-            "overlayData": {
-                "textBlocks": [],
-                "dimensions": [],
-                "lines": [],
-                "isBlank": True  # we'll set to False if we find text or lines
-            }
-        }
+    tile_meta = load_json(tile_meta_file)
+    tile_index = TileIndex(tile_meta)
 
-    # ---- 2) Merge in text data from categorized_results.json (if present) ----
-    categorized_file = os.path.join(plan_dir, "categorized_results.json")
-    if os.path.isfile(categorized_file):
-        with open(categorized_file, "r", encoding="utf-8") as f:
-            categorized_results = json.load(f)
-
-        for entry in categorized_results:
-            image_path = entry.get("image_path")
-            if not image_path:
-                continue
-
-            # parse out page_idx + tile_filename from the path
-            # e.g. ".../page_0/tile_3000_6000.png"
-            page_idx, tile_fn = extract_page_tile(plan_dir, image_path)
-            tile_key = (page_idx, tile_fn)
-
-            if tile_key in overlay_map:
-                text_item = {
-                    "text": entry.get("text", ""),
-                    "bbox": entry.get("bbox", []),
-                    "confidence": entry.get("confidence", 1.0)
-                }
-                overlay_map[tile_key]["overlayData"]["textBlocks"].append(text_item)
-                # Mark tile as not blank
-                overlay_map[tile_key]["overlayData"]["isBlank"] = False
-
-    # ---- 3) Merge line data (line_detection_results.json) if present ----
+    # ---- 2) Text (categorized_results.json, incl. embedded text) and dimensions, by page ----
+    text_by_page = group_by_page(load_json_if_present(os.path.join(plan_dir, "categorized_results.json")))
+    dims_by_page = group_by_page(load_json_if_present(os.path.join(plan_dir, "linked_dimensions.json")))
+
+    # ---- 3) Lines, memory-mapped per page from the line store ----
     lines_file = os.path.join(plan_dir, "line_detection_results.json")
-    if os.path.isfile(lines_file):
-        with open(lines_file, "r", encoding="utf-8") as f:
-            line_data = json.load(f)
-
-        # line_data might be structured differently; adapt as needed
-        for line_entry in line_data:
-            image_path = line_entry.get("image_path")
-            if not image_path:
-                continue
-
-            page_idx, tile_fn = extract_page_tile(plan_dir, image_path)
-            tile_key = (page_idx, tile_fn)
-            if tile_key in overlay_map:
-                # example line structure: { "line": [[x1, y1], [x2, y2]], ...}
-                line_coords = line_entry.get("line", [])
-                if line_coords:
-                    overlay_map[tile_key]["overlayData"]["lines"].append(line_coords)
-                    overlay_map[tile_key]["overlayData"]["isBlank"] = False
-
-    # ---- 4) Merge dimension linking (linked_dimensions.json) if present ----
-    dim_file = os.path.join(plan_dir, "linked_dimensions.json")
-    if os.path.isfile(dim_file):
-        with open(dim_file, "r", encoding="utf-8") as f:
-            dim_data = json.load(f)
-
-        for dim_entry in dim_data:
-            image_path = dim_entry.get("image_path")
-            if not image_path:
-                continue
-
-            page_idx, tile_fn = extract_page_tile(plan_dir, image_path)
-            tile_key = (page_idx, tile_fn)
-            if tile_key in overlay_map:
-                # example dimension structure
-                dim_item = {
-                    "dimText": dim_entry.get("text", ""),
-                    "bbox": dim_entry.get("bbox", []),
-                    "confidence": dim_entry.get("confidence", 1.0),
-                    "nearest_line": dim_entry.get("nearest_line", None),
-                    "distance": dim_entry.get("distance", None)
-                }
-                overlay_map[tile_key]["overlayData"]["dimensions"].append(dim_item)
-                overlay_map[tile_key]["overlayData"]["isBlank"] = False
-
-    # ---- 5) Convert overlay_map dict to a list of tile overlay objects ----
-    final_overlays = list(overlay_map.values())
-
-    # ---- 6) Write out final_overlays.json ----
+    line_table = None
+    if os.path.isfile(lines_file) or os.path.isdir(line_store_dir(lines_file)):
+        line_table = load_line_table(lines_file)
+
+    # ---- 4) Join page by page and stream tiles to final_overlays.json ----
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    shard_dir = shard_dir_for(output_path)
+    shard_writer = OverlayShardWriter(shard_dir, shard_by, plan_id) if shard_by else None
+    if shard_writer is None and os.path.isfile(os.path.join(shard_dir, "manifest.json")):
+        # Shards from an earlier run would shadow the new final_overlays.json for readers
+        os.remove(os.path.join(shard_dir, "manifest.json"))
+    unassigned = 0
+    written = 0
     with open(output_path, "w", encoding="utf-8") as f:
-        json.dump(final_overlays, f, indent=2)
-
+        for page_idx in tile_index.pages():
+            overlays = []
+            for tile_info in tile_index.tiles[page_idx]:
+                tile_fn = tile_info.get("tile_filename", "")
+                # example image path (adjust if needed)
+                # e.g. "C:/.../page_0/tile_3000_6000.png"
+                image_path = os.path.join(plan_dir, f"page_{page_idx}", tile_fn)
+                overlays.append({
+                    "planId": plan_id,
+                    "pageIndex": page_idx,
+                    "tileIndex": tile_info.get("tile_index"),
+                    "imagePath": image_path,  # or any relative/absolute path
+                    "pdfCoords": {
+                        "x_start": tile_info.get("x_start"),
+                        "y_start": tile_info.get("y_start"),
+                        "zoom_factor": tile_info.get("zoom_factor"),
+                        "tile_width": tile_info.get("tile_width"),
+                        "tile_height": tile_info.get("tile_height"),
+                    },
+                    "overlayData": {
+                        "textBlocks": [],
+                        "dimensions": [],
+                        "lines": [],
+                        "isBlank": True  # we'll set to False if we find text or lines
+                    }
+                })
+
+            def add_items(entries, boxes, section, make_item):
+                nonlocal unassigned
+                hits = tile_index.assign(page_idx, boxes)
+                unassigned += int((~hits.any(axis=1)).sum()) if hits.shape[1] else len(entries)
+                for n, t in zip(*np.nonzero(hits)):
+                    overlay_data = overlays[t]["overlayData"]
+                    overlay_data[section].append(make_item(entries[n]))
+                    overlay_data["isBlank"] = False
+
+            texts = text_by_page.get(page_idx, [])
+            add_items(texts, [e["bbox"] for e in texts], "textBlocks", lambda entry: {
+                "text": entry.get("text", ""),
+                "bbox": entry.get("bbox", []),
+                "confidence": entry.get("confidence", 1.0)
+            })
+
+            if line_table is not None:
+                page_lines = line_table.page_lines(page_idx).tolist()
+                # line structure: [[x1, y1], [x2, y2]]
+                add_items(page_lines, page_lines, "lines", lambda line: [line[:2], line[2:]])
+
+            dims = dims_by_page.get(page_idx, [])
+            add_items(dims, [e["bbox"] for e in dims], "dimensions", lambda entry: {
+                "dimText": entry.get("text", ""),
+                "bbox": entry.get("bbox", []),
+                "confidence": entry.get("confidence", 1.0),
+                "nearest_line": entry.get("nearest_line", None),
+                "distance": entry.get("distance", None)
+            })
+
+            for overlay in overlays:
+                write_overlay_item(f, overlay, first=(written == 0))
+                written += 1
+            if shard_writer is not None:
+                shard_writer.add_page(page_idx, overlays)
+
+        f.write("\n]" if written else "[]")
+
+    if shard_writer is not None:
+        shard_writer.close()
+        logging.info(f"Overlay shards ({shard_by}) written to: {shard_dir}")
+
+    # add_items only sees pages that have tiles; count text/dimensions on the others too
+    skipped_pages = (set(text_by_page) | set(dims_by_page)) - set(tile_index.pages())
+    unassigned += sum(len(text_by_page.get(p, [])) + len(dims_by_page.get(p, [])) for p in skipped_pages)
+    if unassigned:
+        logging.info(f"{unassigned} items fell outside every tile and were not assigned.")
     logging.info(f"Final overlay data written to: {output_path}")
 
-def extract_page_tile(plan_dir, image_path):
-    """
-    Attempts to parse page_index and tile_filename from a full image_path.
-    e.g. image_path = ".../page_0/tile_3000_6000.png"
-
-    Returns (page_index, tile_filename) so we can map it back to overlay_map.
-    """
-    # This is just a naive approach; adapt to your path structure.
-    # We'll look for "/page_{idx}/tile_*" in the path.
-
-    # get relative path from plan_dir
-    rel_path = os.path.relpath(image_path, plan_dir)
-    parts = rel_path.split(os.sep)
-    # Expect: [ "page_0", "tile_3000_6000.png" ]
-    if len(parts) >= 2 and parts[0].startswith("page_"):
-        page_str = parts[0].replace("page_", "")
-        page_idx = int(page_str) if page_str.isdigit() else 0
-        tile_fn = parts[1]  # "tile_3000_6000.png"
-        return (page_idx, tile_fn)
-    else:
-        # fallback
-        return (0, os.path.basename(image_path))
-
 if __name__ == "__main__":
     """
-    Usage: python assemble_overlay.py <plan_id> <plan_dir> <output_file>
+    Usage: python assemble_overlay.py <plan_id> <plan_dir> <output_file> [--shard-by page|tile]
     Example:
         python assemble_overlay.py "MyPlan123" "C:/plans/MyPlan123" "C:/plans/MyPlan123/final_overlays.json"
     """
-    if len(sys.argv) < 4:
-        print("Usage: python assemble_overlay.py <plan_id> <plan_dir> <output_file>")
-        sys.exit(1)
-
-    plan_id = sys.argv[1]
-    plan_dir = os.path.normpath(sys.argv[2])
-    output_path = os.path.normpath(sys.argv[3])
+    parser = argparse.ArgumentParser(description="Assemble per-tile overlays for embedding.")
+    parser.add_argument("plan_id", help="Unique identifier for this PDF plan.")
+    parser.add_argument("plan_dir", help="Directory containing the intermediate JSON files.")
+    parser.add_argument("output_path", help="Path to write final_overlays.json.")
+    parser.add_argument("--shard-by", choices=SHARD_BY_CHOICES, default=None,
+                        help="Also write one compressed shard per page or tile, plus a manifest.")
+    args = parser.parse_args()
+
+    plan_id = args.plan_id
+    plan_dir = os.path.normpath(args.plan_dir)
+    output_path = os.path.normpath(args.output_path)
 
     try:
-        assemble_overlay(plan_id, plan_dir, output_path)
+        assemble_overlay(plan_id, plan_dir, output_path, shard_by=args.shard_by)
     except Exception as e:
         logging.error(f"Error assembling overlay: {e}")
-        sys.exit(1)
\ No newline at end of file
+        sys.exit(1)
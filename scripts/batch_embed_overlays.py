@@ -1,11 +1,22 @@
 import os
 import sys
 import json
+import time
 import pymongo
+from functools import lru_cache
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
 from datetime import datetime
-from clip_embedding import embed_image, embed_text
+from clip_embedding import (embed_texts, encode_images, iter_image_batches, image_cache_keys,
+                            cached_embeddings, store_embeddings, disable_embedding_cache,
+                            set_inference_profile, INFERENCE_PROFILES, INFERENCE_PROFILE,
+                            INFERENCE_THREADS, IMAGE_BATCH_SIZE, PREFETCH_WORKERS)
+from overlay_shards import open_overlays
+from embedding_codec import encode_embedding, EMBEDDING_FORMATS, DEFAULT_EMBEDDING_FORMAT
+from vector_index import VectorIndex, VECTOR_INDEX_DIR, FIELDS
 from dotenv import load_dotenv
 import logging
+import argparse
 import requests
 
 load_dotenv()
@@ -20,86 +31,331 @@ logging.basicConfig(
 sys.stdout.reconfigure(encoding="utf-8")
 sys.stderr.reconfigure(encoding="utf-8")
 
-try:
+@lru_cache(maxsize=1)
+def get_collection():
+    """
+    Creates the MongoDB client on first use, pings the server and returns the
+    plan_overlays collection. Raises (instead of exiting at import) when MONGODB_URI
+    is missing or invalid or the server cannot be reached; failures are not cached.
+    """
     mongodb_uri = os.getenv("MONGODB_URI")
     if not mongodb_uri:
         raise ValueError("MONGODB_URI not defined in the environment.")
-    client = pymongo.MongoClient(mongodb_uri)
-    db = client["ModeledHomes"]
-    collection = db["plan_overlays"]
+    client = pymongo.MongoClient(mongodb_uri, serverSelectionTimeoutMS=MONGODB_TIMEOUT_MS)
+    try:
+        client.admin.command("ping")
+    except PyMongoError:
+        client.close()
+        raise
     logging.info("MongoDB connection successful!")
-except Exception as e:
-    logging.error(f"Error connecting to MongoDB: {e}")
-    sys.exit(1)
+    return client["ModeledHomes"]["plan_overlays"]
+
+##############
+# Parameters #
+##############
+
+WRITE_BATCH_SIZE = 100      # tile documents per bulk_write
+WRITE_RETRIES = 3           # extra attempts for the failed part of a batch
+WRITE_RETRY_DELAY = 0.5     # seconds, doubled after each failed attempt
+TILE_KEY = ("planId", "pageIndex", "tileIndex")
+MONGODB_TIMEOUT_MS = 5000   # server selection timeout, so an unreachable server fails fast
+# Write error codes worth resending: network, failover/step-down, shutdown, time limit and
+# write conflict. Others (validation, duplicate key 11000, document too large) fail
+# the same way every time, so their tiles fail at once.
+TRANSIENT_WRITE_ERRORS = frozenset({6, 7, 50, 89, 91, 112, 189, 262, 9001, 10107, 11600, 11602,
+                                    13435, 13436})
 
 
-def process_overlays(plan_id, plan_dir):
+def process_overlays(plan_id, plan_dir, batch_size=IMAGE_BATCH_SIZE, prefetch_workers=PREFETCH_WORKERS,
+                     write_batch_size=WRITE_BATCH_SIZE, target_collection=None, index_dir=VECTOR_INDEX_DIR,
+                     embedding_format=DEFAULT_EMBEDDING_FORMAT):
     """
-    Reads final_overlays.json from plan_dir, embeds images & text (optional),
+    Reads final_overlays.json (or its shards) from plan_dir, embeds images & text (optional),
     and stores them in MongoDB as a single doc per tile.
+    Tile images are embedded batch_size at a time, with the next batches decoded on
+    prefetch_workers threads while the current one runs through the model.
+    Tiles are upserted on (planId, pageIndex, tileIndex) write_batch_size at a time,
+    so re-running a plan replaces its documents instead of duplicating them.
+    The plan's embeddings also replace its entries in the local vector index at
+    index_dir (None to skip). embedding_format picks how embeddings are stored in
+    the documents (see embedding_codec); the index always gets full precision.
     """
     logging.info(f"Processing final overlays for Plan ID: {plan_id}")
 
     final_overlays_path = os.path.join(plan_dir, "final_overlays.json")
-    if not os.path.isfile(final_overlays_path):
+    try:
+        # Shards (if assemble_overlay wrote them) are opened lazily, one tile at a time
+        final_overlays = open_overlays(final_overlays_path)
+    except FileNotFoundError:
         logging.error(f"final_overlays.json not found in {plan_dir}")
         return
 
-    # Load final overlays
-    with open(final_overlays_path, "r", encoding="utf-8") as f:
-        final_overlays = json.load(f)
+    # 1) Skip tiles marked as blank
+    tile_entries = []
+    for tile_entry in final_overlays.tiles():
+        if tile_entry.get("isBlank", True):
+            logging.info(f"Skipping blank tile: {tile_entry.get('imagePath')}")
+            continue
+        tile_entries.append(tile_entry)
 
-    # We can track processed_images if we suspect multiple references
+    # We can track processed_images if we suspect multiple references;
+    # only the first tile that references an image gets its embedding
     processed_images = set()
+    embed_paths = []
+    for tile_entry in tile_entries:
+        image_path = tile_entry.get("imagePath")
+        tile_entry["embedImage"] = bool(image_path) and image_path not in processed_images
+        if tile_entry["embedImage"]:
+            processed_images.add(image_path)
+            embed_paths.append(image_path)
 
-    for tile_obj in final_overlays:
-        image_path = tile_obj.get("imagePath")
-        overlay_data = tile_obj.get("overlayData", {})
-        is_blank = overlay_data.get("isBlank", True)
+    # 2) Images already in the embedding cache, or identical to an earlier tile's
+    # image (same bytes), are not encoded again. Embeddings are keyed by content
+    # hash, or by path for files that could not be hashed.
+    image_keys = image_cache_keys(embed_paths)
+    image_embeddings = cached_embeddings(image_keys.values())
+    encode_paths, queued = [], set()
+    for image_path in embed_paths:
+        key = image_keys.get(image_path, image_path)
+        if key not in image_embeddings and key not in queued:
+            queued.add(key)
+            encode_paths.append(image_path)
+    logging.info(f"Embedding {len(encode_paths)} of {len(embed_paths)} tile images "
+                 f"({len(embed_paths) - len(encode_paths)} cached or repeated)")
 
-        # 1) Skip if tile is marked as blank
-        if is_blank:
-            logging.info(f"Skipping blank tile: {image_path}")
-            continue
+    image_batches = iter_image_batches(encode_paths, batch_size, prefetch_workers)
 
-        # 2) Embed the tile image if not done already
-        image_embedding = None
-        if image_path and image_path not in processed_images:
+    def next_image_embedding(image_path):
+        # Pull (decoded, prefetched) batches until this tile's image has been encoded
+        key = image_keys.get(image_path, image_path)
+        while key not in image_embeddings:
+            paths, images, errors = next(image_batches)
+            for path, error in zip(paths, errors):
+                image_embeddings[image_keys.get(path, path)] = None
+                if error is not None:
+                    logging.error(f"Error embedding image {path}: {error}")
+            decoded = [(path, image) for path, image in zip(paths, images) if image is not None]
             try:
-                image_embedding = embed_image(image_path)
-                processed_images.add(image_path)
+                encoded = encode_images([image for _, image in decoded], batch_size=batch_size)
             except Exception as e:
-                logging.error(f"Error embedding image {image_path}: {e}")
+                logging.error(f"Error embedding image batch starting at {paths[0]}: {e}")
+                continue
+            for (path, _), embedding in zip(decoded, encoded):
+                image_embeddings[image_keys.get(path, path)] = embedding
+            store_embeddings({image_keys[path]: embedding
+                              for (path, _), embedding in zip(decoded, encoded) if path in image_keys})
+        return image_embeddings[key]
 
-        # 3) TEXT EMBEDDING (aggregated)
-        text_blocks = overlay_data.get("textBlocks", [])
-        combined_text = " ".join([tb["text"] for tb in text_blocks]).strip()
+    # 3) TEXT EMBEDDING (aggregated): every chunk of every tile in one batched call
+    combined_texts = [
+        tile_text(final_overlays.get(tile_entry["pageIndex"], tile_entry["tileIndex"]))
+        for tile_entry in tile_entries
+    ]
+    try:
+        text_embeddings = embed_texts(combined_texts)
+    except Exception as e:
+        logging.error(f"Error embedding text for plan {plan_id}: {e}")
+        text_embeddings = [None] * len(tile_entries)
 
-        if combined_text:
-            try:
-                text_embedding = embed_text(combined_text)  # from clip_embedding.py
-            except Exception as e:
-                logging.error(f"Error embedding text for tile {image_path}: {e}")
-                text_embedding = None
-        else:
-            text_embedding = None
-
-        # 4) Prepare MongoDB document
-        doc = {
-            "planId": tile_obj.get("planId", plan_id),
-            "pageIndex": tile_obj.get("pageIndex"),
-            "tileIndex": tile_obj.get("tileIndex"),
-            "imagePath": image_path,
-            "pdfCoords": tile_obj.get("pdfCoords", {}),
-            "overlayData": overlay_data,
-            "imageEmbedding": image_embedding,
-            "textEmbedding": text_embedding,
-            "createdAt": datetime.now().isoformat()
-        }
-
-        # Insert into MongoDB
-        collection.insert_one(doc)
-        logging.info(f"Inserted tile doc for {image_path} (blank={is_blank}).")
+    target_collection = get_collection() if target_collection is None else target_collection
+    ensure_tile_index(target_collection)
+    writer = TileWriter(target_collection, batch_size=write_batch_size)
+    index_entries = []
+    try:
+        for tile_entry, text_embedding in zip(tile_entries, text_embeddings):
+            image_embedding = next_image_embedding(tile_entry["imagePath"]) if tile_entry["embedImage"] else None
+            doc = tile_doc(plan_id, final_overlays, tile_entry, image_embedding, text_embedding, embedding_format)
+            writer.add(doc)
+            index_entries.append({"pageIndex": doc["pageIndex"], "tileIndex": doc["tileIndex"],
+                                  FIELDS["image"]: image_embedding, FIELDS["text"]: text_embedding})
+    finally:
+        image_batches.close()
+    writer.close()
+
+    # 5) Local vector index (searchable without Atlas vector search)
+    if index_dir:
+        try:
+            VectorIndex(index_dir).add_plan(plan_id, index_entries)
+        except Exception as e:
+            logging.error(f"Error updating vector index at {index_dir}: {e}")
+
+def tile_text(tile_obj):
+    text_blocks = tile_obj.get("overlayData", {}).get("textBlocks", [])
+    return " ".join([tb["text"] for tb in text_blocks]).strip()
+
+def tile_doc(plan_id, final_overlays, tile_entry, image_embedding, text_embedding,
+             embedding_format=DEFAULT_EMBEDDING_FORMAT):
+    """
+    Builds the MongoDB document of one non-blank tile with its image and text
+    embeddings (both computed in batches by process_overlays), encoded as
+    embedding_format. Read them back with embedding_codec.decode_embedding.
+    """
+    image_path = tile_entry.get("imagePath")
+    tile_obj = final_overlays.get(tile_entry["pageIndex"], tile_entry["tileIndex"])
+    overlay_data = tile_obj.get("overlayData", {})
+
+    # 4) Prepare MongoDB document
+    return {
+        "planId": tile_obj.get("planId", plan_id),
+        "pageIndex": tile_obj.get("pageIndex"),
+        "tileIndex": tile_obj.get("tileIndex"),
+        "imagePath": image_path,
+        "pdfCoords": tile_obj.get("pdfCoords", {}),
+        "overlayData": overlay_data,
+        "imageEmbedding": encode_embedding(image_embedding, embedding_format),
+        "textEmbedding": encode_embedding(text_embedding, embedding_format),
+        "createdAt": datetime.now().isoformat()
+    }
+
+#################
+# Bulk upserts  #
+#################
+
+def tile_upsert(doc):
+    """
+    Upsert of one tile document keyed on TILE_KEY. createdAt is only set when the
+    tile is first inserted; re-runs overwrite everything else and set updatedAt.
+    """
+    key = {field: doc.get(field) for field in TILE_KEY}
+    fields = {k: v for k, v in doc.items() if k not in TILE_KEY and k != "createdAt"}
+    fields["updatedAt"] = datetime.now().isoformat()
+    return UpdateOne(key, {"$set": fields, "$setOnInsert": {"createdAt": doc.get("createdAt")}}, upsert=True)
+
+def bulk_upsert(target_collection, docs, retries=WRITE_RETRIES, retry_delay=WRITE_RETRY_DELAY):
+    """
+    Upserts docs with one unordered bulk_write. With ordered=False every operation
+    that did not fail is applied, so only the failed ones are resent (after a
+    BulkWriteError) or the whole batch (after a connection/server error, where
+    nothing is known to be applied; the upserts are idempotent either way).
+    Write errors whose code is not in TRANSIENT_WRITE_ERRORS are not resent.
+
+    :return: (counts dict of matched/upserted, list of docs that failed permanently
+             or were still failing after retries, in input order)
+    """
+    operations = [tile_upsert(doc) for doc in docs]
+    pending = list(range(len(operations)))
+    failed = []
+    counts = {"matched": 0, "upserted": 0}
+    attempt = 0
+
+    while pending:
+        try:
+            result = target_collection.bulk_write([operations[i] for i in pending], ordered=False)
+            counts["matched"] += result.matched_count
+            counts["upserted"] += result.upserted_count
+            pending = []
+        except BulkWriteError as e:
+            details = e.details
+            counts["matched"] += details.get("nMatched", 0)
+            counts["upserted"] += details.get("nUpserted", 0)
+            write_errors = details.get("writeErrors", [])
+            logging.warning(f"{len(write_errors)} of {len(pending)} tile upserts failed "
+                            f"(first: {write_errors[0].get('errmsg') if write_errors else 'write concern'}).")
+            if write_errors:
+                failed += [pending[error["index"]] for error in write_errors
+                           if error.get("code") not in TRANSIENT_WRITE_ERRORS]
+                pending = [pending[error["index"]] for error in write_errors
+                           if error.get("code") in TRANSIENT_WRITE_ERRORS]
+        except PyMongoError as e:
+            logging.warning(f"Bulk write of {len(pending)} tiles failed: {e}")
+
+        if pending:
+            attempt += 1
+            if attempt > retries:
+                break
+            time.sleep(retry_delay * 2 ** (attempt - 1))
+
+    return counts, [docs[i] for i in sorted(failed + pending)]
+
+class TileWriter:
+    """
+    Buffers tile documents and upserts them batch_size at a time with bulk_upsert.
+    close() flushes the rest and raises if any tile could not be written, so the
+    pipeline is not reported complete with tiles missing.
+    """
+
+    def __init__(self, target_collection, batch_size=WRITE_BATCH_SIZE, retries=WRITE_RETRIES,
+                 retry_delay=WRITE_RETRY_DELAY):
+        self.collection = target_collection
+        self.batch_size = max(1, batch_size)
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.buffer = []
+        self.counts = {"matched": 0, "upserted": 0}
+        self.failed = []
+
+    def add(self, doc):
+        self.buffer.append(doc)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        counts, failed = bulk_upsert(self.collection, self.buffer, retries=self.retries,
+                                     retry_delay=self.retry_delay)
+        for key, value in counts.items():
+            self.counts[key] += value
+        self.failed.extend(failed)
+        logging.info(f"Upserted {len(self.buffer) - len(failed)} tile docs "
+                     f"({counts['upserted']} new, {counts['matched']} replaced).")
+        self.buffer = []
+
+    def close(self):
+        self.flush()
+        if self.failed:
+            paths = ", ".join(str(doc.get("imagePath")) for doc in self.failed[:5])
+            raise RuntimeError(f"{len(self.failed)} tile docs could not be written (transient errors "
+                               f"were retried {self.retries} times): {paths}")
+
+def ensure_tile_index(target_collection):
+    """
+    Index on TILE_KEY so each upsert finds its tile without a collection scan.
+    Not unique: collections written before upserts may still hold duplicates.
+    """
+    target_collection.create_index([(field, pymongo.ASCENDING) for field in TILE_KEY], name="tile_key")
+
+def benchmark_writes(target_collection, tile_count=1000, batch_sizes=(10, 100, 500), dim=512):
+    """
+    Compares per-document insert_one with bulk upserts on synthetic tile documents
+    (two dim-float embeddings each), then re-runs the upsert to check it is idempotent.
+    target_collection is dropped before each run; point it at a scratch collection.
+    """
+    docs = [{
+        "planId": "benchmark",
+        "pageIndex": i // 20,
+        "tileIndex": i,
+        "imagePath": f"page_{i // 20}_tile_{i}.png",
+        "pdfCoords": {},
+        "overlayData": {"isBlank": False, "textBlocks": []},
+        "imageEmbedding": [float(i % 7) / 7.0] * dim,
+        "textEmbedding": [float(i % 5) / 5.0] * dim,
+        "createdAt": datetime.now().isoformat(),
+    } for i in range(tile_count)]
+
+    print(f"{'method':>18} {'time (s)':>9} {'tiles/s':>9} {'docs after':>11}")
+
+    target_collection.drop()
+    start = time.perf_counter()
+    for doc in docs:
+        target_collection.insert_one(dict(doc))
+    elapsed = time.perf_counter() - start
+    print(f"{'insert_one':>18} {elapsed:>9.3f} {tile_count / elapsed:>9.0f} "
+          f"{target_collection.count_documents({}):>11}")
+
+    for batch_size in batch_sizes:
+        target_collection.drop()
+        ensure_tile_index(target_collection)
+        for run in ("", " rerun"):
+            writer = TileWriter(target_collection, batch_size=batch_size)
+            start = time.perf_counter()
+            for doc in docs:
+                writer.add(doc)
+            writer.close()
+            elapsed = time.perf_counter() - start
+            print(f"{f'upsert x{batch_size}{run}':>18} {elapsed:>9.3f} {tile_count / elapsed:>9.0f} "
+                  f"{target_collection.count_documents({}):>11}")
+    target_collection.drop()
 
 
 def get_uuid_from_path(plan_dir):
@@ -133,23 +389,82 @@ def notify_pipeline_complete(uuid, plan_id):
         print(f"❌ Error notifying backend: {e}")
 
 
-if __name__ == "__main__":
-    if len(sys.argv) < 3:
-        print("Usage: python batch_embed_overlays.py <plan_id> <plan_dir>")
-        sys.exit(1)
+def embed_plan_overlays(plan_id, plan_dir, **options):
+    """
+    Pipeline entry point: embeds and stores the plan's overlays (options are passed
+    to process_overlays), then notifies the backend for the UUID in plan_dir.
+    Raises if MongoDB is unavailable or storing the overlays fails (e.g. tiles that
+    could not be written); the backend is only notified after a successful run.
+    """
+    # Fail before embedding anything if MongoDB is not configured
+    get_collection()
 
-    plan_id = sys.argv[1]
-    plan_dir = os.path.normpath(sys.argv[2])
     uuid = get_uuid_from_path(plan_dir)
+    if not uuid:
+        logging.error(f"🚨 Pipeline completed, but UUID extraction failed. Backend will not be notified.")
+        return
 
-    if uuid:
-        try:
-            process_overlays(plan_id, plan_dir)
-            logging.info(f"Embeddings stored successfully for Plan ID: {plan_id}")
+    process_overlays(plan_id, plan_dir, **options)
+    logging.info(f"Embeddings stored successfully for Plan ID: {plan_id}")
 
-            notify_pipeline_complete(uuid, plan_id)
+    notify_pipeline_complete(uuid, plan_id)
 
-        except Exception as e:
-            logging.error(f"Error processing overlays: {e}")
-    else:
-        logging.error(f"🚨 Pipeline completed, but UUID extraction failed. Backend will not be notified.")
\ No newline at end of file
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Embed final overlays and store them in MongoDB.")
+    parser.add_argument("plan_id", nargs="?", help="Plan ID.")
+    parser.add_argument("plan_dir", nargs="?", help="Results directory containing final_overlays.json.")
+    parser.add_argument("--batch-size", type=int, default=IMAGE_BATCH_SIZE,
+                        help="Tile images per CLIP encode call.")
+    parser.add_argument("--prefetch-workers", type=int, default=PREFETCH_WORKERS,
+                        help="Threads decoding upcoming tile images.")
+    parser.add_argument("--profile", choices=sorted(INFERENCE_PROFILES), default=INFERENCE_PROFILE,
+                        help="CLIP CPU inference profile (see clip_embedding.py).")
+    parser.add_argument("--threads", type=int, default=INFERENCE_THREADS,
+                        help="Intra-op threads for the tuned/int8/onnx profiles (0 = one per CPU).")
+    parser.add_argument("--write-batch-size", type=int, default=WRITE_BATCH_SIZE,
+                        help="Tile documents per MongoDB bulk upsert.")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Neither read nor write the embedding cache.")
+    parser.add_argument("--embedding-format", choices=EMBEDDING_FORMATS, default=DEFAULT_EMBEDDING_FORMAT,
+                        help="Store embeddings as float lists, float16 bytes or int8 bytes with a per-vector scale.")
+    parser.add_argument("--index-dir", default=VECTOR_INDEX_DIR,
+                        help="Local vector index updated with the plan's embeddings.")
+    parser.add_argument("--no-index", action="store_true",
+                        help="Do not update the local vector index.")
+    parser.add_argument("--benchmark-writes", action="store_true",
+                        help="Compare insert_one with bulk upserts on a scratch collection and exit.")
+    parser.add_argument("--mongomock", action="store_true",
+                        help="Run --benchmark-writes against an in-memory mongomock collection.")
+    args = parser.parse_args()
+
+    if args.no_cache:
+        disable_embedding_cache()
+    set_inference_profile(args.profile, args.threads)
+    if args.benchmark_writes:
+        if args.mongomock:
+            import mongomock
+            scratch = mongomock.MongoClient()["ModeledHomes"]["plan_overlays_benchmark"]
+        else:
+            scratch = get_collection().database["plan_overlays_benchmark"]
+        benchmark_writes(scratch)
+        sys.exit(0)
+    if not (args.plan_id and args.plan_dir):
+        parser.error("plan_id and plan_dir are required unless --benchmark-writes is given.")
+
+    try:
+        get_collection()
+    except Exception as e:
+        logging.error(f"Error connecting to MongoDB: {e}")
+        sys.exit(1)
+
+    try:
+        embed_plan_overlays(args.plan_id, os.path.normpath(args.plan_dir),
+                            batch_size=args.batch_size,
+                            prefetch_workers=args.prefetch_workers,
+                            write_batch_size=args.write_batch_size,
+                            index_dir=None if args.no_index else args.index_dir,
+                            embedding_format=args.embedding_format)
+    except Exception as e:
+        logging.error(f"Error embedding overlays: {e}")
+        sys.exit(1)
\ No newline at end of file
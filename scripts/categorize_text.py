@@ -2,25 +2,99 @@ import os
 import sys
 import json
 import re
+import hashlib
+import time
+import random
+import string
+
+from pipeline_artifacts import load_json, save_json
 
 # Global list for label keywords, loaded from an external file.
 label_keywords = []
 
+# Dimension patterns, combined into one compiled alternation
+DIMENSION_PATTERNS = [
+    r"^\d+(\.\d+)?x\d+(\.\d+)?$",               # e.g. "8x16", "8.5x7.25"
+    r"^\d+(\.\d+)?['\"-]?\s?(ft|in|m|cm|mm)?$",  # e.g. "12 ft", "12'", "12.5 in"
+    r"^\d+(width|wide|height|hgt|clg)?\d*$",    # e.g. "16wide", "36height", "8clg"
+]
+DIMENSION_REGEX = re.compile("|".join(f"(?:{p})" for p in DIMENSION_PATTERNS))
+LABEL_TEXT_REGEX = re.compile(r"^[a-z0-9\s\-]+$")
+
+class KeywordAutomaton:
+    """
+    Aho-Corasick automaton over the label keywords. contains_any(text) answers
+    "does any keyword occur in text?" in one pass over text, independent of
+    how many keywords were loaded.
+    """
+
+    def __init__(self, keywords):
+        self.goto = [{}]
+        self.fail = [0]
+        self.match = [False]
+
+        for kw in keywords:
+            state = 0
+            for ch in kw:
+                nxt = self.goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[state][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.match.append(False)
+                state = nxt
+            self.match[state] = True
+
+        # Breadth-first failure links; a state matches if any suffix state does
+        queue = list(self.goto[0].values())
+        head = 0
+        while head < len(queue):
+            state = queue[head]
+            head += 1
+            for ch, nxt in self.goto[state].items():
+                queue.append(nxt)
+                f = self.fail[state]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0)
+                self.match[nxt] = self.match[nxt] or self.match[self.fail[nxt]]
+
+        self.matches_empty = self.match[0]
+
+    def contains_any(self, text: str) -> bool:
+        if self.matches_empty:
+            return True
+        goto, fail, match = self.goto, self.fail, self.match
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if match[state]:
+                return True
+        return False
+
+# Built by load_label_keywords()
+label_matcher = KeywordAutomaton([])
+
 def load_label_keywords(keywords_path: str):
     """
     Loads building plan label keywords from an external text file (one per line).
     Each line is stored in 'label_keywords' in lowercase.
     """
-    global label_keywords
+    global label_keywords, label_matcher
     if not os.path.isfile(keywords_path):
         print(f"[DEBUG] Label keywords file not found: {keywords_path}. Proceeding with empty list.")
         label_keywords = []
+        label_matcher = KeywordAutomaton(label_keywords)
         return
 
     with open(keywords_path, "r", encoding="utf-8") as f:
         lines = f.read().splitlines()
         label_keywords = [line.strip().lower() for line in lines if line.strip()]
 
+    label_matcher = KeywordAutomaton(label_keywords)
     print(f"[DEBUG] Loaded {len(label_keywords)} label keywords from {keywords_path}")
 
 def categorize_text_entry(text: str) -> str:
@@ -33,92 +107,251 @@ def categorize_text_entry(text: str) -> str:
     text_lower = text.lower()
 
     # Dimension patterns
-    dimension_patterns = [
-        r"^\d+(\.\d+)?x\d+(\.\d+)?$",               # e.g. "8x16", "8.5x7.25"
-        r"^\d+(\.\d+)?['\"-]?\s?(ft|in|m|cm|mm)?$",  # e.g. "12 ft", "12'", "12.5 in"
-        r"^\d+(width|wide|height|hgt|clg)?\d*$",    # e.g. "16wide", "36height", "8clg"
-    ]
-    for pattern in dimension_patterns:
-        if re.match(pattern, text_lower):
-            return "dimension"
+    if DIMENSION_REGEX.match(text_lower):
+        return "dimension"
 
     # Check if text matches any known label keywords
-    for kw in label_keywords:
-        if kw in text_lower:
-            return "label"
+    if label_matcher.contains_any(text_lower):
+        return "label"
 
     # If it’s mostly alphanumeric and possibly spaces/hyphens => label
-    if re.match(r"^[a-z0-9\s\-]+$", text_lower):
+    if LABEL_TEXT_REGEX.match(text_lower):
         return "label"
 
     # Otherwise, we classify it as "misc"
-    print(f"[DEBUG] Unmatched entry: {text}")
     return "misc"
 
-def categorize_text(input_path: str, output_path: str, confidence_threshold: float = 0.5):
+def checkpoint_path_for(output_path: str) -> str:
+    """
+    Append-only JSONL checkpoint kept beside the output while categorize_text runs.
+    """
+    return os.path.splitext(output_path)[0] + ".checkpoint.jsonl"
+
+def file_sha1(path: str) -> str:
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+def load_checkpoint(checkpoint_path: str, header: dict) -> list:
+    """
+    Returns the categorized entries already in checkpoint_path, or [] if there is
+    no checkpoint or it was written for a different input. A truncated last line
+    (interrupted write) is dropped.
+    """
+    if not os.path.isfile(checkpoint_path):
+        return []
+
+    done = []
+    with open(checkpoint_path, "r", encoding="utf-8") as f:
+        first = f.readline()
+        try:
+            if json.loads(first).get("_checkpoint") != header:
+                print(f"[DEBUG] Checkpoint {checkpoint_path} is for a different input; starting over.")
+                return []
+        except (json.JSONDecodeError, AttributeError):
+            return []
+
+        for line in f:
+            try:
+                done.append(json.loads(line))
+            except json.JSONDecodeError:
+                break
+    return done
+
+def categorize_text(input_path: str, output_path: str, confidence_threshold: float = 0.5,
+                    resume: bool = True):
     """
     Categorizes text entries based on regex patterns and flags low-confidence OCR results.
+    Progress is appended to a JSONL checkpoint every batch; the JSON output is
+    written once at the end and the checkpoint removed.
     
     :param input_path: Path to the merged text JSON file.
     :param output_path: Path to save the categorized results JSON file.
     :param confidence_threshold: Confidence below which text is flagged for review.
+    :param resume: If True, continue from an existing checkpoint for the same input.
     """
     if not os.path.isfile(input_path):
         raise FileNotFoundError(f"Merged results file not found: {input_path}")
 
-    with open(input_path, 'r', encoding='utf-8') as f:
-        merged_results = json.load(f)
+    merged_results = load_json(input_path)
 
-    categorized_results = []
     batch_size = 100  # Adjust as needed
+    checkpoint_path = checkpoint_path_for(output_path)
+    # Content hashes, not just path and size: the pipeline rewrites merged_results.json
+    # in place on every run, and categories depend on the loaded label keywords
+    header = {
+        "input_path": os.path.abspath(input_path),
+        "input_sha1": file_sha1(input_path),
+        "entries": len(merged_results),
+        "confidence_threshold": confidence_threshold,
+        "keywords_sha1": hashlib.sha1(json.dumps(label_keywords).encode("utf-8")).hexdigest(),
+    }
+
+    categorized_results = load_checkpoint(checkpoint_path, header) if resume else []
+    if categorized_results:
+        print(f"[DEBUG] Resuming from checkpoint at {len(categorized_results)}/{len(merged_results)} entries")
+
+    pending = []
+    unmatched = [e for e in categorized_results if e.get("category") == "misc"]
+    unmatched_count = len(unmatched)
+    unmatched_examples = [e.get("text", "") for e in unmatched[:5]]
+
+    # Rewrite the header and any resumed entries once (drops a truncated tail), then only append
+    with open(checkpoint_path, "w", encoding="utf-8") as checkpoint:
+        checkpoint.write(json.dumps({"_checkpoint": header}) + "\n")
+        for done in categorized_results:
+            checkpoint.write(json.dumps(done) + "\n")
+        checkpoint.flush()
 
-    for i, entry in enumerate(merged_results):
-        text = entry.get("text", "").strip()
-        confidence = entry.get("confidence", 1.0)
-        source = entry.get("source", None)
+        # Entries finished before an exception are still appended, so a rerun resumes after them
+        try:
+            for i in range(len(categorized_results), len(merged_results)):
+                entry = merged_results[i]
+                text = entry.get("text", "").strip()
+                confidence = entry.get("confidence", 1.0)
+                source = entry.get("source", None)
 
-        category = categorize_text_entry(text)
+                category = categorize_text_entry(text)
+                if category == "misc":
+                    unmatched_count += 1
+                    if len(unmatched_examples) < 5:
+                        unmatched_examples.append(text)
 
-        needs_review = (source == "ocr" and confidence < confidence_threshold)
+                needs_review = (source == "ocr" and confidence < confidence_threshold)
 
-        # Build final
-        categorized_results.append({
-            **entry,
-            "category": category,
-            "needs_review": needs_review
-        })
+                # Build final
+                result = {
+                    **entry,
+                    "category": category,
+                    "needs_review": needs_review
+                }
+                categorized_results.append(result)
+                pending.append(json.dumps(result))
 
-        # Optional: save partial progress
-        if (i + 1) % batch_size == 0:
-            print(f"[DEBUG] Processed {i + 1}/{len(merged_results)} entries")
-            with open(output_path, "w", encoding="utf-8") as batch_f:
-                json.dump(categorized_results, batch_f, indent=2)
+                # Save partial progress by appending only this batch
+                if (i + 1) % batch_size == 0:
+                    print(f"[DEBUG] Processed {i + 1}/{len(merged_results)} entries")
+                    checkpoint.write("\n".join(pending) + "\n")
+                    checkpoint.flush()
+                    pending = []
+        finally:
+            if pending:
+                checkpoint.write("\n".join(pending) + "\n")
+
+    if unmatched_count:
+        print(f"[DEBUG] {unmatched_count} unmatched entries categorized as misc "
+              f"(e.g. {unmatched_examples})")
 
     # Save final results
-    with open(output_path, "w", encoding="utf-8") as f:
-        json.dump(categorized_results, f, indent=2)
+    save_json(categorized_results, output_path, indent=2)
+    os.remove(checkpoint_path)
     print(f"Categorized results saved to {output_path}")
 
+def benchmark_keyword_matching(keyword_counts=(10, 100, 1000, 10000), num_entries=5000, seed=0):
+    """
+    Times the per-keyword substring scan against KeywordAutomaton for growing
+    keyword lists, on synthetic drawing-like text, and checks both agree.
+    The synthetic entries are longer than real labels; see benchmark_keyword_file.
+    """
+    rng = random.Random(seed)
+    alphabet = string.ascii_lowercase + string.digits + " /.-"
+
+    def random_word(lo, hi):
+        return "".join(rng.choice(alphabet) for _ in range(rng.randint(lo, hi)))
+
+    entries = [random_word(3, 24) for _ in range(num_entries)]
+
+    print(f"{'keywords':>10} {'scan (s)':>10} {'automaton (s)':>14} {'build (s)':>10} {'speedup':>8}")
+    for count in keyword_counts:
+        keywords = [random_word(3, 10) for _ in range(count)]
+
+        start = time.perf_counter()
+        scan_hits = [any(kw in text for kw in keywords) for text in entries]
+        scan_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        matcher = KeywordAutomaton(keywords)
+        build_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        automaton_hits = [matcher.contains_any(text) for text in entries]
+        automaton_time = time.perf_counter() - start
+
+        if scan_hits != automaton_hits:
+            raise AssertionError(f"Keyword matchers disagree for {count} keywords")
+
+        speedup = scan_time / automaton_time if automaton_time else float("inf")
+        print(f"{count:>10} {scan_time:>10.4f} {automaton_time:>14.4f} {build_time:>10.4f} {speedup:>7.1f}x")
+
+def benchmark_keyword_file(keywords_path: str, input_path: str, repeats: int = 20):
+    """
+    Times the substring scan against KeywordAutomaton with the real keyword file on
+    the text of a merged results file (best of repeats passes), and checks both agree.
+    Short lists alone do not favour the scan: label text is usually only a few
+    characters long, which is what the automaton's cost scales with.
+    """
+    load_label_keywords(keywords_path)
+    texts = [entry.get("text", "").strip().lower() for entry in load_json(input_path)]
+
+    def best_time(match):
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            hits = [match(text) for text in texts]
+            times.append(time.perf_counter() - start)
+        return min(times), hits
+
+    scan_time, scan_hits = best_time(lambda text: any(kw in text for kw in label_keywords))
+    automaton_time, automaton_hits = best_time(label_matcher.contains_any)
+    if scan_hits != automaton_hits:
+        raise AssertionError(f"Keyword matchers disagree on {input_path}")
+
+    mean_length = sum(map(len, texts)) / len(texts) if texts else 0.0
+    print(f"{len(label_keywords)} keywords, {len(texts)} entries (mean {mean_length:.1f} chars), "
+          f"{sum(scan_hits)} with a keyword")
+    print(f"scan {scan_time * 1e3:.3f} ms, automaton {automaton_time * 1e3:.3f} ms "
+          f"({scan_time / automaton_time if automaton_time else float('inf'):.1f}x)")
+
 if __name__ == "__main__":
-    if len(sys.argv) < 3:
-        print("Usage: python categorize_text.py <input_path> <output_path> [label_keywords_file]")
-        sys.exit(1)
+    import argparse
 
-    input_file = sys.argv[1]
-    output_file = sys.argv[2]
+    parser = argparse.ArgumentParser(description="Categorize merged text entries.")
+    parser.add_argument("input_path", nargs="?", help="Path to merged_results.json.")
+    parser.add_argument("output_path", nargs="?", help="Path to save categorized_results.json.")
+    parser.add_argument("label_keywords_file", nargs="?",
+                        help="Label keywords file (defaults to label_keywords.txt beside this script).")
+    parser.add_argument("--benchmark", action="store_true",
+                        help="Benchmark keyword matching across keyword-list sizes and exit; with "
+                             "input_path, on its text and the label keywords file instead.")
+    parser.add_argument("--no-resume", action="store_true",
+                        help="Ignore any existing checkpoint and start from the first entry.")
+    args = parser.parse_args()
 
     # If you provided a third arg for label keywords, use it; else default
-    if len(sys.argv) > 3:
-        label_kw_path = sys.argv[3]
+    if args.label_keywords_file:
+        label_kw_path = args.label_keywords_file
     else:
         # default to label_keywords.txt in the same dir
         script_dir = os.path.dirname(os.path.abspath(__file__))
         label_kw_path = os.path.join(script_dir, "label_keywords.txt")
 
+    if args.benchmark:
+        if args.input_path:
+            benchmark_keyword_file(label_kw_path, args.input_path)
+        else:
+            benchmark_keyword_matching()
+        sys.exit(0)
+
+    if not args.input_path or not args.output_path:
+        print("Usage: python categorize_text.py <input_path> <output_path> [label_keywords_file]")
+        sys.exit(1)
+
     # Load label keywords
     load_label_keywords(label_kw_path)
 
     try:
-        categorize_text(input_file, output_file)
+        categorize_text(args.input_path, args.output_path, resume=not args.no_resume)
     except Exception as e:
-        print(f"Error categorizing text: {e}")
\ No newline at end of file
+        print(f"Error categorizing text: {e}")
@@ -1,58 +1,382 @@
+import os
 import json
+import time
 import numpy as np
+from functools import partial
+from scipy.spatial import cKDTree
 
-def classify_walls(lines_list):
+from line_store import load_line_table, wall_store_dir, line_store_dir, write_wall_store
+from worker_pool import process_pool
+
+##############
+# Parameters #
+##############
+
+# Wall-thickness bands (PDF points); exterior wins where they overlap
+EXTERIOR_BAND = (10, 22)
+INTERIOR_BAND = (5, 12)
+WALL_ANGLE_TOL_DEG = 3.0   # max direction difference between the two faces of a wall
+WALL_MIN_OVERLAP = 0.5     # min shared length along the wall, as a fraction of the shorter face
+PAIR_ENGINE = "parallel"   # see WALL_PAIR_ENGINES
+DEFAULT_WORKERS = os.cpu_count() or 1
+PAIR_CHUNK_PAIRS = 1_000_000  # candidate pairs expanded and checked at once (bounds memory)
+
+################
+# Pair search  #
+################
+
+def _empty_pairs():
+    empty = np.empty(0, dtype=np.int64)
+    return empty, empty, np.empty(0, dtype=np.float64)
+
+def _expand_ranges(begin, end, chunk_pairs):
     """
-    Classifies detected lines into interior or exterior walls.
+    Yields (row, col) arrays covering every col in [begin[row], end[row]), about
+    chunk_pairs pairs at a time (a single row is never split across chunks).
+    """
+    counts = np.maximum(end - begin, 0)
+    total = np.cumsum(counts)
+    row0 = 0
+    while row0 < len(counts):
+        row1 = max(row0 + 1, int(np.searchsorted(total, total[row0] - counts[row0] + chunk_pairs, side="right")))
+        c = counts[row0:row1]
+        if c.sum():
+            rows = np.repeat(np.arange(row0, row1), c)
+            yield rows, begin[rows] + np.arange(c.sum()) - np.repeat(np.cumsum(c) - c, c)
+        row0 = row1
+
+def wall_pairs_parallel(segments, max_dist,
+                        angle_tol_deg=WALL_ANGLE_TOL_DEG,
+                        min_overlap=WALL_MIN_OVERLAP,
+                        chunk_pairs=PAIR_CHUNK_PAIRS):
+    """
+    Pairs near-parallel segments that face each other across at most max_dist.
+    Segments are bucketed by direction (angle_tol_deg wide), so only a bucket and
+    its neighbour are compared; inside that, candidates are found by sorting on the
+    perpendicular offset, within a window sized by the longer segment of each pair
+    (so one long wall does not widen the search for every short segment).
+    Candidates are expanded and checked chunk_pairs at a time. Returns
+    (i, j, thickness) with i < j, where thickness is the distance from the shorter
+    segment's midpoint to the longer segment's line.
+    """
+    n = len(segments)
+    if n < 2:
+        return _empty_pairs()
+
+    p0, p1 = segments[:, :2], segments[:, 2:]
+    delta = p1 - p0
+    length = np.hypot(delta[:, 0], delta[:, 1])
+    valid = length > 0
+    angle = np.degrees(np.arctan2(delta[:, 1], delta[:, 0])) % 180.0
+    n_buckets = max(1, int(np.ceil(180.0 / angle_tol_deg)))
+    bucket = np.minimum((angle // angle_tol_deg).astype(np.int64), n_buckets - 1)
+    mid = (p0 + p1) / 2.0
+
+    def exact(i, j):
+        # Exact checks: direction, thickness, shared length
+        i, j = np.minimum(i, j), np.maximum(i, j)
+        diff = np.abs(angle[i] - angle[j])
+        diff = np.minimum(diff, 180.0 - diff)
+        longer = np.where(length[i] >= length[j], i, j)
+        shorter = np.where(length[i] >= length[j], j, i)
+        direction = delta[longer] / length[longer, None]
+        rel = mid[shorter] - p0[longer]
+        thickness = np.abs(rel[:, 0] * direction[:, 1] - rel[:, 1] * direction[:, 0])
+
+        s0 = ((p0[shorter] - p0[longer]) * direction).sum(axis=1)
+        s1 = ((p1[shorter] - p0[longer]) * direction).sum(axis=1)
+        shared = (np.minimum(np.maximum(s0, s1), length[longer])
+                  - np.maximum(np.minimum(s0, s1), 0.0))
+        keep = ((diff <= angle_tol_deg) & (thickness <= max_dist)
+                & (shared >= min_overlap * length[shorter]))
+        return i[keep], j[keep], thickness[keep]
+
+    members = [np.flatnonzero(valid & (bucket == b)) for b in range(n_buckets)]
+    found_i, found_j, found_t = [], [], []
+    for b in range(n_buckets):
+        group = np.concatenate([members[b], members[(b + 1) % n_buckets]]) if n_buckets > 1 else members[b]
+        if len(group) < 2:
+            continue
+        # Offsets measured across a shared direction at the bucket boundary
+        theta = np.radians((b + 1) * angle_tol_deg)
+        offset = -mid[group, 0] * np.sin(theta) + mid[group, 1] * np.cos(theta)
+
+        order = np.argsort(offset, kind="stable")
+        sorted_offset = offset[order]
+        sorted_ids = group[order]
+        in_first = np.isin(sorted_ids, members[b])
+        # Facing midpoints differ in offset by at most max_dist plus the longer face's
+        # length times the sine of its angle to the shared direction (<= 2 buckets)
+        window = max_dist + length[sorted_ids] * np.sin(np.radians(2 * angle_tol_deg))
+        position = np.arange(len(order))
+        stop = np.searchsorted(sorted_offset, sorted_offset + window, side="right")
+        start = np.searchsorted(sorted_offset, sorted_offset - window, side="left")
+
+        # Each pair is found once: through k's window ahead of it if k's window is
+        # the wider, otherwise through m's window behind it
+        passes = (
+            (_expand_ranges(position + 1, stop, chunk_pairs), lambda k, m: window[k] >= window[m]),
+            (_expand_ranges(start, position, chunk_pairs), lambda m, k: window[m] > window[k]),
+        )
+        for chunks, owns in passes:
+            for k, m in chunks:
+                keep = owns(k, m)
+                if n_buckets > 1:
+                    # pairs inside the neighbour bucket are handled when it is bucket b
+                    keep &= in_first[k] | in_first[m]
+                i, j, thickness = exact(sorted_ids[k[keep]], sorted_ids[m[keep]])
+                found_i.append(i)
+                found_j.append(j)
+                found_t.append(thickness)
+
+    if not found_i:
+        return _empty_pairs()
+    i = np.concatenate(found_i)
+    j = np.concatenate(found_j)
+    thickness = np.concatenate(found_t)
+    order = np.lexsort((j, i))
+    return i[order], j[order], thickness[order]
+
+def wall_pairs_kdtree(segments, max_dist):
+    """
+    Returns (i, j, dist) arrays for every pair i < j whose start points are within
+    max_dist, using a KD-tree so only nearby pairs are ever materialized.
+    """
+    points = np.ascontiguousarray(segments[:, :2], dtype=np.float64)
+    # Small slack so no pair on the band edge is lost to rounding; the bands are re-checked exactly
+    pairs = cKDTree(points).query_pairs(max_dist + 1e-9, output_type="ndarray")
+    if len(pairs) == 0:
+        return _empty_pairs()
+    i, j = pairs[:, 0], pairs[:, 1]
+    delta = points[i] - points[j]
+    return i, j, np.sqrt(delta[:, 0] * delta[:, 0] + delta[:, 1] * delta[:, 1])
+
+def wall_pairs_loop(segments, max_dist):
+    """
+    Reference all-pairs version of wall_pairs_kdtree (O(n^2)).
+    """
+    points = np.asarray(segments[:, :2], dtype=np.float64)
+    pair_i, pair_j, pair_dist = [], [], []
+    for i in range(len(points)):
+        for j in range(i + 1, len(points)):
+            delta = points[i] - points[j]
+            dist = np.sqrt(delta[0] * delta[0] + delta[1] * delta[1])
+            if dist <= max_dist:
+                pair_i.append(i)
+                pair_j.append(j)
+                pair_dist.append(dist)
+    return (np.asarray(pair_i, dtype=np.int64), np.asarray(pair_j, dtype=np.int64),
+            np.asarray(pair_dist, dtype=np.float64))
+
+# "parallel" measures wall thickness between facing segments; "kdtree"/"loop" use
+# the older start-point distance heuristic.
+WALL_PAIR_ENGINES = {
+    "parallel": wall_pairs_parallel,
+    "kdtree": wall_pairs_kdtree,
+    "loop": wall_pairs_loop,
+}
+
+##################
+# Classification #
+##################
+
+def pair_page_task(segments, engine=PAIR_ENGINE):
+    """
+    Pool entry point: pairs the segments of one page, returning (i, j, thickness)
+    as row indices into that page's segments.
+    """
+    return WALL_PAIR_ENGINES[engine](segments, max(EXTERIOR_BAND[1], INTERIOR_BAND[1]))
+
+def classify_wall_ids(segments, pages=None, engine=PAIR_ENGINE, workers=1):
     """
-    exterior_walls = []
-    interior_walls = []
-    
-    for i, line_a in enumerate(lines_list):
-        for j, line_b in enumerate(lines_list):
-            if i >= j:
-                continue
-            
-            # Calculate midpoint distance
-            dist = np.linalg.norm(
-                np.array(line_a["pdf_line"][0]) - np.array(line_b["pdf_line"][0])
-            )
-            
-            # Adjusted thresholds to be less strict
-            if 10 <= dist <= 22:
-                exterior_walls.append(line_a)
-                exterior_walls.append(line_b)
-            elif 5 <= dist <= 12:
-                interior_walls.append(line_a)
-                interior_walls.append(line_b)
-
-    exterior_set = {(tuple(w["pdf_line"][0]), tuple(w["pdf_line"][1])) for w in exterior_walls if len(w["pdf_line"]) >= 2}
-    interior_set = {(tuple(w["pdf_line"][0]), tuple(w["pdf_line"][1])) for w in interior_walls if len(w["pdf_line"]) >= 2}
-
-    return {
-        "exterior": [ [list(pt1), list(pt2)] for pt1, pt2 in exterior_set ],
-        "interior": [ [list(pt1), list(pt2)] for pt1, pt2 in interior_set ]
+    Classifies lines into interior or exterior walls. Lines are only paired with
+    lines on the same page; pages run on a process pool when workers > 1.
+
+    :param segments: (N, 4) array of x1, y1, x2, y2 per line (e.g. LineTable.all_lines()).
+    :param pages: (N,) page index per line (e.g. LineTable.line_pages()); None = one page.
+    :param engine: Pair search, a key of WALL_PAIR_ENGINES.
+    :param workers: Processes used to pair pages.
+    :return: (wall_ids, wall_pairs). wall_ids is {"exterior": ids, "interior": ids}, each a
+             sorted list of row indices; lines with identical coordinates on a page are
+             reported once, by their first row. wall_pairs is {category: ((M, 2) row
+             indices, (M,) thickness)} for every pair that classified the lines.
+    """
+    if pages is None:
+        pages = np.zeros(len(segments), dtype=np.int64)
+
+    first_row = {}
+    for row, (page_idx, coords) in enumerate(zip(pages.tolist(), map(tuple, segments.tolist()))):
+        first_row.setdefault((page_idx, coords), row)
+    keep = np.zeros(len(segments), dtype=bool)
+    keep[list(first_row.values())] = True
+
+    page_rows = [np.flatnonzero(keep & (pages == page_idx)) for page_idx in np.unique(pages)]
+    tasks = [np.ascontiguousarray(segments[rows], dtype=np.float64) for rows in page_rows]
+    if workers > 1 and len(tasks) > 1:
+        with process_pool(min(workers, len(tasks))) as executor:
+            outcomes = list(executor.map(partial(pair_page_task, engine=engine), tasks))
+    else:
+        outcomes = [pair_page_task(task, engine=engine) for task in tasks]
+
+    pairs = [(rows[i], rows[j], dist) for rows, (i, j, dist) in zip(page_rows, outcomes)]
+    i, j, dist = (np.concatenate(parts) for parts in zip(*pairs)) if pairs else _empty_pairs()
+
+    # Adjusted thresholds to be less strict
+    is_exterior = (dist >= EXTERIOR_BAND[0]) & (dist <= EXTERIOR_BAND[1])
+    is_interior = ~is_exterior & (dist >= INTERIOR_BAND[0]) & (dist <= INTERIOR_BAND[1])
+
+    if engine == "parallel":
+        # A face belongs to the wall formed with its closest in-band partner; this
+        # drops pairs that reach across hatching or a neighbouring wall.
+        in_band = np.flatnonzero(is_exterior | is_interior)
+        nearest = np.full(len(segments), np.inf)
+        np.minimum.at(nearest, i[in_band], dist[in_band])
+        np.minimum.at(nearest, j[in_band], dist[in_band])
+        closest = (dist <= nearest[i]) | (dist <= nearest[j])
+        is_exterior &= closest
+        is_interior &= closest
+
+    wall_ids, wall_pairs = {}, {}
+    for category, mask in (("exterior", is_exterior), ("interior", is_interior)):
+        wall_ids[category] = sorted(set(np.concatenate([i[mask], j[mask]]).tolist()))
+        wall_pairs[category] = (np.stack([i[mask], j[mask]], axis=1), dist[mask])
+    return wall_ids, wall_pairs
+
+def walls_to_json(segments, wall_ids, wall_pairs=None, pages=None):
+    walls = {
+        category: [[[x1, y1], [x2, y2]] for x1, y1, x2, y2 in segments[ids].tolist()]
+        for category, ids in wall_ids.items()
     }
+    if wall_pairs is not None:
+        walls["pairs"] = [
+            {
+                "page_index": int(pages[a]) if pages is not None else 0,
+                "category": category,
+                "lines": [[segments[a, :2].tolist(), segments[a, 2:].tolist()],
+                          [segments[b, :2].tolist(), segments[b, 2:].tolist()]],
+                "thickness": thickness,
+            }
+            for category, (ids, thicknesses) in wall_pairs.items()
+            for (a, b), thickness in zip(ids.tolist(), thicknesses.tolist())
+        ]
+    return walls
+
+def classify_walls(lines_list, engine=PAIR_ENGINE, workers=1):
+    """
+    Classifies detected lines into interior or exterior walls.
+    """
+    lines_list = [w for w in lines_list if len(w["pdf_line"]) >= 2]
+    segments = np.array([
+        [*w["pdf_line"][0], *w["pdf_line"][1]] for w in lines_list
+    ], dtype=np.float64).reshape(-1, 4)
+    pages = np.array([w.get("page_index", 0) for w in lines_list], dtype=np.int64)
+    wall_ids, wall_pairs = classify_wall_ids(segments, pages, engine=engine, workers=workers)
+    return walls_to_json(segments, wall_ids, wall_pairs, pages)
+
+def synthetic_plan(n, rng, layout="random", long_fraction=0.03):
+    """
+    n segments at the sample plan's line density (~2400 lines on a 612x792 page,
+    page area grown with n). "random": short segments in any direction. "axis":
+    horizontal and vertical faces with a parallel twin 6-18 pt away, long_fraction
+    of them spanning 30-100% of the page, as on real floor plans.
+    """
+    side = np.sqrt(n / 2400.0 * 612 * 792)
+    if layout == "random":
+        start = rng.uniform(0, side, size=(n, 2))
+        return np.hstack([start, start + rng.uniform(-40, 40, size=(n, 2))])
+
+    half = n // 2
+    start = rng.uniform(0, side, size=(half, 2))
+    length = rng.uniform(5, 60, size=half)
+    is_long = rng.random(half) < long_fraction
+    length[is_long] = rng.uniform(0.3 * side, side, size=is_long.sum())
+    horizontal = rng.random(half) < 0.5
+    end = start.copy()
+    end[horizontal, 0] += length[horizontal]
+    end[~horizontal, 1] += length[~horizontal]
+    faces = np.hstack([start, end])
+    gap = rng.uniform(6, 18, size=half)
+    twins = faces.copy()
+    twins[np.ix_(horizontal, [1, 3])] += gap[horizontal, None]
+    twins[np.ix_(~horizontal, [0, 2])] += gap[~horizontal, None]
+    return np.vstack([faces, twins])
+
+def benchmark_classification(sizes=(1000, 2000, 4000, 20000, 100000), loop_limit=4000, seed=0,
+                             layouts=("random", "axis")):
+    """
+    Times the KD-tree pair search against the all-pairs loop on synthetic plans
+    (see synthetic_plan) and checks that both give the same classification. The
+    loop is skipped above loop_limit lines. The parallel-face engine is timed on
+    the same input for reference, with its peak traced memory.
+    """
+    import tracemalloc
+
+    rng = np.random.default_rng(seed)
+    print(f"{'layout':>7} {'lines':>8} {'loop (s)':>10} {'kdtree (s)':>11} {'speedup':>8} {'same':>5} "
+          f"{'parallel (s)':>13} {'peak (MB)':>10}")
+    for layout in layouts:
+        for n in sizes:
+            segments = synthetic_plan(n, rng, layout)
 
-def process_classification(input_path, output_path):
+            t0 = time.perf_counter()
+            fast, _ = classify_wall_ids(segments, engine="kdtree")
+            t_fast = time.perf_counter() - t0
+
+            tracemalloc.start()
+            t0 = time.perf_counter()
+            classify_wall_ids(segments, engine="parallel")
+            t_parallel = time.perf_counter() - t0
+            peak = tracemalloc.get_traced_memory()[1] / 1e6
+            tracemalloc.stop()
+
+            if n <= loop_limit:
+                t0 = time.perf_counter()
+                slow, _ = classify_wall_ids(segments, engine="loop")
+                t_slow = time.perf_counter() - t0
+                print(f"{layout:>7} {n:>8} {t_slow:>10.3f} {t_fast:>11.4f} {t_slow / t_fast:>7.0f}x "
+                      f"{str(fast == slow):>5} {t_parallel:>13.4f} {peak:>10.0f}")
+            else:
+                print(f"{layout:>7} {n:>8} {'-':>10} {t_fast:>11.4f} {'-':>8} {'-':>5} "
+                      f"{t_parallel:>13.4f} {peak:>10.0f}")
+
+def process_classification(input_path, output_path, engine=PAIR_ENGINE, workers=DEFAULT_WORKERS):
     """
     Processes detected lines and classifies walls.
+    Lines are read from the memory-mapped line store beside input_path; walls are
+    written as JSON coordinates and as line ids into that store (classified_walls.walls/).
     """
-    with open(input_path, 'r', encoding='utf-8') as f:
-        lines_list = json.load(f)
-    
-    classified_walls = classify_walls(lines_list)
-    
+    line_table = load_line_table(input_path)
+    segments = np.asarray(line_table.all_lines(), dtype=np.float64)
+    pages = line_table.line_pages()
+
+    start = time.perf_counter()
+    wall_ids, wall_pairs = classify_wall_ids(segments, pages, engine=engine, workers=workers)
+    print(f"[DEBUG] Classified {len(segments)} lines on {len(line_table.page_indices())} pages "
+          f"in {time.perf_counter() - start:.2f}s (engine={engine}, workers={workers})")
+
     with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(classified_walls, f, indent=4)
-    
+        json.dump(walls_to_json(segments, wall_ids, wall_pairs, pages), f, indent=4)
+    write_wall_store(wall_ids, line_store_dir(input_path), wall_store_dir(output_path), wall_pairs,
+                     source_path=output_path)
+
     print(f"Wall classification results saved to {output_path}")
 
 if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser(description="Classify detected walls into interior and exterior.")
-    parser.add_argument("input_path", help="Path to the line detection results JSON.")
-    parser.add_argument("output_path", help="Path to save classified structures JSON.")
+    parser.add_argument("input_path", nargs="?", help="Path to the line detection results JSON.")
+    parser.add_argument("output_path", nargs="?", help="Path to save classified structures JSON.")
+    parser.add_argument("--engine", choices=sorted(WALL_PAIR_ENGINES), default=PAIR_ENGINE,
+                        help="Pair search used to find nearby lines.")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help="Processes used to pair pages in parallel.")
+    parser.add_argument("--benchmark", action="store_true",
+                        help="Compare pair search engines on synthetic plans of growing size and exit.")
     args = parser.parse_args()
-    
-    process_classification(args.input_path, args.output_path)
\ No newline at end of file
+
+    if args.benchmark:
+        benchmark_classification()
+    elif not args.input_path or not args.output_path:
+        parser.error("input_path and output_path are required unless --benchmark is given.")
+    else:
+        process_classification(args.input_path, args.output_path, engine=args.engine, workers=args.workers)
@@ -8,6 +8,7 @@ PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 DATA_USER = os.path.join(PROJECT_ROOT, "data", "user")
 DATA_OUTPUT = os.path.join(PROJECT_ROOT, "data", "output")
 DATA_TILES = os.path.join(PROJECT_ROOT, "data", "tiles")
+DATA_CACHE = os.path.join(PROJECT_ROOT, "data", "cache")
 
 # Tiling parameters
 DEFAULT_DPI = 300
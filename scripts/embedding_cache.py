@@ -0,0 +1,168 @@
+import os
+import time
+import sqlite3
+import hashlib
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+##############
+# Parameters #
+##############
+
+CACHE_KEY_VERSION = 1
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024   # vectors kept before least recently used ones are evicted
+EVICT_TO = 0.9                           # eviction frees space down to this fraction of max_bytes
+SQLITE_TIMEOUT = 30                      # seconds to wait on another process holding the write lock
+QUERY_CHUNK = 500                        # keys per SELECT (stays under SQLite's variable limit)
+
+#############
+# Cache key #
+#############
+
+def normalize_text(text: str) -> str:
+    """
+    Collapses whitespace. Text is chunked on whitespace-separated words, so
+    texts that normalize the same embed the same.
+    """
+    return " ".join(text.split())
+
+def content_key(model_name: str, kind: str, data: bytes) -> str:
+    """
+    sha256 over the model name, the kind of content (which should also name any
+    preprocessing parameters, e.g. "text:75") and the raw content bytes.
+    """
+    digest = hashlib.sha256()
+    for part in (str(CACHE_KEY_VERSION).encode(), model_name.encode("utf-8"), kind.encode("utf-8")):
+        digest.update(part)
+        digest.update(b"\0")
+    digest.update(data)
+    return digest.hexdigest()
+
+def text_key(model_name: str, kind: str, text: str) -> str:
+    return content_key(model_name, kind, normalize_text(text).encode("utf-8"))
+
+def file_key(model_name: str, kind: str, path: str) -> str:
+    with open(path, "rb") as f:
+        return content_key(model_name, kind, f.read())
+
+#########
+# Cache #
+#########
+
+class EmbeddingCache:
+    """
+    SQLite table of float32 embedding vectors keyed by content_key. Every hit
+    refreshes the row's last_used time; once the stored vectors exceed max_bytes
+    the least recently used rows are deleted down to EVICT_TO * max_bytes.
+    Several pipeline processes can share one cache file (WAL journal), so the
+    byte total is kept in the file too, by triggers, instead of summed per write.
+    """
+
+    def __init__(self, path: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.conn = sqlite3.connect(path, timeout=SQLITE_TIMEOUT)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY,"
+            " vector BLOB NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self.conn.commit()
+        # Created and seeded under the write lock, so no write is missed by the total
+        self.conn.executescript("""
+            BEGIN IMMEDIATE;
+            CREATE TABLE IF NOT EXISTS cache_stats (
+                id INTEGER PRIMARY KEY CHECK (id = 0),
+                total_bytes INTEGER NOT NULL);
+            INSERT OR IGNORE INTO cache_stats SELECT 0, COALESCE(SUM(size), 0) FROM embeddings;
+            CREATE TRIGGER IF NOT EXISTS embeddings_insert AFTER INSERT ON embeddings BEGIN
+                UPDATE cache_stats SET total_bytes = total_bytes + NEW.size WHERE id = 0;
+            END;
+            CREATE TRIGGER IF NOT EXISTS embeddings_delete AFTER DELETE ON embeddings BEGIN
+                UPDATE cache_stats SET total_bytes = total_bytes - OLD.size WHERE id = 0;
+            END;
+            CREATE TRIGGER IF NOT EXISTS embeddings_resize AFTER UPDATE OF size ON embeddings BEGIN
+                UPDATE cache_stats SET total_bytes = total_bytes + NEW.size - OLD.size WHERE id = 0;
+            END;
+            COMMIT;
+        """)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, List[float]]:
+        """Returns {key: embedding} for the keys that are cached."""
+        keys = list(dict.fromkeys(k for k in keys if k))
+        found = {}
+        for start in range(0, len(keys), QUERY_CHUNK):
+            chunk = keys[start:start + QUERY_CHUNK]
+            marks = ",".join("?" * len(chunk))
+            rows = self.conn.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({marks})", chunk)
+            for key, vector in rows:
+                found[key] = np.frombuffer(vector, dtype=np.float32).tolist()
+        if found:
+            now = time.time()
+            self.conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?",
+                                  [(now, key) for key in found])
+            self.conn.commit()
+        return found
+
+    def get(self, key: str) -> Optional[List[float]]:
+        return self.get_many([key]).get(key)
+
+    def put_many(self, items: Dict[str, List[float]]):
+        """Stores {key: embedding}; None embeddings are skipped. Evicts if over max_bytes."""
+        now = time.time()
+        rows = []
+        for key, embedding in items.items():
+            if key and embedding is not None:
+                vector = np.asarray(embedding, dtype=np.float32).tobytes()
+                rows.append((key, vector, len(vector), now))
+        if not rows:
+            return
+        # An upsert, not INSERT OR REPLACE: its implicit delete would skip the delete trigger
+        self.conn.executemany(
+            "INSERT INTO embeddings (key, vector, size, last_used) VALUES (?, ?, ?, ?)"
+            " ON CONFLICT (key) DO UPDATE SET"
+            " vector = excluded.vector, size = excluded.size, last_used = excluded.last_used", rows
+        )
+        self.conn.commit()
+        self.evict()
+
+    def put(self, key: str, embedding: List[float]):
+        self.put_many({key: embedding})
+
+    def total_bytes(self) -> int:
+        return self.conn.execute("SELECT total_bytes FROM cache_stats WHERE id = 0").fetchone()[0]
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def evict(self) -> int:
+        """
+        Deletes least recently used rows until the cache is back under
+        EVICT_TO * max_bytes. Returns the number of rows deleted.
+        """
+        excess = self.total_bytes() - self.max_bytes
+        if excess <= 0:
+            return 0
+        to_free = excess + int(self.max_bytes * (1 - EVICT_TO))
+        doomed, freed = [], 0
+        for key, size in self.conn.execute("SELECT key, size FROM embeddings ORDER BY last_used"):
+            if freed >= to_free:
+                break
+            doomed.append((key,))
+            freed += size
+        self.conn.executemany("DELETE FROM embeddings WHERE key = ?", doomed)
+        self.conn.commit()
+        print(f"[DEBUG] Evicted {len(doomed)} cached embeddings ({freed / 1024 / 1024:.1f} MB)")
+        return len(doomed)
+
+    def close(self):
+        self.conn.close()
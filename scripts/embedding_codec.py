@@ -0,0 +1,129 @@
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+from bson import decode as bson_decode, encode as bson_encode
+from bson.binary import Binary
+
+##############
+# Parameters #
+##############
+
+# "float": a list of Python floats (what Atlas vector search indexes)
+# "float16": half-precision bytes; "int8": bytes quantized with a per-vector scale
+EMBEDDING_FORMATS = ("float", "float16", "int8")
+DEFAULT_EMBEDDING_FORMAT = "float"
+INT8_LEVELS = 127          # symmetric quantization: value = q * scale, q in [-127, 127]
+
+############
+# Encoding #
+############
+
+def encode_embedding(embedding, fmt: str = DEFAULT_EMBEDDING_FORMAT):
+    """
+    Encodes an embedding for a MongoDB document.
+
+    :param embedding: List (or array) of floats, or None.
+    :param fmt: One of EMBEDDING_FORMATS.
+    :return: The list unchanged for "float"; otherwise a dict
+             {"format", "dim", "data": Binary[, "scale"]}. None stays None.
+    """
+    if embedding is None or fmt == "float":
+        return embedding
+    vector = np.asarray(embedding, dtype=np.float32)
+    if fmt == "float16":
+        return {"format": "float16", "dim": len(vector), "data": Binary(vector.astype("<f2").tobytes())}
+    if fmt == "int8":
+        peak = float(np.abs(vector).max()) if len(vector) else 0.0
+        scale = peak / INT8_LEVELS if peak > 0 else 1.0
+        quantized = np.clip(np.rint(vector / scale), -INT8_LEVELS, INT8_LEVELS).astype(np.int8)
+        return {"format": "int8", "dim": len(vector), "scale": scale, "data": Binary(quantized.tobytes())}
+    raise ValueError(f"Unknown embedding format {fmt!r}; expected one of {EMBEDDING_FORMATS}")
+
+def decode_embedding_array(value):
+    """
+    Float32 array of a stored embedding in any EMBEDDING_FORMATS (None stays None),
+    so readers need not know how a document was written.
+    """
+    if value is None:
+        return None
+    if not isinstance(value, dict):
+        return np.asarray(value, dtype=np.float32)
+    fmt = value.get("format")
+    if fmt == "float16":
+        return np.frombuffer(value["data"], dtype="<f2").astype(np.float32)
+    if fmt == "int8":
+        return np.frombuffer(value["data"], dtype=np.int8).astype(np.float32) * np.float32(value["scale"])
+    raise ValueError(f"Unknown stored embedding format {fmt!r}")
+
+def decode_embedding(value):
+    """Stored embedding as a list of floats (the shape readers always got)."""
+    vector = decode_embedding_array(value)
+    return vector.tolist() if vector is not None and not isinstance(value, list) else value
+
+#############
+# Benchmark #
+#############
+
+def benchmark_embedding_formats(embeddings: np.ndarray, k: int = 10, queries: int = 100, seed: int = 0):
+    """
+    For each format: BSON bytes per embedding, encode time, read time (BSON decode
+    plus dequantization, as a reader pays it), cosine between original and decoded
+    vectors, absolute error of query-to-tile cosine scores, and overlap of the
+    top-k tiles per query with the float results.
+    """
+    rng = np.random.default_rng(seed)
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    unit = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    query_rows = rng.choice(len(unit), min(queries, len(unit)), replace=False)
+    exact_scores = unit[query_rows] @ unit.T
+    exact_top = np.argsort(-exact_scores, axis=1)[:, :k]
+
+    print(f"{len(embeddings)} embeddings of dim {embeddings.shape[1]}")
+    print(f"{'format':>8} {'bytes':>7} {'saved':>6} {'enc (us)':>9} {'read (us)':>9} "
+          f"{'min cos':>9} {'max |dscore|':>13} {'top-' + str(k):>7}")
+    baseline = None
+    for fmt in EMBEDDING_FORMATS:
+        start = time.perf_counter()
+        encoded = [encode_embedding(e.tolist(), fmt) for e in embeddings]
+        encode_us = (time.perf_counter() - start) / len(embeddings) * 1e6
+        raw = [bson_encode({"imageEmbedding": e}) for e in encoded]
+        size = np.mean([len(r) for r in raw])
+        baseline = baseline or size
+
+        start = time.perf_counter()
+        decoded = np.array([decode_embedding_array(bson_decode(r)["imageEmbedding"]) for r in raw],
+                           dtype=np.float32)
+        decode_us = (time.perf_counter() - start) / len(embeddings) * 1e6
+
+        decoded_unit = decoded / np.linalg.norm(decoded, axis=1, keepdims=True)
+        self_cos = np.sum(unit * decoded_unit, axis=1)
+        scores = unit[query_rows] @ decoded_unit.T
+        top = np.argsort(-scores, axis=1)[:, :k]
+        overlap = np.mean([len(set(a) & set(b)) / k for a, b in zip(top, exact_top)])
+        print(f"{fmt:>8} {size:>7.0f} {1 - size / baseline:>6.0%} {encode_us:>9.1f} {decode_us:>9.1f} "
+              f"{self_cos.min():>9.6f} {np.abs(scores - exact_scores).max():>13.2e} {overlap:>7.3f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare stored embedding formats (size and similarity error).")
+    parser.add_argument("--cache", help="Embedding cache (SQLite) to take real embeddings from; "
+                                        "synthetic vectors are used if omitted.")
+    parser.add_argument("--count", type=int, default=2000, help="Synthetic embeddings when --cache is not given.")
+    parser.add_argument("--dim", type=int, default=512)
+    args = parser.parse_args()
+
+    if args.cache:
+        if not os.path.isfile(args.cache):
+            print(f"Embedding cache not found: {args.cache}", file=sys.stderr)
+            sys.exit(1)
+        from embedding_cache import EmbeddingCache
+        cache = EmbeddingCache(args.cache)
+        rows = cache.conn.execute("SELECT vector FROM embeddings").fetchall()
+        vectors = np.array([np.frombuffer(row[0], dtype=np.float32) for row in rows])
+    else:
+        # CLIP-like: a shared offset plus a spread of directions
+        rng = np.random.default_rng(0)
+        vectors = 0.5 * rng.standard_normal(args.dim) + rng.standard_normal((args.count, args.dim))
+    benchmark_embedding_formats(vectors)
@@ -1,8 +1,9 @@
 import os
 import sys
-import json
 import pdfplumber
 
+from pipeline_artifacts import save_json
+
 def extract_embedded_text(pdf_path, output_json):
     """
     Extracts embedded text from a PDF file and saves it as a JSON file,
@@ -49,8 +50,7 @@ def extract_embedded_text(pdf_path, output_json):
 
     # Save results to JSON
     os.makedirs(os.path.dirname(output_json), exist_ok=True)
-    with open(output_json, "w", encoding="utf-8") as f:
-        json.dump(results, f, indent=2)
+    save_json(results, output_json, indent=2)
 
     print(f"Embedded text extracted and saved to {output_json}")
 
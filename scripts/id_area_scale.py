@@ -4,6 +4,7 @@ import sys
 import os
 from collections import defaultdict, Counter
 from config import DATA_OUTPUT  # Ensure config.py is in the proper path
+from pipeline_artifacts import load_json
 
 # --- Helper Functions ---
 
@@ -157,24 +158,17 @@ def merge_line_entries(line_entries, horizontal_gap_threshold=10):
 
 # --- Main Processing ---
 
-def main():
-    if len(sys.argv) < 2:
-        print("Usage: python id_area_scale.py <merged_results.json>")
-        sys.exit(1)
-    
-    json_path = sys.argv[1]
+def id_area_scale(json_path):
+    """
+    Finds the plan scale, areas and blueprint titles in merged_results.json and
+    writes plan_area_scale.json (plus blob_debug.json) under DATA_OUTPUT/results.
+    """
     if not os.path.isfile(json_path):
-        print(f"File not found: {json_path}")
-        sys.exit(1)
-    
+        raise FileNotFoundError(f"File not found: {json_path}")
+
     # Load merged_results.json
-    try:
-        with open(json_path, 'r', encoding='utf-8') as f:
-            merged_data = json.load(f)
-    except Exception as e:
-        print(f"Error reading {json_path}: {e}")
-        sys.exit(1)
-    
+    merged_data = load_json(json_path)
+
     # Group text entries by page_index
     pages_entries = defaultdict(list)
     for entry in merged_data:
@@ -252,5 +246,20 @@ def main():
     with open(blob_debug_path, 'w', encoding='utf-8') as f_blob:
         json.dump(blob_debug, f_blob, indent=2)
 
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python id_area_scale.py <merged_results.json>")
+        sys.exit(1)
+
+    json_path = sys.argv[1]
+    try:
+        id_area_scale(json_path)
+    except FileNotFoundError as e:
+        print(e)
+        sys.exit(1)
+    except ValueError as e:
+        print(f"Error reading {json_path}: {e}")
+        sys.exit(1)
+
 if __name__ == '__main__':
     main()
\ No newline at end of file
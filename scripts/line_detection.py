@@ -1,9 +1,35 @@
 import os
 import sys
 import json
+import time
 import cv2
 import numpy as np
+import math
 import argparse
+from collections import defaultdict
+from functools import partial
+
+from line_store import line_store_dir, write_line_store
+from pipeline_artifacts import load_json
+from worker_pool import process_pool
+
+DEFAULT_WORKERS = os.cpu_count() or 1
+
+# Cross-tile stitching tolerances (PDF points / degrees)
+STITCH_ANGLE_TOL_DEG = 2.0   # max direction difference for collinear segments
+STITCH_DIST_TOL = 1.0        # max perpendicular offset between collinear segments
+STITCH_GAP_TOL = 2.5         # max gap along the line that still joins two segments (~maxLineGap at 300 DPI)
+STITCH_GRID_CELL = 32.0      # spatial hash cell size
+
+# Full-page mode: render once at a lower DPI than OCR and detect on the page (or strips)
+HOUGH_REFERENCE_DPI = 300    # DPI the Hough/filter parameters below were tuned at
+LINE_DPI = 150
+STRIP_HEIGHT = 0             # strip height in px at LINE_DPI; 0 = whole page
+STRIP_OVERLAP = 64           # px overlap between strips (duplicates are stitched)
+RECALL_TOL = 2.0             # PDF points; used by compare_line_modes
+
+# Text masking: blank OCR/embedded text boxes before edge detection
+TEXT_MASK_PAD_PT = 1.0       # PDF points of padding around each text bbox
 
 def tile_coords_to_pdf_bottom_left(px, py, tile_info):
     """
@@ -27,18 +53,18 @@ def tile_coords_to_pdf_bottom_left(px, py, tile_info):
 
     return (pdfx_top, pdfy_bottom)
 
-def detect_lines_in_image(image_path, tile_info):
+def detect_lines_in_image(image_path, tile_info, engine=None, mask_rects=None):
     """
     1) Reads the tile image in grayscale,
-    2) Applies a bilateral filter to reduce noise while preserving edges,
-    3) Runs Canny edge detection,
-    4) Applies a morphological close to unify line edges,
-    5) Uses HoughLinesP for probabilistic line detection,
-    6) Converts the resulting line endpoints from tile pixels to PDF/page coords,
-    7) Returns a list of line dicts with 'pdf_line', 'rho', 'theta' (optional).
+    2) Runs the selected line detector engine (default "hough": bilateral filter,
+       Canny, morphological close, HoughLinesP),
+    3) Converts the resulting line endpoints from tile pixels to PDF/page coords,
+    4) Returns a list of line dicts with 'pdf_line'.
     
     :param image_path: Path to the tile PNG.
     :param tile_info: Dict from tile_meta (x_start, y_start, zoom_factor, etc.).
+    :param engine: Key of LINE_DETECTORS (defaults to DEFAULT_ENGINE).
+    :param mask_rects: Optional tile-pixel rects (x0, y0, x1, y1) to blank out first (text regions).
     :return: List of line entries with page-based coords.
     """
     # --- 1) Load grayscale
@@ -46,60 +72,275 @@ def detect_lines_in_image(image_path, tile_info):
     if image is None:
         raise FileNotFoundError(f"Failed to load image: {image_path}")
 
-    # --- 2) Bilateral filter to smooth out minor text noise
+    return detect_lines_in_array(image, tile_info, engine=engine, mask_rects=mask_rects)
+
+##########################
+# Line detector engines  #
+##########################
+# Each engine takes a grayscale uint8 image and a scale (render DPI / HOUGH_REFERENCE_DPI)
+# and returns pixel segments as an iterable of (x1, y1, x2, y2).
+
+def scaled_px(value, scale):
+    """Pixel-sized parameter tuned at HOUGH_REFERENCE_DPI, rescaled to the render DPI."""
+    return max(1, int(round(value * scale)))
+
+def hough_engine(image, scale=1.0):
+    """
+    Bilateral filter + Canny + morphological close + probabilistic Hough (the original detector).
+    """
+    def px(value):
+        return scaled_px(value, scale)
+
+    # Bilateral filter to smooth out minor text noise
     #     d=9, sigmaColor=75, sigmaSpace=75 are typical defaults
-    filtered = cv2.bilateralFilter(image, d=9, sigmaColor=75, sigmaSpace=75)
+    filtered = cv2.bilateralFilter(image, d=px(9), sigmaColor=75, sigmaSpace=75)
 
-    # --- 3) Canny
+    # Canny
     edges = cv2.Canny(filtered, 50, 150, apertureSize=3)
 
-    # --- 4) Morphological close to connect line segments
+    # Morphological close to connect line segments
     kernel = np.ones((3, 3), np.uint8)
     closed = cv2.morphologyEx(edges, cv2.MORPH_CLOSE, kernel, iterations=1)
 
-    # --- 5) Probabilistic Hough transform
+    # Probabilistic Hough transform
     # tune threshold, minLineLength, maxLineGap as needed
     lines_p = cv2.HoughLinesP(
         closed, 
         rho=1, 
         theta=np.pi / 180, 
-        threshold=80,        # min votes in accumulator
-        minLineLength=50,    # discard short segments
-        maxLineGap=10        # merge gaps in collinear lines
+        threshold=px(80),        # min votes in accumulator
+        minLineLength=px(50),    # discard short segments
+        maxLineGap=px(10)        # merge gaps in collinear lines
     )
+    return [] if lines_p is None else (line[0] for line in lines_p)
+
+def filter_short_segments(lines, min_length):
+    if lines is None:
+        return []
+    lines = np.asarray(lines, dtype=np.float64).reshape(-1, 4)
+    lengths = np.hypot(lines[:, 2] - lines[:, 0], lines[:, 3] - lines[:, 1])
+    return lines[lengths >= min_length]
+
+def lsd_engine(image, scale=1.0):
+    """
+    OpenCV's Line Segment Detector on the raw grayscale image (no pre-filtering),
+    keeping segments at least as long as Hough's minLineLength.
+    """
+    detector = cv2.createLineSegmentDetector(cv2.LSD_REFINE_STD)
+    lines = detector.detect(image)[0]
+    return filter_short_segments(lines, scaled_px(50, scale))
+
+def fld_engine(image, scale=1.0):
+    """
+    FastLineDetector from opencv-contrib (cv2.ximgproc), which is not part of the
+    default opencv-python-headless install.
+    """
+    if not hasattr(cv2, "ximgproc"):
+        raise RuntimeError("The 'fld' engine requires opencv-contrib-python-headless (cv2.ximgproc).")
+    detector = cv2.ximgproc.createFastLineDetector(
+        length_threshold=scaled_px(50, scale),
+        distance_threshold=1.41421356,
+        canny_th1=50.0,
+        canny_th2=150.0,
+        canny_aperture_size=3,
+        do_merge=True
+    )
+    return filter_short_segments(detector.detect(image), scaled_px(50, scale))
+
+def morph_engine(image, scale=1.0):
+    """
+    Orientation-specific morphological extractor for horizontal and vertical
+    linework: binarize, open with long 1-px-thick kernels so only straight H/V
+    runs survive, then turn each connected run into a center-line segment.
+    Diagonal lines are not detected.
+    """
+    min_length = scaled_px(50, scale)
+    max_thickness = scaled_px(40, scale)  # thicker blobs are fills/hatching, not lines
+
+    _, binary = cv2.threshold(image, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+    # bridge small breaks (e.g. dashed or anti-aliased strokes) before opening
+    gap = scaled_px(10, scale)
+
+    segments = []
+    for horizontal in (True, False):
+        close_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (gap, 1) if horizontal else (1, gap))
+        open_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (min_length, 1) if horizontal else (1, min_length))
+        mask = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, close_kernel)
+        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, open_kernel)
+
+        count, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+        for label in range(1, count):
+            x, y, w, h = stats[label, :4]
+            if horizontal and w >= min_length and h <= max_thickness:
+                cy = y + (h - 1) / 2.0
+                segments.append((x, cy, x + w - 1, cy))
+            elif not horizontal and h >= min_length and w <= max_thickness:
+                cx = x + (w - 1) / 2.0
+                segments.append((cx, y, cx, y + h - 1))
+    return segments
+
+LINE_DETECTORS = {
+    "hough": hough_engine,
+    "lsd": lsd_engine,
+    "fld": fld_engine,
+    "morph": morph_engine,
+}
+DEFAULT_ENGINE = "hough"
+
+def detect_lines_in_array(image, tile_info, scale=1.0, engine=None, mask_rects=None):
+    """
+    Runs a LINE_DETECTORS engine on an already-loaded grayscale array and converts
+    its pixel segments to PDF/page coords. Pixel-sized parameters are tuned at
+    HOUGH_REFERENCE_DPI and multiplied by scale (render DPI / HOUGH_REFERENCE_DPI)
+    so they cover the same PDF distances. Any mask_rects are painted white first.
+    """
+    detector = LINE_DETECTORS[engine or DEFAULT_ENGINE]
+
+    if mask_rects is not None and len(mask_rects):
+        image = image.copy()
+        for x0, y0, x1, y1 in mask_rects:
+            image[y0:y1, x0:x1] = 255
 
     # We'll store each line in PDF coords
     lines_list = []
-    if lines_p is not None:
-        for line in lines_p:
-            x1, y1, x2, y2 = line[0]
-            pdf_pt1 = tile_coords_to_pdf_bottom_left(x1, y1, tile_info)
-            pdf_pt2 = tile_coords_to_pdf_bottom_left(x2, y2, tile_info)
-            lines_list.append({
-                "pdf_line": [pdf_pt1, pdf_pt2]
-            })
+    for x1, y1, x2, y2 in detector(image, scale):
+        pdf_pt1 = tile_coords_to_pdf_bottom_left(float(x1), float(y1), tile_info)
+        pdf_pt2 = tile_coords_to_pdf_bottom_left(float(x2), float(y2), tile_info)
+        lines_list.append({
+            "pdf_line": [pdf_pt1, pdf_pt2]
+        })
 
     return lines_list
 
-def process_line_detection(input_dir, tile_meta_path, output_path):
+##################
+# Text masking   #
+##################
+
+def load_text_boxes(paths):
     """
-    1) Loads tile_meta.json to get x_start, y_start, zoom_factor for each tile,
-    2) For each .png tile, runs detect_lines_in_image(...),
-    3) Writes final lines in PDF/page coords to line_detection_results.json.
-    
-    :param input_dir: Directory containing page_<idx>/tile_*.png
-    :param tile_meta_path: Path to tile_meta.json
-    :param output_path: JSON file for storing line detection results.
+    Reads text bboxes (bottom-left PDF coords) from ocr_results.json / embedded_text.json
+    style files and returns {page_index: float array (N, 4)}. Missing files and
+    entries without a bbox are skipped.
     """
-    if not os.path.isdir(input_dir):
-        raise NotADirectoryError(f"Input directory not found: {input_dir}")
+    boxes = defaultdict(list)
+    for path in paths:
+        if not path or not os.path.isfile(path):
+            print(f"[DEBUG] Text file for masking not found: {path} (skipping)")
+            continue
+        with open(path, 'r', encoding='utf-8') as f:
+            entries = json.load(f)
+        for entry in entries:
+            bbox = entry.get("bbox")
+            if bbox is None or len(bbox) != 4 or entry.get("page_index") is None:
+                continue
+            boxes[entry["page_index"]].append(bbox)
+    return {page: np.asarray(b, dtype=np.float64) for page, b in boxes.items()}
 
-    if not os.path.isfile(tile_meta_path):
-        raise FileNotFoundError(f"Tile metadata file not found: {tile_meta_path}")
+def text_mask_rects(page_boxes, tile_info, width, height, pad_pt=TEXT_MASK_PAD_PT):
+    """
+    Maps bottom-left PDF text bboxes into a tile's (or strip's) pixel frame and
+    returns the int rects (x0, y0, x1, y1) that intersect it, clipped to width x height.
+    """
+    if page_boxes is None or len(page_boxes) == 0:
+        return np.empty((0, 4), dtype=np.int64)
 
-    with open(tile_meta_path, 'r', encoding='utf-8') as f:
-        tile_metadata = json.load(f)
+    zoom = tile_info["zoom_factor"]
+    pdf_h = tile_info["pdf_height_points"]
+    x0 = (page_boxes[:, 0] - pad_pt) * zoom - tile_info["x_start"]
+    x1 = (page_boxes[:, 2] + pad_pt) * zoom - tile_info["x_start"]
+    # bottom-left y -> top-based pixel rows (y1 is the top edge of the box)
+    y0 = (pdf_h - page_boxes[:, 3] - pad_pt) * zoom - tile_info["y_start"]
+    y1 = (pdf_h - page_boxes[:, 1] + pad_pt) * zoom - tile_info["y_start"]
+
+    rects = np.stack([
+        np.clip(np.floor(x0), 0, width),
+        np.clip(np.floor(y0), 0, height),
+        np.clip(np.ceil(x1), 0, width),
+        np.clip(np.ceil(y1), 0, height),
+    ], axis=1).astype(np.int64)
+    keep = (rects[:, 2] > rects[:, 0]) & (rects[:, 3] > rects[:, 1])
+    return rects[keep]
+
+def detect_lines_full_page(pdf_path, line_dpi=LINE_DPI, strip_height=STRIP_HEIGHT,
+                           strip_overlap=STRIP_OVERLAP, engine=None, text_boxes=None):
+    """
+    Renders each PDF page once at line_dpi (independent of the OCR tiles) and runs
+    line detection on the whole page, or on horizontal strips of strip_height px
+    to bound memory. Returns entries in the same bottom-left PDF coordinate schema
+    as the tile mode; image_path is None since no tile image is involved.
+    If text_boxes ({page_index: PDF bboxes}) is given, those regions are blanked first.
+    """
+    import fitz  # PyMuPDF, only needed for this mode
+
+    zoom = line_dpi / 72.0
+    scale = line_dpi / HOUGH_REFERENCE_DPI
+    results = []
+
+    pdf_doc = fitz.open(pdf_path)
+    for page_index in range(len(pdf_doc)):
+        page = pdf_doc[page_index]
+        page_height = int(page.rect.height * zoom)
+
+        if strip_height <= 0 or strip_height >= page_height:
+            strips = [(0, page_height)]
+        else:
+            step = max(1, strip_height - strip_overlap)
+            strips = [(y, min(y + strip_height, page_height)) for y in range(0, page_height, step)]
+
+        for y_start, y_end in strips:
+            clip = fitz.Rect(0, y_start / zoom, page.rect.width, y_end / zoom)
+            pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY,
+                                  clip=clip, alpha=False)
+            image = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.stride)[:, :pix.width]
+
+            strip_info = {
+                "x_start": 0,
+                "y_start": y_start,
+                "zoom_factor": zoom,
+                "pdf_height_points": page.rect.height,
+            }
+            mask_rects = None
+            if text_boxes is not None:
+                mask_rects = text_mask_rects(text_boxes.get(page_index), strip_info, pix.width, pix.height)
+            for seg in detect_lines_in_array(np.ascontiguousarray(image), strip_info,
+                                             scale=scale, engine=engine, mask_rects=mask_rects):
+                results.append({
+                    "page_index": page_index,
+                    "image_path": None,
+                    "pdf_line": seg["pdf_line"]
+                })
+    pdf_doc.close()
+
+    return results
+
+def init_line_worker(cv_threads):
+    """
+    Process-pool initializer: caps OpenCV's own thread pool so N workers
+    don't each spin up a thread per core.
+    """
+    if cv_threads is not None:
+        cv2.setNumThreads(cv_threads)
+
+def detect_tile_task(task, engine=None):
+    """
+    Pool entry point: runs detect_lines_in_image for one (image_path, page_idx, tile_info, mask_rects)
+    and returns (line_segments, error, seconds).
+    """
+    image_path, _, tile_info, mask_rects = task
+    start = time.perf_counter()
+    try:
+        lines = detect_lines_in_image(image_path, tile_info, engine=engine, mask_rects=mask_rects)
+        return lines, None, time.perf_counter() - start
+    except Exception as e:
+        return [], str(e), time.perf_counter() - start
 
+def collect_tile_tasks(input_dir, tile_metadata, text_boxes=None):
+    """
+    Pairs every .png under input_dir with its tile_meta entry, in sorted path order
+    so results come out the same regardless of filesystem or worker scheduling.
+    Each task is (image_path, page_idx, tile_info, mask_rects); mask_rects are the
+    text boxes mapped into the tile when text_boxes is given, else None.
+    """
     # Build a quick lookup: tile_info_map[(page_idx, tile_filename)] = tile_entry
     tile_info_map = {}
     for meta in tile_metadata:
@@ -108,53 +349,500 @@ def process_line_detection(input_dir, tile_meta_path, output_path):
         tile_key = (page_idx, tile_fn)
         tile_info_map[tile_key] = meta
 
-    results = []
-    for root, _, files in os.walk(input_dir):
-        for file in files:
+    tasks = []
+    for root, dirs, files in os.walk(input_dir):
+        dirs.sort()
+        for file in sorted(files):
             if file.lower().endswith(".png"):
                 image_path = os.path.join(root, file)
 
-                # find matching tile_meta
+                # find matching tile_meta: prefer the page_<idx> folder, else the first page with this filename
                 tile_filename = os.path.basename(image_path)
-                # Guess page index from folder or rely on tile_info_map if you have a direct approach
-                # For now let's do a naive approach:
-                possible_keys = [k for k in tile_info_map.keys() if k[1] == tile_filename]
-                if not possible_keys:
-                    print(f"Metadata not found for tile: {tile_filename}. Skipping.")
-                    continue
-
-                # If there's only one match or you trust there's only one
-                page_idx, _ = possible_keys[0]
+                folder = os.path.basename(root)
+                page_str = folder[len("page_"):] if folder.startswith("page_") else ""
+                if page_str.isdigit() and (int(page_str), tile_filename) in tile_info_map:
+                    page_idx = int(page_str)
+                else:
+                    possible_keys = [k for k in tile_info_map.keys() if k[1] == tile_filename]
+                    if not possible_keys:
+                        print(f"Metadata not found for tile: {tile_filename}. Skipping.")
+                        continue
+                    page_idx, _ = possible_keys[0]
+
                 tile_info = tile_info_map[(page_idx, tile_filename)]
+                mask_rects = None
+                if text_boxes is not None:
+                    mask_rects = text_mask_rects(text_boxes.get(page_idx), tile_info,
+                                                 tile_info["tile_width"], tile_info["tile_height"])
+                tasks.append((image_path, page_idx, tile_info, mask_rects))
+    return tasks
+
+def run_tile_tasks(tasks, workers=1, cv_threads=None, engine=None):
+    """
+    Runs detect_tile_task over tasks, serially (workers <= 1) or on a process pool.
+    Results are returned in task order either way.
+    """
+    if workers <= 1 or len(tasks) <= 1:
+        init_line_worker(cv_threads)
+        return [detect_tile_task(task, engine) for task in tasks]
+
+    with process_pool(min(workers, len(tasks)),
+                      initializer=init_line_worker,
+                      initargs=(cv_threads if cv_threads is not None else 1,)) as pool:
+        return list(pool.map(partial(detect_tile_task, engine=engine), tasks))
+
+def process_line_detection(input_dir, tile_meta_path, output_path, workers=1, cv_threads=None,
+                           stitch=True, mode="tiles", pdf_path=None, line_dpi=LINE_DPI,
+                           strip_height=STRIP_HEIGHT, engine=DEFAULT_ENGINE, text_paths=None):
+    """
+    1) Loads tile_meta.json to get x_start, y_start, zoom_factor for each tile,
+    2) For each .png tile, runs detect_lines_in_image(...), optionally on a process pool,
+    3) Writes final lines in PDF/page coords to line_detection_results.json.
+    
+    :param input_dir: Directory containing page_<idx>/tile_*.png
+    :param tile_meta_path: Path to tile_meta.json
+    :param output_path: JSON file for storing line detection results.
+    :param workers: Number of worker processes (1 = serial, in-process).
+    :param cv_threads: cv2.setNumThreads value per worker (pool default 1; serial default untouched).
+    :param stitch: If True, merge collinear duplicates across overlapping tiles per page.
+    :param mode: "tiles" (reuse the OCR tiles) or "page" (render pdf_path at line_dpi).
+    :param pdf_path: Source PDF, required for mode="page".
+    :param line_dpi: Render DPI for mode="page".
+    :param strip_height: Strip height in px for mode="page" (0 = whole page).
+    :param engine: Line detector engine, a key of LINE_DETECTORS.
+    :param text_paths: Optional list of text JSON files (ocr_results.json, embedded_text.json)
+                       whose bboxes are blanked out before detection.
+    """
+    text_boxes = load_text_boxes(text_paths) if text_paths else None
+    if text_boxes is not None:
+        print(f"[DEBUG] Masking {sum(len(b) for b in text_boxes.values())} text boxes before line detection")
+
+    if mode == "page":
+        if not pdf_path or not os.path.isfile(pdf_path):
+            raise FileNotFoundError(f"PDF not found for full-page line detection: {pdf_path}")
 
-                try:
-                    line_segments = detect_lines_in_image(image_path, tile_info)
+        start = time.perf_counter()
+        results = detect_lines_full_page(pdf_path, line_dpi=line_dpi, strip_height=strip_height,
+                                         engine=engine, text_boxes=text_boxes)
+        print(f"[DEBUG] Detected lines on full pages at {line_dpi} DPI in {time.perf_counter() - start:.2f}s")
 
-                    # Add them to results
-                    for seg in line_segments:
-                        results.append({
-                            "page_index": page_idx,
-                            "image_path": image_path,
-                            "pdf_line": seg["pdf_line"]
-                        })
-                except Exception as e:
-                    print(f"Error processing {image_path}: {e}")
+        if stitch:
+            results = stitch_line_results(results)
+        write_line_results(results, output_path)
+        return
 
+    if not os.path.isdir(input_dir):
+        raise NotADirectoryError(f"Input directory not found: {input_dir}")
+
+    if not os.path.isfile(tile_meta_path):
+        raise FileNotFoundError(f"Tile metadata file not found: {tile_meta_path}")
+
+    tile_metadata = load_json(tile_meta_path)
+
+    tasks = collect_tile_tasks(input_dir, tile_metadata, text_boxes=text_boxes)
+
+    start = time.perf_counter()
+    outcomes = run_tile_tasks(tasks, workers=workers, cv_threads=cv_threads, engine=engine)
+    elapsed = time.perf_counter() - start
+
+    results = []
+    for (image_path, page_idx, *_), (line_segments, error, _) in zip(tasks, outcomes):
+        if error:
+            print(f"Error processing {image_path}: {error}")
+            continue
+
+        # Add them to results
+        for seg in line_segments:
+            results.append({
+                "page_index": page_idx,
+                "image_path": image_path,
+                "pdf_line": seg["pdf_line"]
+            })
+
+    print(f"[DEBUG] Detected lines in {len(tasks)} tiles in {elapsed:.2f}s "
+          f"(engine={engine}, workers={workers})")
+
+    if stitch:
+        results = stitch_line_results(results)
+    write_line_results(results, output_path)
+
+def write_line_results(results, output_path):
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
     with open(output_path, 'w', encoding='utf-8') as f:
         json.dump(results, f, indent=4)
 
+    # Columnar copy for downstream steps (memory-mapped by load_line_table)
+    write_line_store(results, line_store_dir(output_path), source_path=output_path)
+
     print(f"Line detection results saved to {output_path}")
 
+class _UnionFind:
+    def __init__(self, n):
+        self.parent = list(range(n))
+
+    def find(self, i):
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def union(self, i, j):
+        ri, rj = self.find(i), self.find(j)
+        if ri != rj:
+            self.parent[max(ri, rj)] = min(ri, rj)
+
+def stitch_page_segments(segments,
+                         angle_tol_deg=STITCH_ANGLE_TOL_DEG,
+                         dist_tol=STITCH_DIST_TOL,
+                         gap_tol=STITCH_GAP_TOL,
+                         grid_cell=STITCH_GRID_CELL):
+    """
+    Merges collinear, overlapping (or nearly touching) segments from one page,
+    e.g. the same wall detected in two overlapping tiles.
+
+    Segments are bucketed by direction, then hashed into a grid by their
+    tolerance-expanded bounding box; only segments in the same or adjacent
+    angle bucket and a shared grid cell are compared. Each connected group is
+    replaced by one segment spanning the group along its length-weighted
+    direction.
+
+    :param segments: List of ((x1, y1), (x2, y2)) in PDF coords.
+    :return: List of (segment, member_indices), in order of each group's first member.
+    """
+    n = len(segments)
+    if n == 0:
+        return []
+
+    pts = np.asarray(segments, dtype=np.float64).reshape(n, 4)
+    dx = pts[:, 2] - pts[:, 0]
+    dy = pts[:, 3] - pts[:, 1]
+    lengths = np.hypot(dx, dy)
+    angles = np.mod(np.arctan2(dy, dx), np.pi)  # undirected, [0, pi)
+
+    angle_tol = math.radians(angle_tol_deg)
+    num_buckets = max(1, int(math.ceil(math.pi / angle_tol)))
+    buckets = np.minimum((angles / angle_tol).astype(np.int64), num_buckets - 1)
+
+    pad = max(dist_tol, gap_tol)
+    min_x = (np.minimum(pts[:, 0], pts[:, 2]) - pad) // grid_cell
+    max_x = (np.maximum(pts[:, 0], pts[:, 2]) + pad) // grid_cell
+    min_y = (np.minimum(pts[:, 1], pts[:, 3]) - pad) // grid_cell
+    max_y = (np.maximum(pts[:, 1], pts[:, 3]) + pad) // grid_cell
+
+    grid = defaultdict(list)
+    for i in range(n):
+        for cx in range(int(min_x[i]), int(max_x[i]) + 1):
+            for cy in range(int(min_y[i]), int(max_y[i]) + 1):
+                grid[(int(buckets[i]), cx, cy)].append(i)
+
+    uf = _UnionFind(n)
+    for i in range(n):
+        if lengths[i] == 0:
+            continue
+        seen = set()
+        for db in (-1, 0, 1):
+            b = (int(buckets[i]) + db) % num_buckets
+            for cx in range(int(min_x[i]), int(max_x[i]) + 1):
+                for cy in range(int(min_y[i]), int(max_y[i]) + 1):
+                    for j in grid.get((b, cx, cy), ()):
+                        if j > i and j not in seen:
+                            seen.add(j)
+
+        for j in seen:
+            if lengths[j] == 0 or uf.find(i) == uf.find(j):
+                continue
+            diff = abs(angles[i] - angles[j])
+            if min(diff, math.pi - diff) > angle_tol:
+                continue
+
+            # measure against the longer segment's line
+            a, c = (i, j) if lengths[i] >= lengths[j] else (j, i)
+            ux, uy = dx[a] / lengths[a], dy[a] / lengths[a]
+            ox, oy = pts[a, 0], pts[a, 1]
+            rel_x = pts[c, [0, 2]] - ox
+            rel_y = pts[c, [1, 3]] - oy
+            if np.max(np.abs(rel_x * -uy + rel_y * ux)) > dist_tol:
+                continue
+            along = rel_x * ux + rel_y * uy
+            if along.max() < -gap_tol or along.min() > lengths[a] + gap_tol:
+                continue
+
+            uf.union(i, j)
+
+    groups = defaultdict(list)
+    for i in range(n):
+        groups[uf.find(i)].append(i)
+
+    stitched = []
+    for root in sorted(groups):
+        members = groups[root]
+        if len(members) == 1:
+            stitched.append((segments[members[0]], members))
+            continue
+
+        # Length-weighted direction (doubled angles handle the 0/pi wrap)
+        w = lengths[members]
+        theta = 0.5 * math.atan2(float(np.sum(w * np.sin(2 * angles[members]))),
+                                 float(np.sum(w * np.cos(2 * angles[members]))))
+        ux, uy = math.cos(theta), math.sin(theta)
+        nx, ny = -uy, ux
+
+        xs = pts[members][:, [0, 2]].ravel()
+        ys = pts[members][:, [1, 3]].ravel()
+        along = xs * ux + ys * uy
+        mid_x = 0.5 * (pts[members, 0] + pts[members, 2])
+        mid_y = 0.5 * (pts[members, 1] + pts[members, 3])
+        offset = float(np.sum(w * (mid_x * nx + mid_y * ny)) / np.sum(w)) if np.sum(w) else 0.0
+
+        t0, t1 = float(along.min()), float(along.max())
+        p1 = (t0 * ux + offset * nx, t0 * uy + offset * ny)
+        p2 = (t1 * ux + offset * nx, t1 * uy + offset * ny)
+        stitched.append(((p1, p2), members))
+
+    return stitched
+
+def stitch_line_results(results):
+    """
+    Runs stitch_page_segments page by page over line_detection result entries.
+    Merged segments keep the page_index and image_path of their longest member.
+    """
+    by_page = defaultdict(list)
+    for entry in results:
+        by_page[entry["page_index"]].append(entry)
+
+    stitched_results = []
+    for page_idx in sorted(by_page, key=lambda p: (p is None, p)):
+        entries = by_page[page_idx]
+        segments = [tuple(tuple(pt) for pt in e["pdf_line"]) for e in entries]
+        for segment, members in stitch_page_segments(segments):
+            longest = max(members, key=lambda m: math.dist(*segments[m]))
+            stitched_results.append({
+                "page_index": page_idx,
+                "image_path": entries[longest]["image_path"],
+                "pdf_line": [list(segment[0]), list(segment[1])]
+            })
+
+    if results:
+        ratio = 1.0 - len(stitched_results) / len(results)
+        print(f"[DEBUG] Stitched {len(results)} segments into {len(stitched_results)} "
+              f"({ratio:.1%} reduction)")
+    return stitched_results
+
+def benchmark_line_detection(input_dir, tile_meta_path, worker_counts=(1, 2, 4), cv_threads=1):
+    """
+    Times the serial loop against process pools of increasing size on the same tiles,
+    reporting total wall time and mean per-tile detection time, and checks that
+    every mode returns identical segments.
+    """
+    with open(tile_meta_path, 'r', encoding='utf-8') as f:
+        tile_metadata = json.load(f)
+    tasks = collect_tile_tasks(input_dir, tile_metadata)
+    if not tasks:
+        print("No tiles found to benchmark.")
+        return
+
+    baseline = None
+    print(f"{'workers':>8} {'total (s)':>10} {'per tile (s)':>13} {'speedup':>8}")
+    for workers in worker_counts:
+        start = time.perf_counter()
+        outcomes = run_tile_tasks(tasks, workers=workers,
+                                  cv_threads=cv_threads if workers > 1 else None)
+        total = time.perf_counter() - start
+        per_tile = sum(o[2] for o in outcomes) / len(outcomes)
+        segments = [o[0] for o in outcomes]
+
+        if baseline is None:
+            baseline = (total, segments)
+        elif segments != baseline[1]:
+            raise AssertionError(f"Segments differ with workers={workers}")
+
+        print(f"{workers:>8} {total:>10.3f} {per_tile:>13.4f} {baseline[0] / total:>7.2f}x")
+
+def benchmark_engines(input_dir, tile_meta_path, engines=None):
+    """
+    Runs each line detector engine serially over the same tiles and reports total
+    time, mean per-tile time, raw segment count and segment count after stitching.
+    """
+    with open(tile_meta_path, 'r', encoding='utf-8') as f:
+        tile_metadata = json.load(f)
+    tasks = collect_tile_tasks(input_dir, tile_metadata)
+    if not tasks:
+        print("No tiles found to benchmark.")
+        return
+
+    print(f"{'engine':>8} {'total (s)':>10} {'per tile (s)':>13} {'segments':>9} {'stitched':>9}")
+    for engine in engines or LINE_DETECTORS:
+        start = time.perf_counter()
+        outcomes = run_tile_tasks(tasks, engine=engine)
+        total = time.perf_counter() - start
+
+        errors = {o[1] for o in outcomes if o[1]}
+        if errors:
+            print(f"{engine:>8} skipped: {errors.pop()}")
+            continue
+
+        results = [{"page_index": page_idx, "image_path": image_path, "pdf_line": seg["pdf_line"]}
+                   for (image_path, page_idx, *_), o in zip(tasks, outcomes) for seg in o[0]]
+        stitched = stitch_line_results(results)
+        per_tile = sum(o[2] for o in outcomes) / len(outcomes)
+        print(f"{engine:>8} {total:>10.3f} {per_tile:>13.4f} {len(results):>9} {len(stitched):>9}")
+
+def compare_text_masking(input_dir, tile_meta_path, text_paths, engine=None):
+    """
+    Runs tile-mode detection with and without text masking and reports runtime,
+    raw and stitched segment counts, and the drop between them.
+    """
+    with open(tile_meta_path, 'r', encoding='utf-8') as f:
+        tile_metadata = json.load(f)
+    text_boxes = load_text_boxes(text_paths)
+
+    rows = {}
+    for label, boxes in (("unmasked", None), ("masked", text_boxes)):
+        start = time.perf_counter()
+        tasks = collect_tile_tasks(input_dir, tile_metadata, text_boxes=boxes)
+        outcomes = run_tile_tasks(tasks, engine=engine)
+        elapsed = time.perf_counter() - start
+        results = [{"page_index": page_idx, "image_path": image_path, "pdf_line": seg["pdf_line"]}
+                   for (image_path, page_idx, *_), o in zip(tasks, outcomes) for seg in o[0]]
+        rows[label] = (elapsed, len(results), len(stitch_line_results(results)))
+
+    print(f"text boxes masked: {sum(len(b) for b in text_boxes.values())}")
+    print(f"{'':>9} {'time (s)':>9} {'segments':>9} {'stitched':>9}")
+    for label, (elapsed, raw, stitched) in rows.items():
+        print(f"{label:>9} {elapsed:>9.3f} {raw:>9} {stitched:>9}")
+    (t0, r0, s0), (t1, r1, s1) = rows["unmasked"], rows["masked"]
+    if r0 and s0 and t0:
+        print(f"{'change':>9} {(t1 - t0) / t0:>+9.1%} {(r1 - r0) / r0:>+9.1%} {(s1 - s0) / s0:>+9.1%}")
+
+def segment_coverage(reference, candidates, tol=RECALL_TOL, step=1.0, chunk=4096):
+    """
+    Fraction of the total length of `reference` segments lying within tol of any
+    `candidates` segment (both lists of ((x1, y1), (x2, y2))), sampled every `step` points.
+    """
+    if not reference:
+        return 1.0
+    if not candidates:
+        return 0.0
+
+    samples = []
+    for (x1, y1), (x2, y2) in reference:
+        n = max(2, int(math.hypot(x2 - x1, y2 - y1) / step) + 1)
+        t = np.linspace(0.0, 1.0, n)
+        samples.append(np.stack([x1 + t * (x2 - x1), y1 + t * (y2 - y1)], axis=1))
+    samples = np.concatenate(samples)
+
+    cand = np.asarray(candidates, dtype=np.float64).reshape(-1, 4)
+    a = cand[:, 0:2]
+    ab = cand[:, 2:4] - a
+    ab_len2 = np.maximum(np.sum(ab * ab, axis=1), 1e-12)
+
+    covered = 0
+    for start in range(0, len(samples), chunk):
+        p = samples[start:start + chunk]
+        ap = p[:, None, :] - a[None, :, :]
+        t = np.clip(np.sum(ap * ab[None], axis=2) / ab_len2[None], 0.0, 1.0)
+        closest = a[None] + t[..., None] * ab[None]
+        dist = np.sqrt(np.sum((p[:, None, :] - closest) ** 2, axis=2)).min(axis=1)
+        covered += int(np.count_nonzero(dist <= tol))
+    return covered / len(samples)
+
+def compare_line_modes(pdf_path, input_dir, tile_meta_path, line_dpi=LINE_DPI, strip_height=STRIP_HEIGHT):
+    """
+    Runs tile mode and full-page mode on the same plan and reports runtime,
+    segment counts, and per-page recall/precision of the full-page segments
+    measured against the (stitched) tile-mode segments.
+    """
+    with open(tile_meta_path, 'r', encoding='utf-8') as f:
+        tile_metadata = json.load(f)
+
+    start = time.perf_counter()
+    tasks = collect_tile_tasks(input_dir, tile_metadata)
+    tile_results = []
+    for (image_path, page_idx, *_), (segments, _, _) in zip(tasks, run_tile_tasks(tasks)):
+        tile_results.extend({"page_index": page_idx, "image_path": image_path, "pdf_line": s["pdf_line"]}
+                            for s in segments)
+    tile_results = stitch_line_results(tile_results)
+    tile_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    page_results = stitch_line_results(
+        detect_lines_full_page(pdf_path, line_dpi=line_dpi, strip_height=strip_height))
+    page_time = time.perf_counter() - start
+
+    print(f"tiles (300 DPI tiles): {tile_time:.3f}s, {len(tile_results)} segments")
+    print(f"page ({line_dpi} DPI, strip={strip_height or 'full'}): {page_time:.3f}s, "
+          f"{len(page_results)} segments, speedup {tile_time / page_time if page_time else float('inf'):.2f}x")
+
+    pages = sorted({e["page_index"] for e in tile_results} | {e["page_index"] for e in page_results})
+    for page_idx in pages:
+        ref = [e["pdf_line"] for e in tile_results if e["page_index"] == page_idx]
+        got = [e["pdf_line"] for e in page_results if e["page_index"] == page_idx]
+        print(f"  page {page_idx}: recall={segment_coverage(ref, got):.3f} "
+              f"precision={segment_coverage(got, ref):.3f} (tol={RECALL_TOL}pt)")
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Detect lines in tile images, returning PDF coords.")
     parser.add_argument("input_dir", help="Directory containing page_<idx>/tile_*.png")
     parser.add_argument("tile_meta_path", help="Path to tile_meta.json with x_start,y_start,zoom_factor.")
     parser.add_argument("output_path", help="Path to save final line_detection_results.json.")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help="Worker processes for tile detection (1 = serial).")
+    parser.add_argument("--cv-threads", type=int, default=None,
+                        help="cv2.setNumThreads per worker (defaults to 1 when using a pool).")
+    parser.add_argument("--mode", choices=["tiles", "page"], default="tiles",
+                        help="Detect on the OCR tiles, or on each page rendered once at --line-dpi.")
+    parser.add_argument("--pdf-path", default=None, help="Source PDF (required for --mode page).")
+    parser.add_argument("--line-dpi", type=int, default=LINE_DPI, help="Render DPI for --mode page.")
+    parser.add_argument("--strip-height", type=int, default=STRIP_HEIGHT,
+                        help="Strip height in px for --mode page (0 = whole page).")
+    parser.add_argument("--compare-modes", action="store_true",
+                        help="Compare tile and full-page modes (runtime, recall) instead of writing results.")
+    parser.add_argument("--engine", choices=sorted(LINE_DETECTORS), default=DEFAULT_ENGINE,
+                        help="Line detector engine.")
+    parser.add_argument("--benchmark-engines", action="store_true",
+                        help="Compare speed and segment counts of all engines on these tiles.")
+    parser.add_argument("--mask-text", action="store_true",
+                        help="Blank out OCR and embedded text boxes before line detection.")
+    parser.add_argument("--ocr-path", default=None,
+                        help="OCR results for --mask-text (default: ocr_results.json beside tile_meta).")
+    parser.add_argument("--embedded-path", default=None,
+                        help="Embedded text for --mask-text (default: embedded_text.json beside tile_meta).")
+    parser.add_argument("--compare-masking", action="store_true",
+                        help="Compare segment counts and runtime with and without text masking.")
+    parser.add_argument("--no-stitch", action="store_true",
+                        help="Keep raw per-tile segments instead of merging collinear duplicates.")
+    parser.add_argument("--benchmark", action="store_true",
+                        help="Compare serial and pooled detection on these tiles instead of writing results.")
     args = parser.parse_args()
 
+    results_dir = os.path.dirname(os.path.abspath(args.tile_meta_path))
+    text_paths = [
+        args.ocr_path or os.path.join(results_dir, "ocr_results.json"),
+        args.embedded_path or os.path.join(results_dir, "embedded_text.json"),
+    ]
+
     try:
-        process_line_detection(args.input_dir, args.tile_meta_path, args.output_path)
+        if args.compare_masking:
+            compare_text_masking(args.input_dir, args.tile_meta_path, text_paths, engine=args.engine)
+            sys.exit(0)
+        if args.benchmark:
+            benchmark_line_detection(args.input_dir, args.tile_meta_path,
+                                     worker_counts=sorted({1, 2, args.workers}),
+                                     cv_threads=args.cv_threads if args.cv_threads is not None else 1)
+            sys.exit(0)
+        if args.benchmark_engines:
+            benchmark_engines(args.input_dir, args.tile_meta_path)
+            sys.exit(0)
+        if args.compare_modes:
+            compare_line_modes(args.pdf_path, args.input_dir, args.tile_meta_path,
+                               line_dpi=args.line_dpi, strip_height=args.strip_height)
+            sys.exit(0)
+        process_line_detection(args.input_dir, args.tile_meta_path, args.output_path,
+                               workers=args.workers, cv_threads=args.cv_threads,
+                               stitch=not args.no_stitch, mode=args.mode,
+                               pdf_path=args.pdf_path, line_dpi=args.line_dpi,
+                               strip_height=args.strip_height, engine=args.engine,
+                               text_paths=text_paths if args.mask_text else None)
     except Exception as e:
         print(f"Error during line detection: {e}")
         sys.exit(1)
\ No newline at end of file
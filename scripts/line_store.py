@@ -0,0 +1,292 @@
+import os
+import json
+from typing import Dict, List, Optional
+
+import numpy as np
+
+##############
+# Parameters #
+##############
+
+LINE_STORE_VERSION = 2
+LINE_STORE_SUFFIX = ".lines"   # line_detection_results.json -> line_detection_results.lines/
+WALL_STORE_SUFFIX = ".walls"   # classified_walls.json -> classified_walls.walls/
+WALL_CATEGORIES = ("exterior", "interior")
+
+# Files inside a line store directory (meta.json is written last)
+LINE_INDEX_FILE = "index.npy"            # int64 rows of (page_index, first_line_id, count)
+PAGE_LINES_FILE = "page_{}_lines.npy"    # float32 (count, 4): x1, y1, x2, y2 in PDF points
+PAGE_IMAGES_FILE = "page_{}_images.npy"  # int32 (count,): row in meta["image_paths"], -1 if none
+WALL_IDS_FILE = "{}_ids.npy"             # int32 line ids per wall category
+WALL_PAIRS_FILE = "{}_pairs.npy"         # int32 (M, 2) line ids of the two faces of each wall
+WALL_THICKNESS_FILE = "{}_thickness.npy" # float32 (M,) measured thickness per pair
+
+###########
+# Helpers #
+###########
+
+def line_store_dir(json_path: str) -> str:
+    return os.path.splitext(json_path)[0] + LINE_STORE_SUFFIX
+
+def wall_store_dir(json_path: str) -> str:
+    return os.path.splitext(json_path)[0] + WALL_STORE_SUFFIX
+
+def _source_stamp(path: str) -> Optional[List[int]]:
+    if not os.path.isfile(path):
+        return None
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+def _start_store(store_dir: str) -> str:
+    os.makedirs(store_dir, exist_ok=True)
+    meta_path = os.path.join(store_dir, "meta.json")
+    if os.path.isfile(meta_path):
+        os.remove(meta_path)
+    return meta_path
+
+def _load_meta(store_dir: str) -> Optional[dict]:
+    meta_path = os.path.join(store_dir, "meta.json")
+    if not os.path.isfile(meta_path):
+        return None
+    with open(meta_path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    return meta if meta.get("version") == LINE_STORE_VERSION else None
+
+###############
+# Line table  #
+###############
+
+def write_line_store(results, store_dir: str, source_path: Optional[str] = None):
+    """
+    Writes line entries ({"page_index", "image_path", "pdf_line"}) as columnar
+    float32 arrays, one set per page, plus an index table mapping pages to line ids.
+    Line ids are assigned page by page in ascending page order, keeping the
+    original order within each page.
+
+    :param results: List of line entries as written to line_detection_results.json.
+    :param store_dir: Output directory (see line_store_dir).
+    :param source_path: JSON file the store mirrors; its size/mtime are recorded
+                        so readers can tell when the store is stale.
+    """
+    meta_path = _start_store(store_dir)
+
+    image_paths = []
+    image_ids = {}
+    by_page = {}
+    for entry in results:
+        line = entry.get("pdf_line", [])
+        if len(line) != 2:
+            continue
+        image_path = entry.get("image_path")
+        if image_path is None:
+            image_id = -1
+        elif image_path in image_ids:
+            image_id = image_ids[image_path]
+        else:
+            image_id = image_ids[image_path] = len(image_paths)
+            image_paths.append(image_path)
+        coords, images = by_page.setdefault(entry.get("page_index", 0), ([], []))
+        coords.append((line[0][0], line[0][1], line[1][0], line[1][1]))
+        images.append(image_id)
+
+    index = np.zeros((len(by_page), 3), dtype=np.int64)
+    next_id = 0
+    for row, page_idx in enumerate(sorted(by_page)):
+        coords, images = by_page[page_idx]
+        np.save(os.path.join(store_dir, PAGE_LINES_FILE.format(page_idx)),
+                np.asarray(coords, dtype=np.float32).reshape(-1, 4))
+        np.save(os.path.join(store_dir, PAGE_IMAGES_FILE.format(page_idx)),
+                np.asarray(images, dtype=np.int32))
+        index[row] = (page_idx, next_id, len(coords))
+        next_id += len(coords)
+    np.save(os.path.join(store_dir, LINE_INDEX_FILE), index)
+
+    meta = {
+        "version": LINE_STORE_VERSION,
+        "line_count": next_id,
+        "image_paths": image_paths,
+        "source": _source_stamp(source_path) if source_path else None,
+    }
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+
+class LineTable:
+    """
+    Read-only, memory-mapped view of a line store. Per-page arrays are mapped on
+    first access; line ids index the concatenation of all pages in page order.
+    """
+
+    def __init__(self, store_dir: str):
+        meta = _load_meta(store_dir)
+        if meta is None:
+            raise FileNotFoundError(f"No line store found at: {store_dir}")
+        self.store_dir = store_dir
+        self.source = meta.get("source")
+        self.image_paths = meta["image_paths"]
+        self.index = np.load(os.path.join(store_dir, LINE_INDEX_FILE))
+        self._pages = {int(page): (int(first), int(count)) for page, first, count in self.index}
+        self._mapped = {}
+        self._all = None
+
+    def __len__(self):
+        return int(self.index[:, 2].sum()) if len(self.index) else 0
+
+    def page_indices(self) -> List[int]:
+        return sorted(self._pages)
+
+    def _page_arrays(self, page_idx):
+        if page_idx not in self._mapped:
+            def load(pattern):
+                return np.load(os.path.join(self.store_dir, pattern.format(page_idx)), mmap_mode="r")
+            self._mapped[page_idx] = (load(PAGE_LINES_FILE), load(PAGE_IMAGES_FILE))
+        return self._mapped[page_idx]
+
+    def page_lines(self, page_idx: int) -> np.ndarray:
+        """(count, 4) float32 memmap of x1, y1, x2, y2 for one page."""
+        if page_idx not in self._pages:
+            return np.empty((0, 4), dtype=np.float32)
+        return self._page_arrays(page_idx)[0]
+
+    def page_line_ids(self, page_idx: int) -> np.ndarray:
+        first, count = self._pages.get(page_idx, (0, 0))
+        return np.arange(first, first + count, dtype=np.int64)
+
+    def all_lines(self) -> np.ndarray:
+        """(len(self), 4) array of every line, indexed by line id."""
+        if self._all is None:
+            pages = [self.page_lines(p) for p in self.page_indices()]
+            self._all = np.concatenate(pages) if pages else np.empty((0, 4), dtype=np.float32)
+        return self._all
+
+    def line_pages(self) -> np.ndarray:
+        """Page index of every line id."""
+        return np.repeat(self.index[:, 0], self.index[:, 2])
+
+    def entries(self):
+        """
+        Yields line entries in the JSON shape ({"page_index", "image_path", "pdf_line"}).
+        """
+        for page_idx in self.page_indices():
+            lines, images = self._page_arrays(page_idx)
+            for (x1, y1, x2, y2), image_id in zip(lines.tolist(), images.tolist()):
+                yield {
+                    "page_index": page_idx,
+                    "image_path": self.image_paths[image_id] if image_id >= 0 else None,
+                    "pdf_line": [[x1, y1], [x2, y2]],
+                }
+
+def load_line_table(json_path: str) -> LineTable:
+    """
+    Memory-maps the line store beside json_path, (re)building it from the JSON first
+    if it is missing or older than the JSON. A store without its JSON is used as-is.
+    """
+    store_dir = line_store_dir(json_path)
+    meta = _load_meta(store_dir)
+    source = _source_stamp(json_path)
+
+    if source is None:
+        if meta is None:
+            raise FileNotFoundError(f"Line detection results not found: {json_path}")
+        return LineTable(store_dir)
+
+    if meta is None or meta.get("source") != source:
+        print(f"[DEBUG] Building line store from {json_path}")
+        with open(json_path, "r", encoding="utf-8") as f:
+            results = json.load(f)
+        write_line_store(results, store_dir, source_path=json_path)
+    return LineTable(store_dir)
+
+###############
+# Wall table  #
+###############
+
+def write_wall_store(wall_ids: Dict[str, np.ndarray], lines_dir: str, store_dir: str,
+                     wall_pairs: Optional[Dict[str, tuple]] = None, source_path: Optional[str] = None):
+    """
+    Writes classified walls as int32 line ids into the line store at lines_dir,
+    instead of copying their coordinates. wall_pairs ({category: ((M, 2) line ids,
+    (M,) thickness)}) is stored alongside when given. The line store's source stamp
+    (and source_path's, the classified walls JSON) are recorded, since the ids are
+    only valid for the exact lines they were computed from.
+    """
+    meta_path = _start_store(store_dir)
+    counts = {}
+    for category in WALL_CATEGORIES:
+        ids = np.asarray(wall_ids.get(category, []), dtype=np.int32)
+        np.save(os.path.join(store_dir, WALL_IDS_FILE.format(category)), ids)
+        counts[category] = len(ids)
+        if wall_pairs is not None:
+            pair_ids, thickness = wall_pairs.get(category, (np.empty((0, 2)), np.empty(0)))
+            np.save(os.path.join(store_dir, WALL_PAIRS_FILE.format(category)),
+                    np.asarray(pair_ids, dtype=np.int32).reshape(-1, 2))
+            np.save(os.path.join(store_dir, WALL_THICKNESS_FILE.format(category)),
+                    np.asarray(thickness, dtype=np.float32))
+
+    line_table = LineTable(lines_dir)
+    meta = {
+        "version": LINE_STORE_VERSION,
+        "lines": os.path.relpath(os.path.abspath(lines_dir), os.path.abspath(store_dir)),
+        "line_count": len(line_table),
+        "lines_source": line_table.source,
+        "source": _source_stamp(source_path) if source_path else None,
+        "counts": counts,
+        "has_pairs": wall_pairs is not None,
+    }
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+
+class WallTable:
+    """
+    Memory-mapped classified walls: per-category line ids plus the LineTable they index.
+    pairs holds {category: (line id pairs, thickness)} when the classifier recorded them.
+    """
+
+    def __init__(self, store_dir: str):
+        meta = _load_meta(store_dir)
+        if meta is None:
+            raise FileNotFoundError(f"No wall store found at: {store_dir}")
+        self.lines = LineTable(os.path.normpath(os.path.join(store_dir, meta["lines"])))
+        if len(self.lines) != meta["line_count"] or self.lines.source != meta.get("lines_source"):
+            raise ValueError(f"Wall store {store_dir} does not match its line store (rerun classification).")
+        self.ids = {
+            category: np.load(os.path.join(store_dir, WALL_IDS_FILE.format(category)), mmap_mode="r")
+            for category in WALL_CATEGORIES
+        }
+        self.pairs = None
+        if meta.get("has_pairs"):
+            self.pairs = {
+                category: (
+                    np.load(os.path.join(store_dir, WALL_PAIRS_FILE.format(category)), mmap_mode="r"),
+                    np.load(os.path.join(store_dir, WALL_THICKNESS_FILE.format(category)), mmap_mode="r"),
+                )
+                for category in WALL_CATEGORIES
+            }
+
+    def segments(self, category: str) -> np.ndarray:
+        """(n, 4) x1, y1, x2, y2 of every wall in the category."""
+        return self.lines.all_lines()[np.asarray(self.ids[category])]
+
+def load_wall_table(json_path: str) -> Optional[WallTable]:
+    """
+    Opens the wall store beside json_path, or returns None if there is none or it is
+    stale: json_path or the line detection JSON changed since it was written, or
+    its line store was rebuilt. Callers then read json_path instead.
+    """
+    store_dir = wall_store_dir(json_path)
+    meta = _load_meta(store_dir)
+    if meta is None:
+        return None
+
+    lines_dir = os.path.normpath(os.path.join(store_dir, meta["lines"]))
+    lines_json = lines_dir[:-len(LINE_STORE_SUFFIX)] + ".json"
+    source = _source_stamp(json_path)
+    lines_source = _source_stamp(lines_json)
+    if ((source is not None and meta.get("source") != source)
+            or (lines_source is not None and meta.get("lines_source") != lines_source)):
+        print(f"[DEBUG] Wall store {store_dir} is stale; ignoring it.")
+        return None
+    try:
+        return WallTable(store_dir)
+    except ValueError as e:
+        print(f"[DEBUG] {e}")
+        return None
@@ -2,7 +2,21 @@ import os
 import sys
 import json
 import math
+import time
 import argparse
+import numpy as np
+from shapely import STRtree, linestrings, points
+
+from line_store import load_line_table
+from pipeline_artifacts import load_json, save_json
+
+##############
+# Parameters #
+##############
+
+MAX_DISTANCE = 1000          # Set an appropriate threshold based on document scale
+LINK_ENGINE = "numpy"        # see NEAREST_LINE_ENGINES
+LINK_CHUNK_ELEMENTS = 4_000_000  # max dimension x line distances held at once by the numpy engine
 
 def point_to_line_distance(point, line):
     """
@@ -14,75 +28,184 @@ def point_to_line_distance(point, line):
     denominator = math.sqrt((y2 - y1)**2 + (x2 - x1)**2)
     return numerator / denominator if denominator != 0 else float('inf')
 
-def link_dimensions(categorized_path, lines_path, output_path):
+##########################
+# Nearest line engines   #
+##########################
+
+def nearest_lines_loop(centers, lines):
+    """
+    Reference engine: point_to_line_distance for every center against every line.
+    Returns (line_index, distance) per center; line_index is -1 when there are no lines.
+    """
+    nearest = np.full(len(centers), -1, dtype=np.int64)
+    distances = np.full(len(centers), np.inf)
+    line_list = lines.tolist()
+    for c, center in enumerate(centers.tolist()):
+        for index, flat_line in enumerate(line_list):
+            distance = point_to_line_distance(center, flat_line)
+            if distance < distances[c]:
+                distances[c] = distance
+                nearest[c] = index
+    return nearest, distances
+
+def nearest_lines_numpy(centers, lines, chunk_elements=LINK_CHUNK_ELEMENTS):
+    """
+    Same distance as point_to_line_distance (to the infinite line through each
+    segment), computed for a block of centers against all lines at once.
+    Ties go to the first line, as in the loop.
+    """
+    nearest = np.full(len(centers), -1, dtype=np.int64)
+    distances = np.full(len(centers), np.inf)
+    if len(lines) == 0 or len(centers) == 0:
+        return nearest, distances
+
+    x1, y1, x2, y2 = (lines[:, k] for k in range(4))
+    dy, dx = y2 - y1, x2 - x1
+    cross_a, cross_b = x2 * y1, y2 * x1  # kept apart to add in the loop's order
+    denominator = np.sqrt(dy ** 2 + dx ** 2)
+    degenerate = denominator == 0
+    safe_denominator = np.where(degenerate, 1.0, denominator)
+
+    block = max(1, chunk_elements // len(lines))
+    for start in range(0, len(centers), block):
+        x0 = centers[start:start + block, 0:1]
+        y0 = centers[start:start + block, 1:2]
+        dist = np.abs(dy * x0 - dx * y0 + cross_a - cross_b) / safe_denominator
+        dist[:, degenerate] = np.inf
+        nearest[start:start + block] = np.argmin(dist, axis=1)
+        distances[start:start + block] = dist[np.arange(len(x0)), nearest[start:start + block]]
+    return nearest, distances
+
+def nearest_lines_strtree(centers, lines, max_distance=MAX_DISTANCE):
+    """
+    Queries a shapely STRtree for the nearest segment. Unlike the other engines
+    this measures distance to the segment itself, not its infinite extension,
+    so a far-away line whose extension passes the text no longer wins.
+    """
+    nearest = np.full(len(centers), -1, dtype=np.int64)
+    distances = np.full(len(centers), np.inf)
+    if len(lines) == 0 or len(centers) == 0:
+        return nearest, distances
+
+    tree = STRtree(linestrings(lines.reshape(-1, 2, 2)))
+    (center_idx, line_idx), dist = tree.query_nearest(
+        points(centers), max_distance=max_distance, return_distance=True, all_matches=False
+    )
+    nearest[center_idx] = line_idx
+    distances[center_idx] = dist
+    return nearest, distances
+
+NEAREST_LINE_ENGINES = {
+    "numpy": nearest_lines_numpy,
+    "strtree": nearest_lines_strtree,
+    "loop": nearest_lines_loop,
+}
+
+def link_dimensions(categorized_path, lines_path, output_path, engine=LINK_ENGINE):
     """
-    Links dimension text to the nearest detected lines.
+    Links dimension text to the nearest detected lines on the same page.
     
     :param categorized_path: Path to the categorized text JSON file.
-    :param lines_path: Path to the line detection results JSON file.
+    :param lines_path: Path to the line detection results JSON file (its line store is memory-mapped).
     :param output_path: Path to save the linked dimensions JSON file.
+    :param engine: Nearest line search, a key of NEAREST_LINE_ENGINES.
     """
-    if not os.path.isfile(categorized_path) or not os.path.isfile(lines_path):
-        raise FileNotFoundError("Categorized or line detection results file missing.")
+    if not os.path.isfile(categorized_path):
+        raise FileNotFoundError(f"Categorized results file not found: {categorized_path}")
 
-    with open(categorized_path, 'r', encoding='utf-8') as f:
-        categorized_data = json.load(f)
+    categorized_data = load_json(categorized_path)
 
     try:
-        with open(lines_path, 'r', encoding='utf-8') as f:
-            line_data = json.load(f)
+        line_table = load_line_table(lines_path)
     except json.JSONDecodeError as e:
         raise ValueError(f"Invalid JSON in line detection results: {lines_path}") from e
 
-    linked_results = []
-    MAX_DISTANCE = 1000  # Set an appropriate threshold based on document scale
-
-    for text_entry in categorized_data:
-        if text_entry["category"] != "dimension":
-            continue
-
-        bbox = text_entry["bbox"]
-        center_x = sum(bbox[::2]) / len(bbox[::2])
-        center_y = sum(bbox[1::2]) / len(bbox[1::2])
-        center = (center_x, center_y)
-
-        nearest_line = None
-        min_distance = float('inf')
+    # Group dimension centers by page so each page is searched once
+    dimensions = [entry for entry in categorized_data if entry["category"] == "dimension"]
+    centers = np.array([
+        (sum(e["bbox"][::2]) / len(e["bbox"][::2]), sum(e["bbox"][1::2]) / len(e["bbox"][1::2]))
+        for e in dimensions
+    ], dtype=np.float64).reshape(-1, 2)
+    page_of = [e.get("page_index", 0) for e in dimensions]
 
-        for line_entry in line_data:
-            line = line_entry.get("pdf_line", [])
-            if len(line) == 2 and all(isinstance(pt, list) for pt in line):
-                flat_line = [coord for pt in line for coord in pt]
-                distance = point_to_line_distance(center, flat_line)
+    nearest = np.full(len(dimensions), -1, dtype=np.int64)
+    distances = np.full(len(dimensions), np.inf)
+    page_lines = {}
+    start = time.perf_counter()
+    for page_idx in sorted(set(page_of)):
+        rows = np.array([k for k, p in enumerate(page_of) if p == page_idx], dtype=np.int64)
+        page_lines[page_idx] = np.asarray(line_table.page_lines(page_idx), dtype=np.float64)
+        nearest[rows], distances[rows] = NEAREST_LINE_ENGINES[engine](centers[rows], page_lines[page_idx])
+    print(f"[DEBUG] Searched nearest lines for {len(dimensions)} dimensions "
+          f"in {time.perf_counter() - start:.3f}s (engine={engine})")
 
-                if distance < min_distance:
-                    min_distance = distance
-                    nearest_line = line
+    linked_results = []
+    for k, text_entry in enumerate(dimensions):
+        center = tuple(centers[k].tolist())
+        min_distance = float(distances[k])
 
         # Apply the threshold
-        if nearest_line and min_distance <= MAX_DISTANCE:
+        if nearest[k] >= 0 and min_distance <= MAX_DISTANCE:
+            flat_line = page_lines[page_of[k]][nearest[k]].tolist()
             linked_results.append({
                 **text_entry,
-                "nearest_line": nearest_line,
+                "nearest_line": [flat_line[:2], flat_line[2:]],
                 "distance": min_distance
             })
         else:
             print(f"Dimension '{text_entry['text']}' at {center} has no nearby lines (min_distance={min_distance}).")
 
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(linked_results, f, indent=4)
+    save_json(linked_results, output_path, indent=4)
 
     print(f"Linked dimensions saved to {output_path}")
 
+def benchmark_link_dimensions(line_counts=(2500, 10000, 50000), dimension_count=200,
+                              loop_limit=10000, seed=0):
+    """
+    Times each engine on synthetic pages (random segments on a 612x792 page,
+    dimension centers spread over it) and checks numpy against the loop.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.uniform((0, 0), (612, 792), size=(dimension_count, 2))
+    print(f"{'lines':>7} {'loop (s)':>9} {'numpy (s)':>10} {'strtree (s)':>12} {'numpy==loop':>12}")
+    for n in line_counts:
+        start_pts = rng.uniform((0, 0), (612, 792), size=(n, 2))
+        lines = np.hstack([start_pts, start_pts + rng.uniform(-40, 40, size=(n, 2))])
+
+        timings = {}
+        results = {}
+        for name in ("numpy", "strtree", "loop"):
+            if name == "loop" and n > loop_limit:
+                continue
+            t0 = time.perf_counter()
+            results[name] = NEAREST_LINE_ENGINES[name](centers, lines)
+            timings[name] = time.perf_counter() - t0
+
+        loop_time = f"{timings['loop']:.3f}" if "loop" in timings else "-"
+        same = (str(np.array_equal(results["numpy"][0], results["loop"][0])
+                    and np.array_equal(results["numpy"][1], results["loop"][1]))
+                if "loop" in results else "-")
+        print(f"{n:>7} {loop_time:>9} {timings['numpy']:>10.4f} {timings['strtree']:>12.4f} {same:>12}")
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Link dimensions to detected lines.")
-    parser.add_argument("categorized_path", help="Path to the categorized text JSON file.")
-    parser.add_argument("lines_path", help="Path to the line detection results JSON file.")
-    parser.add_argument("output_path", help="Path to save the linked dimensions JSON file.")
+    parser.add_argument("categorized_path", nargs="?", help="Path to the categorized text JSON file.")
+    parser.add_argument("lines_path", nargs="?", help="Path to the line detection results JSON file.")
+    parser.add_argument("output_path", nargs="?", help="Path to save the linked dimensions JSON file.")
+    parser.add_argument("--engine", choices=sorted(NEAREST_LINE_ENGINES), default=LINK_ENGINE,
+                        help="Nearest line search (strtree measures distance to the segment, not its extension).")
+    parser.add_argument("--benchmark", action="store_true",
+                        help="Compare nearest line engines on synthetic pages and exit.")
     args = parser.parse_args()
 
+    if args.benchmark:
+        benchmark_link_dimensions()
+        sys.exit(0)
+    if not (args.categorized_path and args.lines_path and args.output_path):
+        parser.error("categorized_path, lines_path and output_path are required unless --benchmark is given.")
+
     try:
-        link_dimensions(args.categorized_path, args.lines_path, args.output_path)
+        link_dimensions(args.categorized_path, args.lines_path, args.output_path, engine=args.engine)
     except Exception as e:
         print(f"Error linking dimensions: {e}")
\ No newline at end of file
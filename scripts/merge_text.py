@@ -2,9 +2,13 @@ import os
 import sys
 import json
 import difflib
+from collections import Counter, defaultdict
 from typing import List, Dict, Any, Optional
+import numpy as np
 from spellchecker import SpellChecker
 
+from pipeline_artifacts import load_json, save_json
+
 ##############
 # Parameters #
 ##############
@@ -14,9 +18,14 @@ SIM_THRESHOLD = 0.8       # Text similarity threshold for merging
 ALLOW_PARTIAL_MERGE = True  # If True, combine partial OCR entries
 MAX_HORIZONTAL_GAP = 5.0  # Gap for fusing embedded text
 VERTICAL_THRESHOLD = 3.0  # Allowed vertical difference for same line
+SPELL_ENGINE = "pyspellchecker"  # "pyspellchecker" or "symspell"
+IOU_ENGINE = "numpy"      # "numpy" (batched) or "scalar" (pairwise iou())
+IOU_CHUNK_ELEMENTS = 1_000_000  # Max IoU matrix cells held in memory at once
+COMBINE_IOU_THRESHOLD = 0.6     # Overlap above which OCR entries are combined
 
 project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 DOMAIN_DICTIONARY_PATH = os.path.join(project_root, "scripts", "my_domain_dictionary.txt")
+SYMSPELL_INDEX_DIR = os.path.join(project_root, "data", "cache", "symspell_index")
 
 #####################
 # Debug text = none #
@@ -37,6 +46,7 @@ def debug_check_for_none_text(entries, label=""):
 ############################
 
 spell = SpellChecker()
+symspell_index = None  # set by load_symspell_index() when SPELL_ENGINE == "symspell"
 
 def load_domain_dictionary(dictionary_path: str):
     """
@@ -48,12 +58,29 @@ def load_domain_dictionary(dictionary_path: str):
     else:
         print(f"Domain dictionary not found: {dictionary_path} (continuing without it)")
 
-def advanced_spellcheck(text: str) -> str:
+def load_symspell_index(index_dir: str = SYMSPELL_INDEX_DIR):
+    """
+    Memory-maps the precomputed delete index over the spellchecker's vocabulary
+    (English word list + domain dictionary), building it on first use.
+    Call after load_domain_dictionary so the domain words are included.
+    """
+    global symspell_index
+    from symspell_index import load_or_build_index
+    symspell_index = load_or_build_index(spell.word_frequency.dictionary, index_dir)
+
+def advanced_spellcheck(text: str, engine: str = SPELL_ENGINE) -> str:
     """
-    Runs the text through pyspellchecker, skipping short numeric strings
-    and handling domain-specific caps if needed.
+    Runs the text through pyspellchecker (or the SymSpell index),
+    skipping short numeric strings and handling domain-specific caps if needed.
     Ensures no None value is appended to corrected_tokens.
     """
+    if engine == "symspell":
+        if symspell_index is None:
+            load_symspell_index()
+        correction = symspell_index.correction
+    else:
+        correction = spell.correction
+
     tokens = text.split()
     corrected_tokens = []
 
@@ -65,10 +92,10 @@ def advanced_spellcheck(text: str) -> str:
 
         # handle uppercase
         if token.isupper():
-            guess = spell.correction(token.lower())
+            guess = correction(token.lower())
             corrected = guess.upper() if guess else token
         else:
-            guess = spell.correction(token)
+            guess = correction(token)
             corrected = guess if guess else token
 
         # fallback
@@ -137,6 +164,43 @@ def text_similarity(a: str, b: str) -> float:
     seq = difflib.SequenceMatcher(None, a, b)
     return seq.ratio()
 
+# How many comparisons each tier of bounded_text_similarity settled
+similarity_stats = Counter()
+
+def bounded_text_similarity(a: str, b: str, cutoff: float) -> Optional[float]:
+    """
+    Same value as text_similarity(a, b), but returns None without computing the
+    full ratio when a cheaper upper bound shows it cannot exceed cutoff:
+      1) length bound 2*min(len)/sum(len) (== real_quick_ratio),
+      2) quick_ratio (character multiset overlap),
+      3) full ratio.
+    """
+    similarity_stats["compared"] += 1
+    len_a, len_b = len(a), len(b)
+    if len_a + len_b == 0:
+        similarity_stats["full_ratio"] += 1
+        return 1.0
+
+    if 2.0 * min(len_a, len_b) / (len_a + len_b) <= cutoff:
+        similarity_stats["length_pruned"] += 1
+        return None
+
+    seq = difflib.SequenceMatcher(None, a, b)
+    if seq.quick_ratio() <= cutoff:
+        similarity_stats["quick_pruned"] += 1
+        return None
+
+    similarity_stats["full_ratio"] += 1
+    return seq.ratio()
+
+def log_similarity_stats():
+    compared = similarity_stats["compared"]
+    avoided = similarity_stats["length_pruned"] + similarity_stats["quick_pruned"]
+    if compared:
+        print(f"[DEBUG] Text similarity: {compared} comparisons, {avoided} full ratios avoided "
+              f"(length={similarity_stats['length_pruned']}, quick={similarity_stats['quick_pruned']}), "
+              f"{similarity_stats['full_ratio']} computed")
+
 def iou(bbox_a, bbox_b) -> float:
     x0_a, y0_a, x1_a, y1_a = bbox_a
     x0_b, y0_b, x1_b, y1_b = bbox_b
@@ -158,6 +222,109 @@ def iou(bbox_a, bbox_b) -> float:
         return 0.0
     return inter_area / union_area
 
+#########################
+# Batched IoU (NumPy)   #
+#########################
+
+def iou_pairs(boxes_a, boxes_b, threshold: float, strict: bool = False,
+              chunk_elements: int = IOU_CHUNK_ELEMENTS):
+    """
+    Finds every (i, j) with iou(boxes_a[i], boxes_b[j]) >= threshold (> if strict),
+    using the same arithmetic as iou(). Rows are processed in chunks of at most
+    chunk_elements matrix cells, and each chunk is only compared against the
+    boxes_b whose x-range can intersect it (when a positive IoU is required).
+
+    :return: (rows, cols, values) arrays sorted by row, then col.
+    """
+    a = np.asarray(boxes_a, dtype=np.float64).reshape(-1, 4)
+    b = np.asarray(boxes_b, dtype=np.float64).reshape(-1, 4)
+    empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0))
+    if len(a) == 0 or len(b) == 0:
+        return empty
+
+    col_order = np.argsort(b[:, 0], kind="stable")
+    b = b[col_order]
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    max_width_b = max(0.0, float(np.max(b[:, 2] - b[:, 0])))
+    # iou > 0 needs a non-empty intersection, so x-windows can be pruned
+    prune = threshold > 0 or (strict and threshold == 0)
+
+    row_order = np.argsort(a[:, 0], kind="stable")
+    chunk_rows = max(1, chunk_elements // len(b))
+
+    rows_out, cols_out, vals_out = [], [], []
+    for start in range(0, len(a), chunk_rows):
+        row_idx = row_order[start:start + chunk_rows]
+        chunk = a[row_idx]
+
+        lo, hi = 0, len(b)
+        if prune:
+            lo = int(np.searchsorted(b[:, 0], chunk[:, 0].min() - max_width_b, side="left"))
+            hi = int(np.searchsorted(b[:, 0], chunk[:, 2].max(), side="right"))
+            if lo >= hi:
+                continue
+        window = b[lo:hi]
+
+        inter_w = np.maximum(0, np.minimum(chunk[:, None, 2], window[None, :, 2])
+                             - np.maximum(chunk[:, None, 0], window[None, :, 0]))
+        inter_h = np.maximum(0, np.minimum(chunk[:, None, 3], window[None, :, 3])
+                             - np.maximum(chunk[:, None, 1], window[None, :, 1]))
+        inter_area = inter_w * inter_h
+        area_a = (chunk[:, 2] - chunk[:, 0]) * (chunk[:, 3] - chunk[:, 1])
+        union_area = area_a[:, None] + area_b[None, lo:hi] - inter_area
+        with np.errstate(divide="ignore", invalid="ignore"):
+            values = np.where(union_area == 0, 0.0, inter_area / union_area)
+
+        mask = values > threshold if strict else values >= threshold
+        r, c = np.nonzero(mask)
+        rows_out.append(row_idx[r])
+        cols_out.append(col_order[lo + c])
+        vals_out.append(values[r, c])
+
+    if not rows_out:
+        return empty
+
+    rows = np.concatenate(rows_out)
+    cols = np.concatenate(cols_out)
+    vals = np.concatenate(vals_out)
+    order = np.lexsort((cols, rows))
+    return rows[order], cols[order], vals[order]
+
+def batched_iou_candidates(entries_a: List[Dict], entries_b: List[Dict],
+                           threshold: float, strict: bool = False,
+                           page_default: Any = -1) -> Dict[int, List[tuple]]:
+    """
+    Runs iou_pairs page by page and returns {index_a: [(index_b, iou), ...]},
+    with index_b ascending so callers see candidates in the same order as a
+    linear scan over entries_b. Entries without a bbox are never candidates.
+    """
+    def by_page(entries):
+        pages = defaultdict(list)
+        for idx, e in enumerate(entries):
+            if e.get("bbox") is not None:
+                pages[e.get("page_index", page_default)].append(idx)
+        return pages
+
+    pages_a = by_page(entries_a)
+    pages_b = by_page(entries_b)
+
+    candidates = defaultdict(list)
+    for page, idx_a in pages_a.items():
+        idx_b = pages_b.get(page)
+        if not idx_b:
+            continue
+        rows, cols, vals = iou_pairs(
+            [entries_a[i]["bbox"] for i in idx_a],
+            [entries_b[j]["bbox"] for j in idx_b],
+            threshold, strict=strict
+        )
+        for r, c, v in zip(rows.tolist(), cols.tolist(), vals.tolist()):
+            candidates[idx_a[r]].append((idx_b[c], v))
+
+    for pairs in candidates.values():
+        pairs.sort()
+    return candidates
+
 def choose_better_bbox(bbox_a, bbox_b):
     return [
         min(bbox_a[0], bbox_b[0]),
@@ -173,18 +340,25 @@ def choose_better_bbox(bbox_a, bbox_b):
 def fuse_embedded_and_ocr(embedded_entries: List[Dict],
                           ocr_entries: List[Dict],
                           iou_threshold: float = IOU_THRESHOLD,
-                          sim_threshold: float = SIM_THRESHOLD) -> List[Dict]:
+                          sim_threshold: float = SIM_THRESHOLD,
+                          iou_engine: str = IOU_ENGINE) -> List[Dict]:
     """
     Attempt to unify embedded & OCR entries if bounding boxes overlap significantly
     and text is similar.
     - Prefer embedded text if conflict,
     - Keep OCR's image_path for the fused record.
     - Skip any OCR entries missing 'bbox'.
+    - iou_engine="numpy" finds overlapping pairs per page in batches;
+      "scalar" calls iou() pair by pair.
     """
     fused_results = []
     used_ocr_indices = set()
 
-    for emb in embedded_entries:
+    candidate_map = None
+    if iou_engine == "numpy":
+        candidate_map = batched_iou_candidates(embedded_entries, ocr_entries, iou_threshold)
+
+    for emb_idx, emb in enumerate(embedded_entries):
         # skip if no bounding box
         if "bbox" not in emb:
             fused_results.append(emb)
@@ -193,23 +367,18 @@ def fuse_embedded_and_ocr(embedded_entries: List[Dict],
         best_match_idx = None
         best_score = 0.0
 
-        for i, ocr in enumerate(ocr_entries):
-            # skip if missing bbox
-            if "bbox" not in ocr:
-                continue
-
-            # skip if page mismatch
-            if ocr.get("page_index", -1) != emb.get("page_index", -1):
-                continue
+        if candidate_map is not None:
+            candidates = (i for i, _ in candidate_map.get(emb_idx, ()))
+        else:
+            candidates = scalar_iou_candidates(emb, ocr_entries, iou_threshold)
 
-            # check IOU
-            iou_val = iou(emb["bbox"], ocr["bbox"])
-            if iou_val < iou_threshold:
-                continue
+        for i in candidates:
+            ocr = ocr_entries[i]
 
-            # check text similarity
-            sim = text_similarity(emb["text"], ocr["text"])
-            if sim > best_score:
+            # check text similarity; a candidate only matters if it beats both the
+            # current best (strict >) and the final sim_threshold
+            sim = bounded_text_similarity(emb["text"], ocr["text"], max(best_score, sim_threshold))
+            if sim is not None and sim > best_score:
                 best_score = sim
                 best_match_idx = i
 
@@ -240,20 +409,37 @@ def fuse_embedded_and_ocr(embedded_entries: List[Dict],
 
     return fused_results
 
+def scalar_iou_candidates(emb: Dict, ocr_entries: List[Dict], iou_threshold: float):
+    """
+    Yields indices of OCR entries on the same page whose IoU with emb reaches iou_threshold.
+    """
+    for i, ocr in enumerate(ocr_entries):
+        # skip if missing bbox
+        if "bbox" not in ocr:
+            continue
+
+        # skip if page mismatch
+        if ocr.get("page_index", -1) != emb.get("page_index", -1):
+            continue
+
+        # check IOU
+        if iou(emb["bbox"], ocr["bbox"]) < iou_threshold:
+            continue
+
+        yield i
+
 ####################################
 # Add tile_filename to tile_meta   #
 ####################################
 
 def add_tile_filename_to_meta(tile_meta_path):
-    with open(tile_meta_path, "r", encoding="utf-8") as f:
-        tile_meta_data = json.load(f)
+    tile_meta_data = load_json(tile_meta_path)
 
     for entry in tile_meta_data:
         if "tile_filename" not in entry and "image_path" in entry:
             entry["tile_filename"] = os.path.basename(entry["image_path"])
 
-    with open(tile_meta_path, "w", encoding="utf-8") as f:
-        json.dump(tile_meta_data, f, indent=4)
+    save_json(tile_meta_data, tile_meta_path, indent=4)
 
     print(f"Updated tile_meta.json with tile_filename: {tile_meta_path}")
 
@@ -302,10 +488,16 @@ def assign_tile_to_embedded(embedded_data: List[Dict], tile_meta_data: List[Dict
 # Combine overlapping OCR entries (option) #
 ###########################################
 
-def combine_overlapping_ocr_entries(ocr_entries: List[Dict]) -> List[Dict]:
+def combine_overlapping_ocr_entries(ocr_entries: List[Dict],
+                                    iou_engine: str = IOU_ENGINE) -> List[Dict]:
     combined = []
     used = set()
 
+    pair_map = None
+    if iou_engine == "numpy":
+        pair_map = batched_iou_candidates(ocr_entries, ocr_entries, COMBINE_IOU_THRESHOLD,
+                                          strict=True, page_default=None)
+
     for i, entry_a in enumerate(ocr_entries):
         if i in used:
             continue
@@ -317,19 +509,27 @@ def combine_overlapping_ocr_entries(ocr_entries: List[Dict]) -> List[Dict]:
         best_j = None
         best_iou = 0.0
 
-        for j, entry_b in enumerate(ocr_entries):
-            if j <= i or j in used:
-                continue
-            if "bbox" not in entry_b:
-                continue
+        if pair_map is not None:
+            for j, iou_val in pair_map.get(i, ()):
+                if j <= i or j in used:
+                    continue
+                if iou_val > best_iou:
+                    best_iou = iou_val
+                    best_j = j
+        else:
+            for j, entry_b in enumerate(ocr_entries):
+                if j <= i or j in used:
+                    continue
+                if "bbox" not in entry_b:
+                    continue
 
-            if entry_a.get("page_index") != entry_b.get("page_index"):
-                continue
+                if entry_a.get("page_index") != entry_b.get("page_index"):
+                    continue
 
-            iou_val = iou(entry_a["bbox"], entry_b["bbox"])
-            if iou_val > 0.6 and iou_val > best_iou:
-                best_iou = iou_val
-                best_j = j
+                iou_val = iou(entry_a["bbox"], entry_b["bbox"])
+                if iou_val > COMBINE_IOU_THRESHOLD and iou_val > best_iou:
+                    best_iou = iou_val
+                    best_j = j
 
         if best_j is not None:
             entry_b = ocr_entries[best_j]
@@ -373,7 +573,9 @@ def merge_text(
     embedded_path: str,
     ocr_path: str,
     tile_meta_path: str,
-    output_path: str
+    output_path: str,
+    spell_engine: str = SPELL_ENGINE,
+    iou_engine: str = IOU_ENGINE
 ):
     """
     Merges embedded text and OCR results into a single JSON file, ensuring:
@@ -385,6 +587,8 @@ def merge_text(
     """
     # Load domain dictionary if available
     load_domain_dictionary(DOMAIN_DICTIONARY_PATH)
+    if spell_engine == "symspell":
+        load_symspell_index()
 
     required_files = {
         "embedded_text": embedded_path,
@@ -395,23 +599,17 @@ def merge_text(
         if not os.path.isfile(file):
             raise FileNotFoundError(f"Missing input file: {file} ({key})")
 
-    # Load data
-    with open(embedded_path, "r", encoding="utf-8") as f:
-        embedded_data = json.load(f)
+    # Load data (entries are copied: the steps below edit them in place, and the
+    # loaded lists may be shared with other stages of an in-process run)
+    embedded_data = [dict(e) for e in load_json(embedded_path)]
     debug_check_for_none_text(embedded_data, label="Initial embedded_data")
 
-    with open(ocr_path, "r", encoding="utf-8") as f:
-        ocr_data = json.load(f)
+    ocr_data = [dict(e) for e in load_json(ocr_path)]
     debug_check_for_none_text(ocr_data, label="Initial ocr_data")
 
-    with open(tile_meta_path, "r", encoding="utf-8") as f:
-        tile_meta_data = json.load(f)
-
     # Possibly add tile_filename to tile_meta if missing
     add_tile_filename_to_meta(tile_meta_path)
-    # Reload tile_meta_data after we updated it
-    with open(tile_meta_path, "r", encoding="utf-8") as f:
-        tile_meta_data = json.load(f)
+    tile_meta_data = load_json(tile_meta_path)
 
     # Assign tile references to embedded
     assign_tile_to_embedded(embedded_data, tile_meta_data)
@@ -422,46 +620,58 @@ def merge_text(
 
     # 2) Spellcheck embedded text
     for e in fused_embedded:
-        e["text"] = advanced_spellcheck(e["text"] or "")
+        e["text"] = advanced_spellcheck(e["text"] or "", engine=spell_engine)
     debug_check_for_none_text(fused_embedded, label="fused_embedded after advanced_spellcheck")
 
     # 3) If partial merges are allowed, combine overlapping OCR
     if ALLOW_PARTIAL_MERGE:
-        ocr_data = combine_overlapping_ocr_entries(ocr_data)
+        ocr_data = combine_overlapping_ocr_entries(ocr_data, iou_engine=iou_engine)
         debug_check_for_none_text(ocr_data, label="ocr_data after combine_overlapping_ocr_entries")
 
     # 4) Fuse embedded & OCR by bounding box + text similarity
-    merged_results = fuse_embedded_and_ocr(fused_embedded, ocr_data)
+    similarity_stats.clear()
+    merged_results = fuse_embedded_and_ocr(fused_embedded, ocr_data, iou_engine=iou_engine)
+    log_similarity_stats()
     debug_check_for_none_text(merged_results, label="merged_results after fuse_embedded_and_ocr")
 
     # Save final
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    with open(output_path, "w", encoding="utf-8") as f:
-        json.dump(merged_results, f, indent=2)
+    save_json(merged_results, output_path, indent=2)
 
     print(f"Merged results saved to {output_path}")
 
 if __name__ == "__main__":
-    if len(sys.argv) < 5:
-        print("Usage: python merge_text.py <embedded_path> <ocr_path> <tile_meta_path> <output_path>")
-        sys.exit(1)
+    import argparse
+    import traceback
 
-    embedded_path = os.path.normpath(sys.argv[1])
-    ocr_path = os.path.normpath(sys.argv[2])
-    tile_meta_path = os.path.normpath(sys.argv[3])
-    output_path = os.path.normpath(sys.argv[4])
+    parser = argparse.ArgumentParser(description="Merge embedded text and OCR results.")
+    parser.add_argument("embedded_path", help="Path to embedded_text.json.")
+    parser.add_argument("ocr_path", help="Path to ocr_results.json.")
+    parser.add_argument("tile_meta_path", help="Path to tile_meta.json.")
+    parser.add_argument("output_path", help="Path to save merged_results.json.")
+    parser.add_argument("--spell-engine", choices=["pyspellchecker", "symspell"], default=SPELL_ENGINE,
+                        help="Correction engine for embedded text.")
+    parser.add_argument("--iou-engine", choices=["numpy", "scalar"], default=IOU_ENGINE,
+                        help="Batched NumPy IoU or pairwise iou() for the merge passes.")
+    args = parser.parse_args()
+
+    embedded_path = os.path.normpath(args.embedded_path)
+    ocr_path = os.path.normpath(args.ocr_path)
+    tile_meta_path = os.path.normpath(args.tile_meta_path)
+    output_path = os.path.normpath(args.output_path)
 
     print(f"Running merge_text with arguments:")
     print(f"  Embedded: {embedded_path}")
     print(f"  OCR: {ocr_path}")
     print(f"  Tile Meta: {tile_meta_path}")
     print(f"  Output: {output_path}")
-
-    import traceback
+    print(f"  Spell engine: {args.spell_engine}")
+    print(f"  IoU engine: {args.iou_engine}")
 
     try:
-        merge_text(embedded_path, ocr_path, tile_meta_path, output_path)
+        merge_text(embedded_path, ocr_path, tile_meta_path, output_path,
+                   spell_engine=args.spell_engine, iou_engine=args.iou_engine)
     except Exception as e:
         print("[DEBUG] Caught an exception in merge_text main:")
         traceback.print_exc()
-        sys.exit(1)
\ No newline at end of file
+        sys.exit(1)
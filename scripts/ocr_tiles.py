@@ -4,6 +4,7 @@ import re
 import json
 import argparse
 from util_tile_meta import load_tile_meta_map, tile_coords_to_pdf_bottom_left
+from pipeline_artifacts import save_json
 from mmocr.apis.inferencers.mmocr_inferencer import MMOCRInferencer
 
 def chunk_polygon(flat_list):
@@ -279,8 +280,7 @@ def ocr_tiles(tiles_dir, output_path, tile_meta_path, device="cpu", save_vis=Fal
 
     # 1) Save snippet-level results
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(final_snippets, f, indent=4)
+    save_json(final_snippets, output_path, indent=4)
     print(f"OCR snippet-level results saved to {output_path}")
 
     # 2) Save raw results in a separate file
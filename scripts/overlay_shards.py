@@ -0,0 +1,240 @@
+import os
+import gzip
+import json
+import time
+import shutil
+import argparse
+import tempfile
+from functools import lru_cache
+
+##############
+# Parameters #
+##############
+
+SHARD_VERSION = 1
+SHARD_SUFFIX = ".shards"      # final_overlays.json -> final_overlays.shards/
+SHARD_BY_CHOICES = ("page", "tile")
+SHARD_COMPRESSLEVEL = 6
+SHARD_CACHE_SIZE = 8          # decoded shards kept per reader
+
+def shard_dir_for(output_path):
+    return os.path.splitext(output_path)[0] + SHARD_SUFFIX
+
+def _shard_name(page_idx, tile_idx=None):
+    if tile_idx is None:
+        return f"page_{page_idx}.json.gz"
+    return f"page_{page_idx}_tile_{tile_idx}.json.gz"
+
+##########
+# Writer #
+##########
+
+class OverlayShardWriter:
+    """
+    Writes tile overlays as gzip-compressed JSON shards (one per page or per tile)
+    plus manifest.json listing every tile and the shard that holds it.
+    The manifest is written last by close(), so a partial run has none.
+    """
+
+    def __init__(self, shard_dir, shard_by="page", plan_id=None):
+        if shard_by not in SHARD_BY_CHOICES:
+            raise ValueError(f"shard_by must be one of {SHARD_BY_CHOICES}, got {shard_by!r}")
+        self.shard_dir = shard_dir
+        self.shard_by = shard_by
+        self.plan_id = plan_id
+        self.entries = []
+
+        if os.path.isdir(shard_dir):
+            shutil.rmtree(shard_dir)
+        os.makedirs(shard_dir)
+
+    def _write(self, name, payload):
+        with gzip.open(os.path.join(self.shard_dir, name), "wt", encoding="utf-8",
+                       compresslevel=SHARD_COMPRESSLEVEL) as f:
+            json.dump(payload, f, separators=(",", ":"))
+
+    def add_page(self, page_idx, overlays):
+        """
+        Writes the overlays of one page (a list of tile overlay dicts).
+        """
+        if self.shard_by == "page":
+            name = _shard_name(page_idx)
+            self._write(name, overlays)
+            shards = [(name, position) for position in range(len(overlays))]
+        else:
+            shards = []
+            for overlay in overlays:
+                name = _shard_name(page_idx, overlay.get("tileIndex"))
+                self._write(name, overlay)
+                shards.append((name, None))
+
+        for overlay, (name, position) in zip(overlays, shards):
+            self.entries.append({
+                "pageIndex": page_idx,
+                "tileIndex": overlay.get("tileIndex"),
+                "imagePath": overlay.get("imagePath"),
+                "isBlank": overlay.get("overlayData", {}).get("isBlank", True),
+                "shard": name,
+                "position": position,
+            })
+
+    def close(self):
+        manifest = {
+            "version": SHARD_VERSION,
+            "planId": self.plan_id,
+            "shardBy": self.shard_by,
+            "tiles": self.entries,
+        }
+        with open(os.path.join(self.shard_dir, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+
+##########
+# Reader #
+##########
+
+class ShardedOverlays:
+    """
+    Lazy reader over a shard directory. tiles() only reads the manifest; get()
+    decompresses just the shard holding the requested tile.
+    """
+
+    def __init__(self, shard_dir):
+        with open(os.path.join(shard_dir, "manifest.json"), "r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        self.shard_dir = shard_dir
+        self._by_key = {(t["pageIndex"], t["tileIndex"]): t for t in self.manifest["tiles"]}
+        self._read_shard = lru_cache(maxsize=SHARD_CACHE_SIZE)(self._load_shard)
+
+    def _load_shard(self, name):
+        with gzip.open(os.path.join(self.shard_dir, name), "rt", encoding="utf-8") as f:
+            return json.load(f)
+
+    def tiles(self):
+        """Manifest entries (pageIndex, tileIndex, imagePath, isBlank, ...) in output order."""
+        return self.manifest["tiles"]
+
+    def get(self, page_idx, tile_idx):
+        entry = self._by_key.get((page_idx, tile_idx))
+        if entry is None:
+            raise KeyError(f"No tile {tile_idx} on page {page_idx}")
+        payload = self._read_shard(entry["shard"])
+        return payload if entry["position"] is None else payload[entry["position"]]
+
+    def __iter__(self):
+        for entry in self.tiles():
+            yield self.get(entry["pageIndex"], entry["tileIndex"])
+
+class MonolithicOverlays:
+    """
+    Same interface over a single final_overlays.json; the file is parsed on first use.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._overlays = None
+        self._by_key = None
+
+    def _load(self):
+        if self._overlays is None:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._overlays = json.load(f)
+            self._by_key = {(o.get("pageIndex"), o.get("tileIndex")): o for o in self._overlays}
+        return self._overlays
+
+    def tiles(self):
+        return [{
+            "pageIndex": o.get("pageIndex"),
+            "tileIndex": o.get("tileIndex"),
+            "imagePath": o.get("imagePath"),
+            "isBlank": o.get("overlayData", {}).get("isBlank", True),
+        } for o in self._load()]
+
+    def get(self, page_idx, tile_idx):
+        self._load()
+        if (page_idx, tile_idx) not in self._by_key:
+            raise KeyError(f"No tile {tile_idx} on page {page_idx}")
+        return self._by_key[(page_idx, tile_idx)]
+
+    def __iter__(self):
+        return iter(self._load())
+
+def open_overlays(path):
+    """
+    Opens final overlays for reading. path may be final_overlays.json or its shard
+    directory; shards are preferred when both exist.
+    """
+    shard_dir = path if os.path.isdir(path) else shard_dir_for(path)
+    if os.path.isfile(os.path.join(shard_dir, "manifest.json")):
+        return ShardedOverlays(shard_dir)
+    if os.path.isfile(path):
+        return MonolithicOverlays(path)
+    raise FileNotFoundError(f"No final overlays found at: {path}")
+
+#############
+# Benchmark #
+#############
+
+def benchmark_time_to_first_tile(overlays_path, copies=(1, 20, 100)):
+    """
+    Replicates the tiles of an existing final_overlays.json into larger synthetic
+    plans (copies x pages) and compares time-to-first-tile and time to read one
+    tile from the last page: monolithic JSON vs page shards vs tile shards.
+    """
+    with open(overlays_path, "r", encoding="utf-8") as f:
+        base = json.load(f)
+    page_count = len({o["pageIndex"] for o in base})
+
+    print(f"{'tiles':>7} {'format':>10} {'size (KB)':>10} {'first tile (s)':>15} {'last page (s)':>14}")
+    for n in copies:
+        pages = {}
+        for copy in range(n):
+            for overlay in base:
+                page_idx = copy * page_count + overlay["pageIndex"]
+                tile_idx = sum(len(v) for v in pages.values())
+                pages.setdefault(page_idx, []).append({**overlay, "pageIndex": page_idx, "tileIndex": tile_idx})
+
+        workdir = tempfile.mkdtemp()
+        try:
+            mono_path = os.path.join(workdir, "final_overlays.json")
+            with open(mono_path, "w", encoding="utf-8") as f:
+                json.dump([o for p in sorted(pages) for o in pages[p]], f, indent=2)
+            targets = {"monolithic": (mono_path, os.path.getsize(mono_path))}
+            for shard_by in SHARD_BY_CHOICES:
+                shard_dir = os.path.join(workdir, f"{shard_by}{SHARD_SUFFIX}")
+                writer = OverlayShardWriter(shard_dir, shard_by=shard_by)
+                for page_idx in sorted(pages):
+                    writer.add_page(page_idx, pages[page_idx])
+                writer.close()
+                size = sum(os.path.getsize(os.path.join(shard_dir, f)) for f in os.listdir(shard_dir))
+                targets[shard_by] = (shard_dir, size)
+
+            last = pages[max(pages)][-1]
+            for label, (target, size) in targets.items():
+                start = time.perf_counter()
+                reader = open_overlays(target)
+                first = reader.tiles()[0]
+                reader.get(first["pageIndex"], first["tileIndex"])
+                t_first = time.perf_counter() - start
+
+                start = time.perf_counter()
+                open_overlays(target).get(last["pageIndex"], last["tileIndex"])
+                t_last = time.perf_counter() - start
+                print(f"{sum(len(v) for v in pages.values()):>7} {label:>10} {size / 1024:>10.0f} "
+                      f"{t_first:>15.4f} {t_last:>14.4f}")
+        finally:
+            shutil.rmtree(workdir)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or benchmark sharded overlay output.")
+    parser.add_argument("overlays_path", help="final_overlays.json (or its .shards directory).")
+    parser.add_argument("--benchmark", action="store_true",
+                        help="Compare time-to-first-tile of monolithic vs sharded output on scaled copies.")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark_time_to_first_tile(args.overlays_path)
+    else:
+        reader = open_overlays(args.overlays_path)
+        for entry in reader.tiles():
+            print(f"page {entry['pageIndex']} tile {entry['tileIndex']}: "
+                  f"{'blank' if entry['isBlank'] else 'content'} ({entry.get('shard', 'monolithic')})")
@@ -1,8 +1,13 @@
 import os
 import sys
-import subprocess
+import time
 import logging
+import argparse
+import importlib
+import subprocess
+from contextlib import nullcontext
 from config import get_user_project_path
+from pipeline_artifacts import keep_artifacts_in_memory
 
 # Setup logging
 logging.basicConfig(
@@ -11,12 +16,85 @@ logging.basicConfig(
     handlers=[logging.StreamHandler()]
 )
 
-def pdf_model_conv(uuid, plan_id):
+##############
+# Parameters #
+##############
+
+# "inprocess" imports each stage once and calls it, keeping JSON artifacts in memory;
+# "subprocess" runs each stage script in a fresh interpreter (the fallback)
+PIPELINE_EXECUTOR = os.getenv("PIPELINE_EXECUTOR", "inprocess")
+LABEL_KEYWORDS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "label_keywords.txt")
+
+# Pipeline DAG in run order: stage (script module) -> stages whose outputs it reads
+PIPELINE_STAGES = {
+    "extract_embedded_text": [],
+    "pdf_to_tiles": [],
+    "ocr_tiles": ["pdf_to_tiles"],
+    "merge_text": ["extract_embedded_text", "pdf_to_tiles", "ocr_tiles"],
+    "id_area_scale": ["merge_text"],
+    "categorize_text": ["merge_text"],
+    "line_detection": ["pdf_to_tiles"],
+    "classify_structures": ["line_detection"],
+    "link_dimensions": ["categorize_text", "line_detection"],
+    "assemble_overlay": ["pdf_to_tiles", "categorize_text", "line_detection", "link_dimensions"],
+    "batch_embed_overlays": ["assemble_overlay"],
+}
+
+def categorize_stage(module, run):
+    module.load_label_keywords(LABEL_KEYWORDS_PATH)
+    module.categorize_text(run["paths"]["merged_results"], run["paths"]["categorized_results"])
+
+# Command line of each stage script (subprocess executor), built from the run context
+STAGE_ARGS = {
+    "extract_embedded_text": lambda run: [run["pdf_path"], run["paths"]["embedded_text"]],
+    "pdf_to_tiles": lambda run: [run["pdf_path"], run["results_dir"], "300", "1500"],
+    "ocr_tiles": lambda run: [run["results_dir"], run["paths"]["ocr_results"], run["paths"]["tile_meta"],
+                              "--save-vis"],
+    "merge_text": lambda run: [run["paths"]["embedded_text"], run["paths"]["ocr_results"],
+                               run["paths"]["tile_meta"], run["paths"]["merged_results"]],
+    "id_area_scale": lambda run: [run["paths"]["merged_results"]],
+    "categorize_text": lambda run: [run["paths"]["merged_results"], run["paths"]["categorized_results"]],
+    "line_detection": lambda run: [run["results_dir"], run["paths"]["tile_meta"],
+                                   run["paths"]["line_detection_results"]],
+    "classify_structures": lambda run: [run["paths"]["line_detection_results"], run["paths"]["classified_walls"]],
+    "link_dimensions": lambda run: [run["paths"]["categorized_results"], run["paths"]["line_detection_results"],
+                                    run["paths"]["linked_dimensions"]],
+    "assemble_overlay": lambda run: [run["plan_id"], run["results_dir"], run["paths"]["final_overlays"]],
+    "batch_embed_overlays": lambda run: [run["plan_id"], run["results_dir"]],
+}
+
+# The same steps as in-process calls: (imported stage module, run context) -> None
+STAGE_CALLS = {
+    "extract_embedded_text": lambda m, run: m.extract_embedded_text(run["pdf_path"], run["paths"]["embedded_text"]),
+    "pdf_to_tiles": lambda m, run: m.convert_pdf_to_tiles(run["pdf_path"], run["results_dir"],
+                                                          dpi=300, tile_size=1500),
+    "ocr_tiles": lambda m, run: m.ocr_tiles(run["results_dir"], run["paths"]["ocr_results"],
+                                            run["paths"]["tile_meta"], save_vis=True),
+    "merge_text": lambda m, run: m.merge_text(run["paths"]["embedded_text"], run["paths"]["ocr_results"],
+                                              run["paths"]["tile_meta"], run["paths"]["merged_results"]),
+    "id_area_scale": lambda m, run: m.id_area_scale(run["paths"]["merged_results"]),
+    "categorize_text": categorize_stage,
+    "line_detection": lambda m, run: m.process_line_detection(run["results_dir"], run["paths"]["tile_meta"],
+                                                              run["paths"]["line_detection_results"],
+                                                              workers=m.DEFAULT_WORKERS),
+    "classify_structures": lambda m, run: m.process_classification(run["paths"]["line_detection_results"],
+                                                                   run["paths"]["classified_walls"]),
+    "link_dimensions": lambda m, run: m.link_dimensions(run["paths"]["categorized_results"],
+                                                        run["paths"]["line_detection_results"],
+                                                        run["paths"]["linked_dimensions"]),
+    "assemble_overlay": lambda m, run: m.assemble_overlay(run["plan_id"], run["results_dir"],
+                                                          run["paths"]["final_overlays"]),
+    "batch_embed_overlays": lambda m, run: m.embed_plan_overlays(run["plan_id"], run["results_dir"]),
+}
+
+def pdf_model_conv(uuid, plan_id, executor=PIPELINE_EXECUTOR, stages=None):
     """
     Runs the pipeline:
     1) Accesses the project input directory using uuid and plan_id.
     2) Processes the target PDF.
     3) Saves outputs to data/user/{uuid}/projects/{plan_id}/results/.
+    executor is a key of PIPELINE_EXECUTORS; stages limits the run to those stages
+    (default: all), reading the outputs of the others from their JSON checkpoints.
     """
     logging.info(f"Starting pipeline for '{plan_id}' under user '{uuid}'...")
 
@@ -65,29 +143,100 @@ def pdf_model_conv(uuid, plan_id):
     }
 
     # Step 5: Run pipeline steps
+    run = {"plan_id": plan_id, "pdf_path": pdf_path, "results_dir": results_dir, "paths": paths}
     try:
-        pipeline_steps = [
-            ("extract_embedded_text.py", [pdf_path, paths["embedded_text"]]),
-            ("pdf_to_tiles.py", [pdf_path, results_dir, "300", "1500"]),
-            ("ocr_tiles.py", [results_dir, paths["ocr_results"], paths["tile_meta"], "--save-vis"]),
-            ("merge_text.py", [paths["embedded_text"], paths["ocr_results"], paths["tile_meta"], paths["merged_results"]]),
-            ("id_area_scale.py", [paths["merged_results"]]),
-            ("categorize_text.py", [paths["merged_results"], paths["categorized_results"]]),
-            ("line_detection.py", [results_dir, paths["tile_meta"], paths["line_detection_results"]]),
-            ("classify_structures.py", [paths["line_detection_results"], paths["classified_walls"]]),
-            ("link_dimensions.py", [paths["categorized_results"], paths["line_detection_results"], paths["linked_dimensions"]]),
-            ("assemble_overlay.py", [plan_id, results_dir, paths["final_overlays"]]),
-            ("batch_embed_overlays.py", [plan_id, results_dir]),
-        ]
-
-        for script_name, args in pipeline_steps:
-            run_script(script_name, args)
-
-        logging.info(f"✅ Pipeline completed for '{plan_id}'. Results saved in: {results_dir}")
+        timings = run_pipeline(run, executor=executor, stages=stages)
+        logging.info(f"✅ Pipeline completed for '{plan_id}' in {sum(timings.values()):.1f}s "
+                     f"({executor}). Results saved in: {results_dir}")
 
     except Exception as e:
         logging.error(f"❌ Pipeline failed for '{plan_id}': {e}")
 
+def pipeline_order(stages=None):
+    """
+    Returns stages (default: all) in DAG order; unknown names raise ValueError.
+    """
+    if stages is None:
+        return list(PIPELINE_STAGES)
+    unknown = set(stages) - set(PIPELINE_STAGES)
+    if unknown:
+        raise ValueError(f"Unknown pipeline stages: {sorted(unknown)}")
+    return [stage for stage in PIPELINE_STAGES if stage in stages]
+
+def downstream_stages(stage):
+    """
+    Returns stage and every stage that depends on it, directly or not, in DAG order.
+    """
+    selected = {stage}
+    for name, dependencies in PIPELINE_STAGES.items():
+        if selected.intersection(dependencies):
+            selected.add(name)
+    return pipeline_order(selected)
+
+def run_pipeline(run, executor=PIPELINE_EXECUTOR, stages=None):
+    """
+    Runs stages (default: all) in DAG order and returns {stage: seconds}.
+
+    :param run: Run context: plan_id, pdf_path, results_dir and the artifact paths.
+    :param executor: Key of PIPELINE_EXECUTORS. In-process, JSON artifacts are passed
+                     between stages in memory (see pipeline_artifacts) and a stage
+                     that raises stops the pipeline.
+    :param stages: Stage names to run; the others' outputs are read from their checkpoints.
+    """
+    if executor not in PIPELINE_EXECUTORS:
+        raise ValueError(f"Unknown executor {executor!r}; expected one of {sorted(PIPELINE_EXECUTORS)}")
+    stages = pipeline_order(stages)
+    from_checkpoints = sorted({dep for stage in stages for dep in PIPELINE_STAGES[stage]} - set(stages))
+    if from_checkpoints:
+        logging.info(f"Reading checkpoints of stages not in this run: {from_checkpoints}")
+
+    timings = {}
+    with keep_artifacts_in_memory() if executor == "inprocess" else nullcontext():
+        for stage in stages:
+            start = time.perf_counter()
+            PIPELINE_EXECUTORS[executor](stage, run)
+            timings[stage] = time.perf_counter() - start
+    logging.info("Stage times: " + ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in timings.items()))
+    return timings
+
+def run_stage_subprocess(stage, run):
+    run_script(f"{stage}.py", STAGE_ARGS[stage](run))
+
+def run_stage_inprocess(stage, run):
+    """
+    Imports the stage script (once per process) and calls its entry function.
+    """
+    logging.info(f"▶️ Running {stage} in-process")
+    STAGE_CALLS[stage](importlib.import_module(stage), run)
+    logging.info(f"✅ {stage} completed successfully.")
+
+PIPELINE_EXECUTORS = {
+    "inprocess": run_stage_inprocess,
+    "subprocess": run_stage_subprocess,
+}
+
+def compare_executors(uuid, plan_id, stages=None, executors=("subprocess", "inprocess")):
+    """
+    Runs the pipeline once per executor, each from a fresh interpreter so imports
+    are paid as in production, and prints the wall time of each.
+    """
+    walls = {}
+    for executor in executors:
+        command = [sys.executable, os.path.abspath(__file__), uuid, plan_id, "--executor", executor]
+        if stages:
+            command += ["--stages", *stages]
+        start = time.perf_counter()
+        subprocess.run(command, check=True)
+        walls[executor] = time.perf_counter() - start
+
+    print(f"{'executor':>10} {'wall (s)':>9}")
+    for executor, wall in walls.items():
+        print(f"{executor:>10} {wall:>9.2f}")
+    if "subprocess" in walls and "inprocess" in walls:
+        saved = walls["subprocess"] - walls["inprocess"]
+        print(f"In-process saved {saved:.2f}s ({saved / walls['subprocess']:.0%}) "
+              f"over {len(pipeline_order(stages))} stages")
+
 def run_script(script_name, args):
     """
     Helper function to execute a script.
@@ -108,11 +257,23 @@ def get_script_path(script_name):
     return path
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: python pdf_model_conv.py <uuid> <plan_id>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Run the PDF-to-overlay pipeline for a project.")
+    parser.add_argument("uuid", help="UUID of the user/organization.")
+    parser.add_argument("plan_id", help="Plan ID (the project directory name).")
+    parser.add_argument("--executor", choices=sorted(PIPELINE_EXECUTORS), default=PIPELINE_EXECUTOR,
+                        help="Run stages in this process (JSON passed in memory) or one subprocess per stage.")
+    stage_group = parser.add_mutually_exclusive_group()
+    stage_group.add_argument("--stages", nargs="+", choices=list(PIPELINE_STAGES),
+                             help="Run only these stages; the others' outputs are read from their checkpoints.")
+    stage_group.add_argument("--from-stage", choices=list(PIPELINE_STAGES),
+                             help="Run this stage and every stage downstream of it.")
+    parser.add_argument("--compare-executors", action="store_true",
+                        help="Time the subprocess and in-process executors on this plan and exit.")
+    args = parser.parse_args()
 
-    uuid_arg = sys.argv[1]
-    plan_id_arg = sys.argv[2]
+    stages = downstream_stages(args.from_stage) if args.from_stage else args.stages
+    if args.compare_executors:
+        compare_executors(args.uuid, args.plan_id, stages=stages)
+        sys.exit(0)
 
-    pdf_model_conv(uuid_arg, plan_id_arg)
\ No newline at end of file
+    pdf_model_conv(args.uuid, args.plan_id, executor=args.executor, stages=stages)
\ No newline at end of file
@@ -1,10 +1,11 @@
 import os
 import sys
 import fitz  # PyMuPDF
-import json
 from tqdm import tqdm
 from PIL import Image
 
+from pipeline_artifacts import save_json
+
 def convert_pdf_to_tiles(pdf_path, output_dir, plan_id=None,
                          dpi=300, tile_size=1500,
                          overlap_px=150,
@@ -134,8 +135,7 @@ def convert_pdf_to_tiles(pdf_path, output_dir, plan_id=None,
 
     # Write tile_meta.json
     meta_path = os.path.join(output_dir, "tile_meta.json")
-    with open(meta_path, 'w', encoding='utf-8') as mf:
-        json.dump(tile_metadata, mf, indent=2)
+    save_json(tile_metadata, meta_path, indent=2)
     print(f"Tile metadata saved to {meta_path}")
 
 if __name__ == "__main__":
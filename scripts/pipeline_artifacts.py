@@ -0,0 +1,48 @@
+import os
+import json
+from contextlib import contextmanager
+
+# Absolute path -> JSON artifact, while an in-process pipeline run keeps them in memory
+_artifacts = None
+
+@contextmanager
+def keep_artifacts_in_memory():
+    """
+    While active, JSON artifacts saved with save_json (or read once with load_json)
+    stay in memory, so later stages get them without parsing the file again. The
+    files are still written, as checkpoints for resuming and for other readers.
+
+    Loaded objects are shared between stages: a stage that changes one in place
+    must copy it first, or save it again with save_json.
+    """
+    global _artifacts
+    previous = _artifacts
+    _artifacts = {}
+    try:
+        yield _artifacts
+    finally:
+        _artifacts = previous
+
+def load_json(path):
+    """
+    Returns a JSON artifact: the object a stage saved during this run if artifacts
+    are kept in memory, otherwise (or if it was not saved this run) the file.
+    """
+    key = os.path.abspath(path)
+    if _artifacts is not None and key in _artifacts:
+        return _artifacts[key]
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if _artifacts is not None:
+        _artifacts[key] = data
+    return data
+
+def save_json(data, path, indent=None):
+    """
+    Writes a JSON artifact to path and, if artifacts are kept in memory, keeps
+    data itself for load_json.
+    """
+    if _artifacts is not None:
+        _artifacts[os.path.abspath(path)] = data
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=indent)
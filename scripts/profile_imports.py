@@ -0,0 +1,88 @@
+import os
+import re
+import sys
+import time
+import argparse
+import subprocess
+
+from pdf_model_conv import PIPELINE_STAGES
+
+##############
+# Parameters #
+##############
+
+# Scripts run by pdf_model_conv, in pipeline order
+PIPELINE_SCRIPTS = list(PIPELINE_STAGES)
+TOP_IMPORTS = 3    # heaviest direct imports listed per script
+REPEATS = 3        # fresh interpreters per script; the fastest run is reported
+
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+def parse_importtime(stderr, module_name):
+    """
+    Parses `python -X importtime` output. Returns (cumulative seconds of
+    module_name, [(name, cumulative seconds)] of its direct imports), or
+    (None, []) if the module never finished importing.
+    """
+    children = []
+    for line in stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        cumulative = int(match.group(2)) / 1e6
+        depth = (len(match.group(3)) - 1) // 2
+        name = match.group(4)
+        if depth == 1:
+            children.append((name, cumulative))
+        elif depth == 0:
+            if name == module_name:
+                return cumulative, sorted(children, key=lambda c: c[1], reverse=True)
+            children = []
+    return None, []
+
+def profile_import(module_name, script_dir, repeats=REPEATS):
+    """
+    Imports module_name in fresh interpreters (as the pipeline's subprocesses do)
+    and returns {"wall", "import", "top", "error"} for the fastest run. wall
+    includes interpreter startup; import is the module's own cumulative time.
+    """
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module_name}"],
+                              cwd=script_dir, capture_output=True, text=True)
+        wall = time.perf_counter() - start
+        if proc.returncode != 0:
+            error = proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else f"exit {proc.returncode}"
+            return {"wall": wall, "import": None, "top": [], "error": error}
+        cumulative, children = parse_importtime(proc.stderr, module_name)
+        if best is None or wall < best["wall"]:
+            best = {"wall": wall, "import": cumulative, "top": children, "error": None}
+    return best
+
+def profile_pipeline(scripts=PIPELINE_SCRIPTS, repeats=REPEATS, top=TOP_IMPORTS):
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    print(f"{'script':<24} {'wall (s)':>9} {'import (s)':>11}  heaviest direct imports")
+    total = 0.0
+    for name in scripts:
+        result = profile_import(name, script_dir, repeats)
+        total += result["wall"]
+        if result["error"]:
+            print(f"{name:<24} {result['wall']:>9.2f} {'-':>11}  failed: {result['error']}")
+            continue
+        heaviest = ", ".join(f"{child} {seconds:.2f}s" for child, seconds in result["top"][:top])
+        print(f"{name:<24} {result['wall']:>9.2f} {result['import']:>11.2f}  {heaviest}")
+    print(f"{'total':<24} {total:>9.2f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Profile the cold import time of each pipeline script (python -X importtime).")
+    parser.add_argument("scripts", nargs="*", default=PIPELINE_SCRIPTS,
+                        help="Module names to profile (default: every pipeline script).")
+    parser.add_argument("--repeats", type=int, default=REPEATS,
+                        help="Fresh interpreters per script; the fastest run is reported.")
+    parser.add_argument("--top", type=int, default=TOP_IMPORTS,
+                        help="Heaviest direct imports listed per script.")
+    args = parser.parse_args()
+
+    profile_pipeline([os.path.splitext(s)[0] for s in args.scripts], args.repeats, args.top)
@@ -0,0 +1,271 @@
+import os
+import json
+import string
+import hashlib
+from array import array
+from functools import lru_cache
+from typing import Dict, Optional, Set
+
+import numpy as np
+
+##############
+# Parameters #
+##############
+
+MAX_EDIT_DISTANCE = 2   # Same reach as pyspellchecker's default distance=2
+PREFIX_LENGTH = 7       # Deletes are generated on this many leading chars only
+INDEX_VERSION = 1
+CORRECTION_CACHE_SIZE = 65536
+
+# Files that make up an index directory (meta.json is written last)
+INDEX_FILES = {
+    "keys": "delete_keys.npy",          # uint64, sorted unique hashes of delete strings
+    "offsets": "delete_offsets.npy",    # int64, postings range per key (len(keys) + 1)
+    "postings": "delete_postings.npy",  # uint32, word ids
+    "word_offsets": "word_offsets.npy", # int64, byte range per word in words.npy
+    "words": "words.npy",               # uint8, utf-8 blob of sorted words
+    "freqs": "freqs.npy",               # int64, frequency per word id
+}
+
+###########
+# Helpers #
+###########
+
+def hash_term(term: str) -> int:
+    """
+    Stable 64-bit hash for a delete string (Python's hash() is salted per process).
+    """
+    return int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little")
+
+def generate_deletes(term: str, max_distance: int = MAX_EDIT_DISTANCE) -> Set[str]:
+    """
+    Returns the term plus every string reachable by up to max_distance deletions.
+    """
+    deletes = {term}
+    frontier = {term}
+    for _ in range(max_distance):
+        next_frontier = set()
+        for word in frontier:
+            for i in range(len(word)):
+                next_frontier.add(word[:i] + word[i + 1:])
+        next_frontier -= deletes
+        deletes |= next_frontier
+        frontier = next_frontier
+    return deletes
+
+def edit_distance(a: str, b: str, max_distance: int) -> int:
+    """
+    Optimal string alignment distance (insert, delete, replace, transpose),
+    the same operations pyspellchecker uses to generate candidates.
+    Returns max_distance + 1 as soon as the distance is known to exceed max_distance.
+    """
+    if a == b:
+        return 0
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+
+    prev_prev = None
+    prev = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        row_min = current[0]
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            value = min(prev[j] + 1, current[j - 1] + 1, prev[j - 1] + cost)
+            if (prev_prev is not None and i > 1 and j > 1
+                    and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]):
+                value = min(value, prev_prev[j - 2] + 1)
+            current[j] = value
+            row_min = min(row_min, value)
+        if row_min > max_distance:
+            return max_distance + 1
+        prev_prev, prev = prev, current
+
+    return prev[len(b)] if prev[len(b)] <= max_distance else max_distance + 1
+
+def index_fingerprint(word_frequencies: Dict[str, int],
+                      max_distance: int = MAX_EDIT_DISTANCE,
+                      prefix_length: int = PREFIX_LENGTH) -> str:
+    """
+    Hash of the vocabulary and index parameters, used to detect a stale index on disk.
+    """
+    digest = hashlib.sha1(f"{INDEX_VERSION}:{max_distance}:{prefix_length}".encode("utf-8"))
+    for word in sorted(word_frequencies):
+        digest.update(f"\n{word}\t{word_frequencies[word]}".encode("utf-8"))
+    return digest.hexdigest()
+
+##################
+# Building index #
+##################
+
+def build_index(word_frequencies: Dict[str, int],
+                index_dir: str,
+                max_distance: int = MAX_EDIT_DISTANCE,
+                prefix_length: int = PREFIX_LENGTH,
+                fingerprint: Optional[str] = None):
+    """
+    Precomputes the delete-neighborhood of every word's prefix and writes it to
+    index_dir as flat NumPy arrays, so it can be memory-mapped by SymSpellIndex.
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    meta_path = os.path.join(index_dir, "meta.json")
+    if os.path.isfile(meta_path):
+        os.remove(meta_path)
+
+    words = sorted(word_frequencies)
+
+    key_buffer = array("Q")
+    id_buffer = array("I")
+    for word_id, word in enumerate(words):
+        for term in generate_deletes(word[:prefix_length], max_distance):
+            key_buffer.append(hash_term(term))
+            id_buffer.append(word_id)
+
+    keys = np.frombuffer(key_buffer, dtype=np.uint64)
+    postings = np.frombuffer(id_buffer, dtype=np.uint32)
+    order = np.lexsort((postings, keys))
+    keys = keys[order]
+    postings = postings[order]
+    unique_keys, starts = np.unique(keys, return_index=True)
+    offsets = np.append(starts, len(keys)).astype(np.int64)
+
+    encoded = [w.encode("utf-8") for w in words]
+    word_offsets = np.zeros(len(words) + 1, dtype=np.int64)
+    np.cumsum([len(e) for e in encoded], out=word_offsets[1:])
+    blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    freqs = np.array([word_frequencies[w] for w in words], dtype=np.int64)
+
+    arrays = {
+        "keys": unique_keys,
+        "offsets": offsets,
+        "postings": postings,
+        "word_offsets": word_offsets,
+        "words": blob,
+        "freqs": freqs,
+    }
+    for name, values in arrays.items():
+        np.save(os.path.join(index_dir, INDEX_FILES[name]), values)
+
+    meta = {
+        "version": INDEX_VERSION,
+        "max_edit_distance": max_distance,
+        "prefix_length": prefix_length,
+        "word_count": len(words),
+        "delete_count": int(len(unique_keys)),
+        "longest_word_length": max((len(w) for w in words), default=0),
+        "fingerprint": fingerprint or index_fingerprint(word_frequencies, max_distance, prefix_length),
+    }
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+
+    print(f"[DEBUG] Built SymSpell index ({len(words)} words, {len(unique_keys)} deletes) in {index_dir}")
+
+#################
+# Loading index #
+#################
+
+class SymSpellIndex:
+    """
+    Read-only, memory-mapped delete-neighborhood index.
+    correction() follows SpellChecker.correction(): a known word is returned as-is,
+    otherwise the lowest edit distance wins, then the highest frequency.
+    Frequency ties go to the alphabetically first word (pyspellchecker picks
+    whichever the candidate set yields first, so those can differ).
+    """
+
+    def __init__(self, index_dir: str):
+        with open(os.path.join(index_dir, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+
+        self.max_distance = self.meta["max_edit_distance"]
+        self.prefix_length = self.meta["prefix_length"]
+        self.longest_word_length = self.meta["longest_word_length"]
+
+        def load(name):
+            return np.load(os.path.join(index_dir, INDEX_FILES[name]), mmap_mode="r")
+
+        self._keys = load("keys")
+        self._offsets = load("offsets")
+        self._postings = load("postings")
+        self._word_offsets = load("word_offsets")
+        self._words = load("words")
+        self._freqs = load("freqs")
+
+        self.correction = lru_cache(maxsize=CORRECTION_CACHE_SIZE)(self._correction)
+
+    def word(self, word_id: int) -> str:
+        start = self._word_offsets[word_id]
+        end = self._word_offsets[word_id + 1]
+        return self._words[start:end].tobytes().decode("utf-8")
+
+    def _should_check(self, word: str) -> bool:
+        # Same early-outs as pyspellchecker: lone punctuation, overlong tokens, numbers
+        if len(word) == 1 and word in string.punctuation:
+            return False
+        if len(word) > self.longest_word_length + 3:
+            return False
+        if word == "nan":
+            return True
+        try:
+            float(word)
+            return False
+        except ValueError:
+            return True
+
+    def _candidate_ids(self, word: str) -> Set[int]:
+        if len(self._keys) == 0:
+            return set()
+        terms = generate_deletes(word[:self.prefix_length], self.max_distance)
+        hashes = np.fromiter((hash_term(t) for t in terms), dtype=np.uint64, count=len(terms))
+
+        positions = np.searchsorted(self._keys, hashes)
+        in_range = positions < len(self._keys)
+        positions, hashes = positions[in_range], hashes[in_range]
+        positions = positions[self._keys[positions] == hashes]
+
+        candidate_ids = set()
+        for pos in positions:
+            candidate_ids.update(self._postings[self._offsets[pos]:self._offsets[pos + 1]].tolist())
+        return candidate_ids
+
+    def _correction(self, original: str) -> Optional[str]:
+        word = original.lower()
+        if not self._should_check(word):
+            return original
+
+        best = None  # (distance, -frequency, word)
+        for word_id in self._candidate_ids(word):
+            candidate = self.word(word_id)
+            if abs(len(candidate) - len(word)) > self.max_distance:
+                continue
+            distance = edit_distance(word, candidate, self.max_distance)
+            if distance > self.max_distance:
+                continue
+            key = (distance, -int(self._freqs[word_id]), candidate)
+            if distance == 0:
+                return original
+            if best is None or key < best:
+                best = key
+
+        return best[2] if best else None
+
+def load_or_build_index(word_frequencies: Dict[str, int],
+                        index_dir: str,
+                        max_distance: int = MAX_EDIT_DISTANCE,
+                        prefix_length: int = PREFIX_LENGTH) -> SymSpellIndex:
+    """
+    Memory-maps the index in index_dir, rebuilding it first if it is missing
+    or was built from a different vocabulary.
+    """
+    fingerprint = index_fingerprint(word_frequencies, max_distance, prefix_length)
+    meta_path = os.path.join(index_dir, "meta.json")
+
+    if os.path.isfile(meta_path):
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("fingerprint") == fingerprint:
+            return SymSpellIndex(index_dir)
+        print(f"[DEBUG] SymSpell index at {index_dir} is stale; rebuilding.")
+
+    build_index(word_frequencies, index_dir, max_distance, prefix_length, fingerprint)
+    return SymSpellIndex(index_dir)
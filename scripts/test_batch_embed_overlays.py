@@ -0,0 +1,99 @@
+"""
+Checks of the MongoDB tile writes (bulk_upsert / TileWriter) against mongomock.
+Run with: python scripts/test_batch_embed_overlays.py
+"""
+import unittest
+import mongomock
+from pymongo.errors import BulkWriteError
+from batch_embed_overlays import bulk_upsert, TileWriter, TILE_KEY
+
+DUPLICATE_KEY = 11000
+INTERRUPTED_DUE_TO_REPL_STATE_CHANGE = 11602
+
+def tile_doc(index, created_at="2024-01-01T00:00:00"):
+    return {"planId": "plan", "pageIndex": 0, "tileIndex": index, "imagePath": f"tile_{index}.png",
+            "imageEmbedding": [float(index)] * 4, "createdAt": created_at}
+
+def tile_key(operation):
+    return tuple(operation._filter[field] for field in TILE_KEY)
+
+class FlakyCollection:
+    """
+    Wraps a mongomock collection. Call n of bulk_write fails the operations at the
+    positions in failures[n] ({position: error code}) and applies the others, as an
+    unordered bulk_write does; calls past the end of failures succeed.
+    """
+
+    def __init__(self, collection, failures):
+        self.collection = collection
+        self.failures = failures
+        self.calls = []
+
+    def bulk_write(self, operations, ordered=True):
+        failing = self.failures[len(self.calls)] if len(self.calls) < len(self.failures) else {}
+        self.calls.append([tile_key(operation) for operation in operations])
+        applied = [operation for i, operation in enumerate(operations) if i not in failing]
+        result = self.collection.bulk_write(applied, ordered=ordered) if applied else None
+        if not failing:
+            return result
+        raise BulkWriteError({
+            "writeErrors": [{"index": i, "code": code, "errmsg": f"error {code}"}
+                            for i, code in sorted(failing.items())],
+            "nMatched": result.matched_count if result else 0,
+            "nUpserted": result.upserted_count if result else 0,
+        })
+
+class TileWriteTests(unittest.TestCase):
+
+    def setUp(self):
+        self.collection = mongomock.MongoClient()["ModeledHomes"]["plan_overlays"]
+
+    def test_rerun_keeps_one_doc_per_tile_and_created_at(self):
+        for created_at in ("2024-01-01T00:00:00", "2025-06-01T00:00:00"):
+            writer = TileWriter(self.collection, batch_size=10)
+            for index in range(25):
+                writer.add(tile_doc(index, created_at))
+            writer.close()
+
+        self.assertEqual(self.collection.count_documents({}), 25)
+        self.assertEqual(self.collection.distinct("createdAt"), ["2024-01-01T00:00:00"])
+        self.assertEqual(self.collection.count_documents({"updatedAt": {"$exists": True}}), 25)
+
+    def test_partial_failure_resends_only_failed_docs(self):
+        flaky = FlakyCollection(self.collection, [{2: INTERRUPTED_DUE_TO_REPL_STATE_CHANGE,
+                                                   5: INTERRUPTED_DUE_TO_REPL_STATE_CHANGE}])
+        docs = [tile_doc(index) for index in range(8)]
+
+        counts, failed = bulk_upsert(flaky, docs, retry_delay=0)
+
+        self.assertEqual(failed, [])
+        self.assertEqual(len(flaky.calls), 2)
+        self.assertEqual(flaky.calls[1], [("plan", 0, 2), ("plan", 0, 5)])
+        self.assertEqual(counts["upserted"], 8)
+        self.assertEqual(self.collection.count_documents({}), 8)
+
+    def test_permanent_error_is_not_resent(self):
+        flaky = FlakyCollection(self.collection, [{1: DUPLICATE_KEY}])
+        docs = [tile_doc(index) for index in range(4)]
+
+        counts, failed = bulk_upsert(flaky, docs, retry_delay=0)
+
+        self.assertEqual(len(flaky.calls), 1)
+        self.assertEqual(failed, [docs[1]])
+        self.assertEqual(self.collection.count_documents({}), 3)
+
+    def test_exhausted_retries_raise_on_close(self):
+        flaky = FlakyCollection(self.collection, [{0: INTERRUPTED_DUE_TO_REPL_STATE_CHANGE}] * 10)
+        writer = TileWriter(flaky, batch_size=10, retries=2, retry_delay=0)
+        for index in range(3):
+            writer.add(tile_doc(index))
+
+        with self.assertRaises(RuntimeError) as raised:
+            writer.close()
+
+        self.assertIn("tile_0.png", str(raised.exception))
+        self.assertEqual(len(flaky.calls), 3)
+        self.assertEqual(self.collection.count_documents({}), 2)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,7 +1,8 @@
 # util_tile_meta.py
-import json
 import os
 
+from pipeline_artifacts import load_json
+
 def load_tile_meta_map(tile_meta_path):
     """
     Loads tile_meta.json (a list of dicts) into a dictionary keyed by (page_idx, x_start, y_start).
@@ -9,8 +10,7 @@ def load_tile_meta_map(tile_meta_path):
     if not os.path.isfile(tile_meta_path):
         raise FileNotFoundError(f"Tile metadata file not found: {tile_meta_path}")
 
-    with open(tile_meta_path, "r", encoding="utf-8") as f:
-        tile_meta_list = json.load(f)
+    tile_meta_list = load_json(tile_meta_path)
 
     tile_meta_map = {}
     for meta in tile_meta_list:
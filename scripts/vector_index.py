@@ -0,0 +1,412 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from config import DATA_CACHE
+
+##############
+# Parameters #
+##############
+
+VECTOR_INDEX_VERSION = 1
+VECTOR_INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", os.path.join(DATA_CACHE, "vector_index"))
+FIELDS = {"image": "imageEmbedding", "text": "textEmbedding"}   # index field -> tile doc key
+
+IVF_MIN_VECTORS = 2048     # below this, "ivf" searches fall back to the flat scan
+IVF_LISTS_PER_SQRT = 2     # inverted lists = IVF_LISTS_PER_SQRT * sqrt(vectors)
+IVF_RETRAIN_GROWTH = 2.0   # retrain centroids once the field has grown this much since training
+IVF_NPROBE = 8             # lists scanned per query
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE_PER_LIST = 64
+SCORE_CHUNK_ROWS = 65536   # vectors scored per matrix product
+
+# Files inside the index directory (meta.json is written last)
+SEGMENT_VECTORS_FILE = "{}_{}.npy"        # float32 (n, dim) unit vectors per segment (one plan) and field
+SEGMENT_TILES_FILE = "{}_{}_tiles.npy"    # int64 (n, 2): pageIndex, tileIndex
+SEGMENT_LISTS_FILE = "{}_{}_lists.npy"    # int32 (n,): IVF list of each vector
+CENTROIDS_FILE = "{}_centroids.npy"       # float32 (lists, dim) per field
+
+###########
+# Helpers #
+###########
+
+def segment_name(plan_id: str) -> str:
+    """File-safe segment name for a plan (plan ids may contain spaces, '#', ...)."""
+    return "plan_" + hashlib.sha1(plan_id.encode("utf-8")).hexdigest()[:16]
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """Unit-length rows, so dot product == cosine similarity (as CLIP embeddings are compared)."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1.0, norms)
+
+def top_k(scores: np.ndarray, k: int):
+    """Indices of the k highest scores, best first."""
+    if len(scores) <= k:
+        return np.argsort(-scores, kind="stable")
+    best = np.argpartition(-scores, k - 1)[:k]
+    return best[np.argsort(-scores[best], kind="stable")]
+
+def assign_lists(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Nearest (highest cosine) centroid of every vector."""
+    lists = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), SCORE_CHUNK_ROWS):
+        lists[start:start + SCORE_CHUNK_ROWS] = np.argmax(vectors[start:start + SCORE_CHUNK_ROWS] @ centroids.T, axis=1)
+    return lists
+
+def train_centroids(vectors: np.ndarray, n_lists: int, iterations: int = KMEANS_ITERATIONS, seed: int = 0):
+    """
+    Spherical k-means on a sample of the vectors (KMEANS_SAMPLE_PER_LIST per list).
+    Lists that end up empty are re-seeded from random sample points.
+    """
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(vectors), n_lists * KMEANS_SAMPLE_PER_LIST)
+    sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+    centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+
+    for _ in range(iterations):
+        lists = assign_lists(sample, centroids)
+        order = np.argsort(lists, kind="stable")
+        used, starts = np.unique(lists[order], return_index=True)
+        sums = sample[rng.choice(len(sample), n_lists)]   # rows of empty lists stay re-seeded
+        sums[used] = np.add.reduceat(sample[order], starts)
+        centroids = normalize_rows(sums)
+    return centroids
+
+###############
+# Field index #
+###############
+
+class FieldIndex:
+    """
+    All vectors of one field (image or text) across plans, with an optional IVF
+    layer: vectors grouped into inverted lists by nearest centroid, so a query
+    only scores the lists whose centroids are closest to it.
+    """
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.vectors = np.empty((0, dim), dtype=np.float32)
+        self.tiles = np.empty((0, 2), dtype=np.int64)
+        self.plans = np.empty(0, dtype=np.int32)      # row in VectorIndex.plan_ids
+        self.lists = np.empty(0, dtype=np.int32)
+        self.centroids = None
+        self._order = None                            # row ids sorted by list
+        self._offsets = None                          # start of each list in _order
+
+    def set_rows(self, vectors, tiles, plans, lists, centroids):
+        self.vectors, self.tiles, self.plans, self.lists = vectors, tiles, plans, lists
+        self.centroids = centroids
+        self._order = self._offsets = None
+
+    def _inverted_lists(self):
+        if self._order is None:
+            self._order = np.argsort(self.lists, kind="stable")
+            self._offsets = np.searchsorted(self.lists[self._order], np.arange(len(self.centroids) + 1))
+        return self._order, self._offsets
+
+    def candidates(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        """Row ids in the nprobe lists nearest to the query."""
+        order, offsets = self._inverted_lists()
+        probe = top_k(self.centroids @ query, nprobe)
+        return np.concatenate([order[offsets[l]:offsets[l + 1]] for l in probe])
+
+    def search(self, query: np.ndarray, k: int, method: str = "ivf", nprobe: int = IVF_NPROBE,
+               plan_row: Optional[int] = None):
+        """
+        Returns (row ids, scores) of the k most similar vectors, best first.
+        "ivf" falls back to "flat" until centroids have been trained.
+        """
+        if method == "ivf" and self.centroids is not None:
+            rows = self.candidates(query, nprobe)
+        else:
+            rows = None
+        if plan_row is not None:
+            mask = self.plans == plan_row
+            rows = np.flatnonzero(mask) if rows is None else rows[mask[rows]]
+
+        if rows is None:
+            scores = np.concatenate([self.vectors[start:start + SCORE_CHUNK_ROWS] @ query
+                                     for start in range(0, len(self.vectors), SCORE_CHUNK_ROWS)]
+                                    or [np.empty(0, dtype=np.float32)])
+            best = top_k(scores, k)
+            return best, scores[best]
+        scores = self.vectors[rows] @ query
+        best = top_k(scores, k)
+        return rows[best], scores[best]
+
+################
+# Vector index #
+################
+
+class VectorIndex:
+    """
+    On-disk similarity index over tile embeddings. Each plan is a segment of
+    per-field .npy files, so add_plan writes (or replaces) one plan without
+    rewriting the others. A replaced plan gets a new segment, and the old one is
+    deleted only after meta.json (written last, atomically) points at the new one.
+    Vectors are stored unit-length; scores are cosine similarities.
+    Single writer; fields are loaded into memory on the first search.
+    """
+
+    def __init__(self, index_dir: str = VECTOR_INDEX_DIR):
+        self.index_dir = index_dir
+        self.meta = {"version": VECTOR_INDEX_VERSION, "dim": None, "next_segment": 0, "plans": {}, "trained": {}}
+        meta_path = os.path.join(index_dir, "meta.json")
+        if os.path.isfile(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("version") == VECTOR_INDEX_VERSION:
+                self.meta = meta
+            else:
+                print(f"[DEBUG] Ignoring vector index with version {meta.get('version')} at {index_dir}")
+        self._fields = {}
+
+    def _path(self, pattern, *args):
+        return os.path.join(self.index_dir, pattern.format(*args))
+
+    @property
+    def plan_ids(self) -> List[str]:
+        return list(self.meta["plans"])
+
+    def count(self, field: str) -> int:
+        return sum(plan["counts"].get(field, 0) for plan in self.meta["plans"].values())
+
+    def __len__(self):
+        return sum(self.count(field) for field in FIELDS)
+
+    def field(self, field: str) -> FieldIndex:
+        """The field's vectors across all plans (loaded on first use)."""
+        if field not in self._fields:
+            index = FieldIndex(self.meta["dim"] or 0)
+            parts = {"vectors": [], "tiles": [], "plans": [], "lists": []}
+            for plan_row, plan in enumerate(self.meta["plans"].values()):
+                if not plan["counts"].get(field):
+                    continue
+                segment = plan["segment"]
+                vectors = np.load(self._path(SEGMENT_VECTORS_FILE, segment, field))
+                parts["vectors"].append(vectors)
+                parts["tiles"].append(np.load(self._path(SEGMENT_TILES_FILE, segment, field)))
+                parts["plans"].append(np.full(len(vectors), plan_row, dtype=np.int32))
+                lists_path = self._path(SEGMENT_LISTS_FILE, segment, field)
+                parts["lists"].append(np.load(lists_path) if os.path.isfile(lists_path)
+                                      else np.zeros(len(vectors), dtype=np.int32))
+            if parts["vectors"]:
+                centroids = np.load(self._path(CENTROIDS_FILE, field)) if field in self.meta["trained"] else None
+                index.set_rows(np.concatenate(parts["vectors"]), np.concatenate(parts["tiles"]),
+                               np.concatenate(parts["plans"]), np.concatenate(parts["lists"]), centroids)
+            self._fields[field] = index
+        return self._fields[field]
+
+    def _write_meta(self):
+        tmp_path = os.path.join(self.index_dir, "meta.json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.meta, f, indent=2)
+        os.replace(tmp_path, os.path.join(self.index_dir, "meta.json"))
+        self._fields = {}
+
+    def _remove_segment(self, segment):
+        for field in FIELDS:
+            for pattern in (SEGMENT_VECTORS_FILE, SEGMENT_TILES_FILE, SEGMENT_LISTS_FILE):
+                path = self._path(pattern, segment, field)
+                if os.path.isfile(path):
+                    os.remove(path)
+
+    def add_plan(self, plan_id: str, docs):
+        """
+        Inserts (or replaces) one plan's tiles. docs are tile documents as built by
+        batch_embed_overlays (pageIndex, tileIndex, imageEmbedding, textEmbedding);
+        tiles without an embedding are left out of that field. Once a field is large
+        enough its IVF centroids are (re)trained; otherwise the new vectors are
+        assigned to the existing lists.
+        """
+        os.makedirs(self.index_dir, exist_ok=True)
+        segment = f"{segment_name(plan_id)}_{self.meta['next_segment']}"
+        self.meta["next_segment"] += 1
+
+        counts = {}
+        for field, doc_key in FIELDS.items():
+            rows = [doc for doc in docs if doc.get(doc_key) is not None]
+            if not rows:
+                continue
+            vectors = normalize_rows([doc[doc_key] for doc in rows])
+            if self.meta["dim"] is None:
+                self.meta["dim"] = vectors.shape[1]
+            elif vectors.shape[1] != self.meta["dim"]:
+                raise ValueError(f"{field} embeddings of plan {plan_id} have dim {vectors.shape[1]}, "
+                                 f"index has {self.meta['dim']}")
+            tiles = np.array([(doc.get("pageIndex", -1), doc.get("tileIndex", -1)) for doc in rows],
+                             dtype=np.int64).reshape(-1, 2)
+            np.save(self._path(SEGMENT_VECTORS_FILE, segment, field), vectors)
+            np.save(self._path(SEGMENT_TILES_FILE, segment, field), tiles)
+            if field in self.meta["trained"]:
+                centroids = np.load(self._path(CENTROIDS_FILE, field))
+                np.save(self._path(SEGMENT_LISTS_FILE, segment, field), assign_lists(vectors, centroids))
+            counts[field] = len(vectors)
+
+        previous = self.meta["plans"].pop(plan_id, None)
+        self.meta["plans"][plan_id] = {"segment": segment, "counts": counts}
+        self._write_meta()
+        if previous is not None:
+            self._remove_segment(previous["segment"])
+
+        for field in counts:
+            trained = self.meta["trained"].get(field)
+            if self.count(field) >= IVF_MIN_VECTORS and (not trained or self.count(field) >= trained * IVF_RETRAIN_GROWTH):
+                self.train(field)
+        print(f"[DEBUG] Indexed plan {plan_id}: "
+              + ", ".join(f"{n} {field}" for field, n in counts.items()) + f" vectors ({len(self)} total)")
+
+    def remove_plan(self, plan_id: str):
+        plan = self.meta["plans"].pop(plan_id, None)
+        if plan is not None:
+            self._write_meta()
+            self._remove_segment(plan["segment"])
+
+    def train(self, field: str, n_lists: Optional[int] = None):
+        """Trains IVF centroids for a field and reassigns all of its vectors to them."""
+        index = self.field(field)
+        if len(index.vectors) == 0:
+            return
+        n_lists = n_lists or max(1, int(IVF_LISTS_PER_SQRT * np.sqrt(len(index.vectors))))
+        start = time.perf_counter()
+        centroids = train_centroids(index.vectors, min(n_lists, len(index.vectors)))
+        np.save(self._path(CENTROIDS_FILE, field), centroids)
+        for plan_row, plan in enumerate(self.meta["plans"].values()):
+            rows = index.plans == plan_row
+            if rows.any():
+                np.save(self._path(SEGMENT_LISTS_FILE, plan["segment"], field),
+                        assign_lists(index.vectors[rows], centroids))
+        self.meta["trained"][field] = len(index.vectors)
+        self._write_meta()
+        print(f"[DEBUG] Trained {len(centroids)} {field} lists on {len(index.vectors)} vectors "
+              f"in {time.perf_counter() - start:.2f}s")
+
+    def search(self, query, k: int = 10, field: str = "image", method: str = "ivf",
+               nprobe: int = IVF_NPROBE, plan_id: Optional[str] = None) -> List[Dict]:
+        """
+        Top-k tiles most similar to a query embedding.
+
+        :param query: Query vector (e.g. embed_text() of a search string; CLIP puts
+                      text and images in one space, so text can search either field).
+        :param field: "image" or "text" embeddings of the tiles.
+        :param method: "ivf" (approximate; exact until the field is trained) or "flat" (exact).
+        :param nprobe: IVF lists scanned; more is slower and closer to exact.
+        :param plan_id: Restrict results to one plan.
+        :return: [{"planId", "pageIndex", "tileIndex", "score"}], best first.
+        """
+        if self.count(field) == 0 or (plan_id is not None and plan_id not in self.meta["plans"]):
+            return []
+        index = self.field(field)
+        plan_ids = self.plan_ids
+        query = normalize_rows(np.asarray(query, dtype=np.float32).reshape(1, -1))[0]
+        plan_row = plan_ids.index(plan_id) if plan_id is not None else None
+        rows, scores = index.search(query, k, method=method, nprobe=nprobe, plan_row=plan_row)
+        return [{
+            "planId": plan_ids[index.plans[row]],
+            "pageIndex": int(index.tiles[row, 0]),
+            "tileIndex": int(index.tiles[row, 1]),
+            "score": float(score),
+        } for row, score in zip(rows.tolist(), scores.tolist())]
+
+#############
+# Benchmark #
+#############
+
+def benchmark_index(sizes=(10000, 100000), dim=512, latent_dim=32, queries=200, k=10,
+                    nprobes=(1, 4, 8, 16, 32), seed=0):
+    """
+    Recall@k of IVF against the exact flat scan, and per-query latency, on
+    synthetic unit vectors: clusters in a latent_dim space mapped into dim
+    dimensions (a stand-in for tile embeddings, which have low intrinsic
+    dimension and cluster by drawing type and sheet). Queries are perturbed
+    copies of indexed vectors.
+    """
+    import tempfile
+    import shutil
+
+    rng = np.random.default_rng(seed)
+    print(f"{'vectors':>8} {'method':>10} {'ms/query':>9} {'recall@' + str(k):>10}")
+    for n in sizes:
+        projection = np.linalg.qr(rng.standard_normal((dim, latent_dim)))[0].T
+        centers = rng.standard_normal((max(8, n // 500), latent_dim))
+        latent = centers[rng.integers(len(centers), size=n)] + 0.5 * rng.standard_normal((n, latent_dim))
+        data = normalize_rows(latent @ projection + 0.02 * rng.standard_normal((n, dim)))
+        query_vectors = normalize_rows(data[rng.integers(n, size=queries)]
+                                       + 0.02 * rng.standard_normal((queries, dim)))
+
+        workdir = tempfile.mkdtemp()
+        try:
+            index = VectorIndex(workdir)
+            plans = 10
+            for p in range(plans):
+                rows = range(p * n // plans, (p + 1) * n // plans)
+                index.add_plan(f"plan {p}", [{"pageIndex": 0, "tileIndex": i, "imageEmbedding": data[i]} for i in rows])
+            if "image" not in index.meta["trained"]:
+                index.train("image")
+
+            def run(method, nprobe=IVF_NPROBE):
+                start = time.perf_counter()
+                results = [{(r["planId"], r["tileIndex"]) for r in index.search(q, k, method=method, nprobe=nprobe)}
+                           for q in query_vectors]
+                return results, (time.perf_counter() - start) / queries * 1000
+
+            exact, flat_ms = run("flat")
+            print(f"{n:>8} {'flat':>10} {flat_ms:>9.3f} {1.0:>10.3f}")
+            for nprobe in nprobes:
+                approx, ivf_ms = run("ivf", nprobe)
+                recall = np.mean([len(a & e) / len(e) for a, e in zip(approx, exact)])
+                print(f"{n:>8} {f'ivf/{nprobe}':>10} {ivf_ms:>9.3f} {recall:>10.3f}")
+        finally:
+            shutil.rmtree(workdir)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local similarity search over tile embeddings.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    query_parser = subparsers.add_parser("query", help="Find the tiles most similar to a text query.")
+    query_parser.add_argument("text", help="Search text (embedded with CLIP).")
+    query_parser.add_argument("--field", choices=sorted(FIELDS), default="image",
+                              help="Search the tiles' image or text embeddings.")
+    query_parser.add_argument("-k", type=int, default=10, help="Number of tiles to return.")
+    query_parser.add_argument("--method", choices=["ivf", "flat"], default="ivf")
+    query_parser.add_argument("--nprobe", type=int, default=IVF_NPROBE)
+    query_parser.add_argument("--plan-id", help="Only search this plan.")
+
+    build_parser = subparsers.add_parser("build", help="(Re)index plans from the MongoDB plan_overlays collection.")
+    build_parser.add_argument("plan_ids", nargs="*", help="Plans to index (default: every plan in the collection).")
+
+    subparsers.add_parser("benchmark", help="Recall and latency of IVF vs flat search on synthetic vectors.")
+    parser.add_argument("--index-dir", default=VECTOR_INDEX_DIR, help="Index directory.")
+    args = parser.parse_args()
+
+    if args.command == "benchmark":
+        benchmark_index()
+        sys.exit(0)
+
+    vector_index = VectorIndex(args.index_dir)
+    if args.command == "build":
+        from batch_embed_overlays import get_collection
+        from embedding_codec import decode_embedding_array
+        collection = get_collection()
+        for plan_id in args.plan_ids or collection.distinct("planId"):
+            docs = list(collection.find({"planId": plan_id},
+                                        {"pageIndex": 1, "tileIndex": 1, **{key: 1 for key in FIELDS.values()}}))
+            for doc in docs:
+                for key in FIELDS.values():
+                    doc[key] = decode_embedding_array(doc.get(key))
+            vector_index.add_plan(plan_id, docs)
+    else:
+        from clip_embedding import embed_text
+        query_vector = embed_text(args.text)
+        if query_vector is None:
+            parser.error("query text has no words to embed.")
+        for hit in vector_index.search(query_vector, k=args.k, field=args.field, method=args.method,
+                                       nprobe=args.nprobe, plan_id=args.plan_id):
+            print(f"{hit['score']:.4f}  {hit['planId']}  page {hit['pageIndex']} tile {hit['tileIndex']}")
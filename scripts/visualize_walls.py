@@ -4,6 +4,8 @@ import numpy as np
 import os
 import importlib.util
 
+from line_store import load_wall_table
+
 # Dynamically load config.py
 config_path = os.path.join(os.path.dirname(__file__), "config.py")
 spec = importlib.util.spec_from_file_location("config", config_path)
@@ -39,8 +41,16 @@ def visualize_walls():
     """ Visualizes classified wall segments from JSON data. """
     classified_walls_path, output_image_path = get_paths()
     
-    with open(classified_walls_path, 'r', encoding='utf-8') as f:
-        classified_walls = json.load(f)
+    # Prefer the memory-mapped wall store (line ids into the line table) when present
+    wall_table = load_wall_table(classified_walls_path)
+    if wall_table is not None:
+        classified_walls = {
+            category: [[[x1, y1], [x2, y2]] for x1, y1, x2, y2 in wall_table.segments(category).tolist()]
+            for category in ["exterior", "interior"]
+        }
+    else:
+        with open(classified_walls_path, 'r', encoding='utf-8') as f:
+            classified_walls = json.load(f)
     
     fig, ax = plt.subplots(figsize=(10, 10))
     
@@ -0,0 +1,25 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+##############
+# Parameters #
+##############
+
+# Start method of stage worker pools. Not "fork": the in-process pipeline runs these
+# stages after ocr_tiles has started torch's OpenMP threads, and a forked child of a
+# process with live thread pools can deadlock. "forkserver" forks from a clean server
+# process; "spawn" is the fallback where it is unavailable (Windows).
+POOL_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+# Imported once by the fork server (the first pool starts it), so workers do not each
+# import cv2/numpy/scipy again
+POOL_PRELOAD = ["line_detection", "classify_structures"]
+
+def process_pool(max_workers, **kwargs):
+    """
+    Returns a ProcessPoolExecutor whose workers are started with POOL_START_METHOD.
+    Worker functions and their arguments must be picklable module-level objects.
+    """
+    context = multiprocessing.get_context(POOL_START_METHOD)
+    if POOL_START_METHOD == "forkserver":
+        context.set_forkserver_preload(POOL_PRELOAD)
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=context, **kwargs)